@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+"""Measure the overhead of the executor.
+
+The benchmarks use a synthetic stand-in for `lsst.pipe.tasks` package with
+stub command line tasks, so they do not require the LSST stack.  Results are
+written in JSON format, so they can be compared across commits, e.g.::
+
+    $ python benchmarks/overhead.py -o before.json
+    $ git checkout <commit>
+    $ python benchmarks/overhead.py -o after.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import pyclbr
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executor.commands import IngestCalibs
+from executor.invoker import create_repo
+from executor.mapper import TaskIndex, TaskMapper
+from executor.schema import default, get_validator, validate
+
+
+# Template of the base module of the synthetic package.
+BASE = '''\
+import sys
+
+
+class CmdLineTask(object):
+    _DefaultName = None
+
+    @classmethod
+    def parseAndRun(cls, args=None):
+        return list(sys.argv[1:]) if args is None else list(args)
+'''
+
+# Template of the modules implementing stub tasks.
+MODULE = '''\
+from .base import CmdLineTask
+
+
+class {name}Config(object):
+    pass
+
+
+class {name}Task(CmdLineTask):
+    ConfigClass = {name}Config
+    _DefaultName = '{task}'
+
+    def run(self, dataRef):
+        return self.helper(dataRef)
+
+    def helper(self, dataRef):
+        return dataRef
+
+
+def util{num}(value):
+    return value
+'''
+
+# Tasks a job requires, they must exist in the synthetic package.
+TASKS = {
+    'ingest': 'Ingest',
+    'ingestCalibs': 'IngestCalibs',
+    'processCcd': 'ProcessCcd',
+}
+
+
+def make_package(root, size):
+    """Create a synthetic stand-in for `lsst.pipe.tasks` package.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory the package is created in.
+    size : `int`
+        Number of modules with stub tasks, apart from the ones jobs require.
+    """
+    path = os.path.join(root, 'lsst', 'pipe', 'tasks')
+    os.makedirs(path)
+    for dirname in ('lsst', os.path.join('lsst', 'pipe'),
+                    os.path.join('lsst', 'pipe', 'tasks')):
+        open(os.path.join(root, dirname, '__init__.py'), 'w').close()
+    with open(os.path.join(path, 'base.py'), 'w') as f:
+        f.write(BASE)
+    modules = dict(TASKS)
+    modules.update(('mod{}'.format(i), 'Mod{}'.format(i)) for i in range(size))
+    for num, (task, name) in enumerate(sorted(modules.items())):
+        with open(os.path.join(path, task + '.py'), 'w') as f:
+            f.write(MODULE.format(name=name, task=task, num=num))
+
+
+def use_package(root):
+    """Make the synthetic package in a given directory importable.
+
+    Any previously imported synthetic package is forgotten.
+    """
+    for name in list(sys.modules):
+        if name == 'lsst' or name.startswith('lsst.'):
+            del sys.modules[name]
+    pyclbr._modules.clear()
+    sys.path = [root] + [p for p in sys.path if not p.startswith(SCRATCH)]
+    if hasattr(importlib, 'invalidate_caches'):
+        importlib.invalidate_caches()
+
+
+def make_job(root, calibs, pfn):
+    """Create a job description.
+
+    Parameters
+    ----------
+    root : `str`
+        Location of the input repository.
+    calibs : `int`
+        Number of calibration records.
+    pfn : `str`
+        Physical file name used in all records.
+    """
+    kinds = ['bias', 'dark', 'flat', 'fringe']
+    records = []
+    for i in range(calibs):
+        meta = {
+            'type': kinds[i % len(kinds)],
+            'validity': 999,
+            'ccd': i,
+            'template': 'CALIB/{type}/{ccd:06d}.fits',
+        }
+        records.append({'pfn': pfn, 'meta': meta})
+    return {
+        'task': {'name': 'processCcd', 'args': ['--id', 'visit=1']},
+        'input': {
+            'root': root,
+            'mapper': 'lsst.obs.hsc.HscMapper',
+            'readonly': False,
+            'ingest_mode': 'copy',
+        },
+        'output': {'root': os.path.join(root, 'output')},
+        'data': [{'pfn': pfn, 'meta': {}}],
+        'calibs': records,
+    }
+
+
+def measure(func, repeat, number=1, setup=None):
+    """Time a function.
+
+    Parameters
+    ----------
+    func : callable
+        Function to time.
+    repeat : `int`
+        Number of measurements.
+    number : `int`, optional
+        Number of calls per measurement. Defaults to 1.
+    setup : callable, optional
+        Function called before each measurement, not timed.
+
+    Returns
+    -------
+    `dict`
+        The shortest, median, and the longest time of a single call (in
+        seconds).
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        for _ in range(number):
+            func()
+        times.append((timeit.default_timer() - start) / number)
+    times.sort()
+    return {
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'max': times[-1],
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def bench_mapper(sizes, repeat):
+    """Measure construction of the task mapper against package size."""
+    results = []
+    for size in sizes:
+        root = os.path.join(SCRATCH, 'mapper-{}'.format(size))
+        make_package(root, size)
+        use_package(root)
+        path = os.path.join(root, 'tasks.json')
+
+        def build(rebuild):
+            use_package(root)
+            index = TaskIndex(path, rebuild=rebuild)
+            return TaskMapper(['lsst.pipe.tasks'], index=index)
+
+        for name, func in [
+            ('no index', lambda: TaskMapper(['lsst.pipe.tasks'])),
+            ('cold index', lambda: build(True)),
+            ('warm index', lambda: build(False)),
+        ]:
+            stats = measure(func, repeat, setup=lambda: use_package(root))
+            results.append(record('mapper', stats, modules=size + len(TASKS),
+                                  variant=name))
+    return results
+
+
+def bench_get_task(repeat):
+    """Measure latency of task look ups."""
+    root = os.path.join(SCRATCH, 'get-task')
+    make_package(root, 10)
+    results = []
+
+    def first():
+        use_package(root)
+        return TaskMapper(['lsst.pipe.tasks'], lazy=True)
+
+    mappers = []
+    stats = measure(lambda: mappers[-1].get_task('processCcd'), repeat,
+                    setup=lambda: mappers.append(first()))
+    results.append(record('get_task', stats, variant='first call'))
+
+    mapper = first()
+    mapper.get_task('processCcd')
+    stats = measure(lambda: mapper.get_task('processCcd'), repeat,
+                    number=10000)
+    results.append(record('get_task', stats, variant='cached'))
+    return results
+
+
+def bench_validation(calibs, repeat):
+    """Measure validation of job descriptions."""
+    results = []
+    validator = get_validator(default)
+    for num in calibs:
+        job = make_job(os.path.join(SCRATCH, 'repo'), num, 'calib.fits')
+        number = max(1, 10000 // (num + 1))
+        for name, func in [
+            ('fast path', lambda: validate(job)),
+            ('jsonschema', lambda: validator.validate(job)),
+        ]:
+            stats = measure(func, repeat, number=number)
+            results.append(record('validate', stats, calibs=num,
+                                  variant=name))
+    return results
+
+
+def bench_create_repo(calibs, repeat):
+    """Measure building the command queue for a new repository."""
+    root = os.path.join(SCRATCH, 'create-repo')
+    make_package(root, 10)
+    use_package(root)
+    mapper = TaskMapper(['lsst.pipe.tasks'], special={
+        'ingestImages': ('lsst.pipe.tasks.ingest', 'IngestTask')})
+    results = []
+    for num in calibs:
+        job = make_job(os.path.join(root, 'repo'), num, 'calib.fits')
+        stats = measure(lambda: create_repo(job, mapper),
+                        repeat)
+        results.append(record('create_repo', stats, calibs=num))
+    return results
+
+
+def bench_ingest_calibs(files, size, workers, repeat):
+    """Measure throughput of placing calibration files in a repository."""
+    root = os.path.join(SCRATCH, 'ingest-calibs')
+    os.makedirs(root)
+    pfn = os.path.join(root, 'calib.fits')
+    with open(pfn, 'wb') as f:
+        f.write(os.urandom(size))
+    records = make_job(root, files, pfn)['calibs']
+    repo = os.path.join(root, 'repo')
+    results = []
+    for mode in ('copy', 'hardlink'):
+        for num in workers:
+            cmds = []
+
+            def setup():
+                shutil.rmtree(repo, ignore_errors=True)
+                cmds.append(IngestCalibs(repo, records, workers=num,
+                                         mode=mode))
+
+            stats = measure(lambda: cmds[-1].execute(), repeat, setup=setup)
+            stats['throughput'] = files * size / 1024.0 ** 2 / stats['median']
+            stats['files_per_second'] = files / stats['median']
+            results.append(record('IngestCalibs', stats, files=files,
+                                  size=size, mode=mode, workers=num))
+    return results
+
+
+def bench_startup(repeat):
+    """Measure the latency of a dry run of a job, including startup."""
+    root = os.path.join(SCRATCH, 'startup')
+    make_package(root, 100)
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(root, 'job.json')
+    with open(path, 'w') as f:
+        json.dump(make_job(os.path.join(root, 'repo'), 10, 'calib.fits'), f)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([here, root])
+    index = os.path.join(root, 'tasks.json')
+    execute = [sys.executable, os.path.join(here, 'bin', 'execute'),
+               '--dry-run', '--index', index, path]
+    subprocess.check_call(execute, env=env)
+    results = []
+    for name, argv in [
+        ('interpreter', [sys.executable, '-c', 'pass']),
+        ('dry run', execute),
+    ]:
+        stats = measure(lambda: subprocess.check_call(argv, env=env), repeat)
+        results.append(record('startup', stats, variant=name))
+    return results
+
+
+def record(name, stats, **params):
+    """Create a record describing a benchmark result."""
+    msg = '{:<14} {:<60} {:10.6f} s'
+    desc = ', '.join('{}={}'.format(k, v) for k, v in sorted(params.items()))
+    sys.stderr.write(msg.format(name, desc, stats['median']) + '\n')
+    return {'benchmark': name, 'params': params, 'stats': stats}
+
+
+def describe():
+    """Describe the environment the benchmarks were executed in."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as null:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=here, stderr=null)
+        commit = commit.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def create_parser():
+    """Create command line parser."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', type=str,
+                        help='file to write the results to (JSON), '
+                             'defaults to standard output', default=None)
+    parser.add_argument('-r', '--repeat', type=int,
+                        help='number of measurements', default=5)
+    parser.add_argument('--modules', type=int, nargs='+',
+                        help='sizes of the synthetic package',
+                        default=[10, 100, 1000])
+    parser.add_argument('--calibs', type=int, nargs='+',
+                        help='numbers of calibration records in a job',
+                        default=[10, 1000, 100000])
+    parser.add_argument('--files', type=int,
+                        help='number of calibration files to place',
+                        default=200)
+    parser.add_argument('--size', type=int,
+                        help='size of a calibration file in bytes',
+                        default=1024 ** 2)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        help='numbers of threads placing calibration files',
+                        default=[1, 4])
+    return parser
+
+
+def main(argv):
+    global SCRATCH
+    args = create_parser().parse_args(argv[1:])
+    SCRATCH = tempfile.mkdtemp(prefix='executor-bench')
+    path = list(sys.path)
+    try:
+        results = []
+        results.extend(bench_mapper(args.modules, args.repeat))
+        results.extend(bench_get_task(args.repeat))
+        results.extend(bench_validation(args.calibs, args.repeat))
+        results.extend(bench_create_repo(args.calibs, args.repeat))
+        results.extend(bench_ingest_calibs(args.files, args.size,
+                                           args.workers, args.repeat))
+        results.extend(bench_startup(args.repeat))
+    finally:
+        sys.path = path
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+    report = {'environment': describe(), 'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write('\n')
+    return 0
+
+
+# Scratch directory, set by main().
+SCRATCH = None
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,351 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from .files import checksum, makedirs, new_hash, place
+from .imports import load
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of the least recently used files considered for eviction at once.
+EVICTION_BATCH = 100
+
+
+class CalibCache(object):
+    """Node-local cache of files shared between jobs.
+
+    Files are stored under keys derived from their real paths, sizes, and
+    modification times, so a file is copied to the cache only once as long
+    as it does not change.  Repositories are populated from the cache with
+    hard links, hence placing a cached file in a repository costs virtually
+    nothing.
+
+    When the total size of the cached files exceeds the budget, the least
+    recently used ones are evicted.  Evicting a file does not affect
+    repositories it was linked to.  The sizes of the cached files, the times
+    they were last used, and their total size are kept in an index, an
+    SQLite database in the cache, so neither the files nor the repositories
+    they are linked to are touched to track their use, and the cache is not
+    walked to find the files to evict.  On request, the checksums of the
+    files are computed while they are copied to the cache and kept in the
+    index as well, so a cached file is never read to compute its checksum
+    again.
+
+    The cache can be safely used by many processes at the same time, the
+    access to it is serialized with a lock file.
+
+    Parameters
+    ----------
+    root : `str`
+        Location of the cache.
+    budget : `int`, optional
+        Maximal total size of the cached files in bytes. If None (default),
+        the size of the cache is not limited.
+
+    Attributes
+    ----------
+    hits : `int`
+        Number of requested files which were in the cache.
+    misses : `int`
+        Number of requested files which had to be cached first.
+    evictions : `int`
+        Number of files removed from the cache.
+    """
+
+    def __init__(self, root, budget=None):
+        self.root = os.path.abspath(root)
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.objects = os.path.join(self.root, 'objects')
+        self.tmp = os.path.join(self.root, 'tmp')
+        self.lockfile = os.path.join(self.root, 'lock')
+        self.index = os.path.join(self.root, 'index.sqlite3')
+        self.mutex = threading.Lock()
+        makedirs(self.objects)
+        makedirs(self.tmp)
+        with self._locked(fcntl.LOCK_EX):
+            self._create_index()
+
+    def __repr__(self):
+        tmpl = '{cls}({root!r}, budget={budget})'
+        return tmpl.format(cls=self.__class__.__name__, root=self.root,
+                           budget=self.budget)
+
+    @property
+    def stats(self):
+        """`dict`: Number of cache hits, misses, and evictions."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    @staticmethod
+    def key(filename):
+        """Compute the key a file is stored under.
+
+        Parameters
+        ----------
+        filename : `str`
+            File name.
+
+        Returns
+        -------
+        `str`
+            The key.
+        """
+        st = os.stat(filename)
+        ident = '{}:{}:{!r}'.format(os.path.realpath(filename), st.st_size,
+                                    st.st_mtime)
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """Return the location of a cached file.
+
+        Parameters
+        ----------
+        key : `str`
+            The key the file is stored under.
+
+        Returns
+        -------
+        `str`
+            The location of the file in the cache.
+        """
+        return os.path.join(self.objects, key[:2], key[2:])
+
+    def place(self, src, dst, checksum=False):
+        """Place a file at a given location via the cache.
+
+        If the file is not in the cache, it is copied there first.
+        Then it is linked to the destination (or copied, if the destination
+        is on a different device).
+
+        Parameters
+        ----------
+        src : `str`
+            Source file.
+        dst : `str`
+            Destination, see :func:`executor.files.place`.
+        checksum : `bool`, optional
+            If True, the checksum of the file's content is returned as well.
+            It is computed while the file is copied to the cache, or taken
+            from the index if the file is already there. Defaults to False.
+
+        Returns
+        -------
+        hit : `bool`
+            True if the file was already in the cache, False otherwise.
+        digest : `tuple` of `str` or None
+            The checksum of the file's content and the name of the algorithm
+            it was computed with (see :func:`executor.files.new_hash`), or
+            None if it was not requested.
+        """
+        key = self.key(src)
+        path = self.path(key)
+        with self._locked(fcntl.LOCK_SH):
+            if os.path.exists(path):
+                place(path, dst, mode='hardlink')
+                digest = self._touch(key, path, checksum)
+                self._count('hits')
+                return True, digest
+
+        # Copy the file without holding the lock, so other processes can
+        # use the cache in the meantime.
+        fd, tmp = tempfile.mkstemp(dir=self.tmp)
+        os.close(fd)
+        digest = None
+        try:
+            if checksum:
+                hashed = new_hash()
+                place(src, tmp, mode='copy', digest=hashed)
+                digest = hashed.hexdigest(), hashed.name
+            else:
+                shutil.copy(src, tmp)
+            size = os.path.getsize(tmp)
+            with self._locked(fcntl.LOCK_EX):
+                makedirs(os.path.dirname(path))
+                os.rename(tmp, path)
+                place(path, dst, mode='hardlink')
+                with self._connect() as conn:
+                    self._add(conn, key, size, digest=digest)
+                    if self.budget is not None:
+                        self._evict(conn, keep=key)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._count('misses')
+        return False, digest
+
+    def _touch(self, key, path, digested=False):
+        """Record the use of a cached file.
+
+        Parameters
+        ----------
+        key : `str`
+            The key the file is stored under.
+        path : `str`
+            Location of the file in the cache.
+        digested : `bool`, optional
+            If True, the checksum of the file is returned.  If it is not in
+            the index, e.g. it was not requested when the file was cached, it
+            is computed and added to the index. Defaults to False.
+
+        Returns
+        -------
+        `tuple` of `str` or None
+            The checksum and the name of the algorithm, if requested.
+        """
+        now = time.time()
+        digest = None
+        if digested:
+            with self._connect() as conn:
+                row = conn.execute('SELECT checksum, algorithm FROM objects '
+                                   'WHERE key = ?', (key,)).fetchone()
+            hashed = new_hash()
+            if row is not None and row[0] and row[1] == hashed.name:
+                digest = row[0], row[1]
+            else:
+                checksum(path, digest=hashed)
+                digest = hashed.hexdigest(), hashed.name
+        with self._connect() as conn:
+            if digest is None:
+                conn.execute('UPDATE objects SET used = ? WHERE key = ?',
+                             (now, key))
+            else:
+                conn.execute('UPDATE objects SET used = ?, checksum = ?, '
+                             'algorithm = ? WHERE key = ?',
+                             (now, digest[0], digest[1], key))
+        return digest
+
+    def _create_index(self):
+        """Create the index of the cache, if it does not exist yet.
+
+        Files cached before the index existed are added to it as if they
+        were just used.  Must be called with the exclusive lock held.
+        """
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS objects ('
+                         'key TEXT PRIMARY KEY, '
+                         'size INTEGER NOT NULL, '
+                         'used REAL NOT NULL, '
+                         'checksum TEXT, '
+                         'algorithm TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS objects_used '
+                         'ON objects (used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS usage ('
+                         'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                         'total INTEGER NOT NULL)')
+            if conn.execute('SELECT total FROM usage').fetchone() is not None:
+                return
+            conn.execute('INSERT INTO usage (id, total) VALUES (0, 0)')
+            now = time.time()
+            for dirpath, _, filenames in os.walk(self.objects):
+                prefix = os.path.basename(dirpath)
+                for name in filenames:
+                    size = os.path.getsize(os.path.join(dirpath, name))
+                    self._add(conn, prefix + name, size, used=now)
+
+    @staticmethod
+    def _add(conn, key, size, used=None, digest=None):
+        """Add a cached file to the index, updating the total size.
+
+        Parameters
+        ----------
+        conn : `sqlite3.Connection`
+            Connection to the index.
+        key : `str`
+            The key the file is stored under.
+        size : `int`
+            Size of the file in bytes.
+        used : `float`, optional
+            Time the file was last used. Defaults to the current time.
+        digest : `tuple` of `str`, optional
+            Checksum of the file and the name of the algorithm, if known.
+        """
+        row = conn.execute('SELECT size FROM objects WHERE key = ?',
+                           (key,)).fetchone()
+        previous = row[0] if row is not None else 0
+        value, algorithm = digest if digest is not None else (None, None)
+        conn.execute('INSERT OR REPLACE INTO objects '
+                     '(key, size, used, checksum, algorithm) '
+                     'VALUES (?, ?, ?, ?, ?)',
+                     (key, size, time.time() if used is None else used,
+                      value, algorithm))
+        conn.execute('UPDATE usage SET total = total + ?',
+                     (size - previous,))
+
+    def _evict(self, conn, keep=None):
+        """Remove the least recently used files exceeding the budget.
+
+        Must be called with the exclusive lock held.
+
+        Parameters
+        ----------
+        conn : `sqlite3.Connection`
+            Connection to the index.
+        keep : `str`, optional
+            Key of the file which must not be removed.
+        """
+        total = conn.execute('SELECT total FROM usage').fetchone()[0]
+        while total > self.budget:
+            rows = conn.execute('SELECT key, size FROM objects '
+                                'WHERE key != ? ORDER BY used LIMIT ?',
+                                (keep or '', EVICTION_BATCH)).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.budget:
+                    break
+                path = self.path(key)
+                try:
+                    os.remove(path)
+                except OSError:
+                    if os.path.exists(path):
+                        raise
+                conn.execute('DELETE FROM objects WHERE key = ?', (key,))
+                total -= size
+                self._count('evictions')
+                logger.debug('Evicted \'{}\' from the cache.'.format(path))
+        conn.execute('UPDATE usage SET total = ?', (total,))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Connect to the index, within a single transaction.
+
+        The transaction is committed (or rolled back, if an exception is
+        raised) and the connection is closed on exit.
+        """
+        conn = load('sqlite3').connect(self.index, timeout=60.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, name):
+        """Increase a counter in a thread safe manner."""
+        with self.mutex:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        """Hold a lock on the cache.
+
+        Parameters
+        ----------
+        operation : `int`
+            Either :data:`fcntl.LOCK_SH` or :data:`fcntl.LOCK_EX`.
+        """
+        with open(self.lockfile, 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
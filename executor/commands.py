@@ -1,24 +1,85 @@
 import abc
+import hashlib
 import logging
 import shutil
 import six
 import sys
 import os
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from .files import (MB, checksum, clone_tree, makedirs, move_tree, new_hash,
+                    place, scan, spread)
+from .manifest import Manifest
+from .processes import fork_map
+from .records import chunks, describe, origin, pluck
+from .registry import merge
 
 
 logger = logging.getLogger(__name__)
 
 
+# Maximal number of files processed at once by commands handling many files.
+CHUNK_SIZE = 1000
+
+
 class Command(object):
     """Define a command interface.
+
+    Attributes
+    ----------
+    requires : `list` of `Command`
+        Commands which must be completed before this one is executed.
+    resources : `frozenset` of `str`
+        Names of resources which the command requires exclusive access to.
+        Commands requiring the same resource are never executed concurrently.
+    resumable : `bool`
+        If True, the command is not executed again when the job is resumed
+        and the command was completed before, see :class:`Scheduler`.
+    idempotent : `bool`
+        If False, executing the command again after it was interrupted does
+        not give the same result, e.g. files it already ingested would be
+        ingested twice.
     """
 
     __metaclass__ = abc.ABCMeta
 
+    requires = ()
+    resources = frozenset()
+    resumable = False
+    idempotent = True
+
     @abc.abstractmethod
     def execute(self):
         pass
 
+    def fingerprint(self):
+        """Identify the command.
+
+        Returns
+        -------
+        `str`
+            Hash of the command's type and arguments. Equivalent commands of
+            different runs of the same job have the same fingerprints.
+        """
+        return _digest(self.__class__.__name__, repr(self))
+
+    def after(self, *commands):
+        """Make the command depend on other commands.
+
+        Parameters
+        ----------
+        *commands
+            Commands which must be completed before this one is executed.
+
+        Returns
+        -------
+        `Command`
+            The command itself.
+        """
+        self.requires = list(self.requires) + list(commands)
+        return self
+
 
 class InitRepo(Command):
     """Initialize a data butler repository at a given location.
@@ -38,6 +99,8 @@ class InitRepo(Command):
         If a dataset repository already exists at specified location.
     """
 
+    resumable = True
+
     def __init__(self, path, mapper, mapper_file='_mapper'):
         self.path = path
         self.mapper_file = os.path.join(self.path, mapper_file)
@@ -62,6 +125,80 @@ class InitRepo(Command):
             f.write(self.mapper_type + '\n')
 
 
+class CloneRepo(Command):
+    """Clone a butler repository.
+
+    Files are hard linked (or copied, if it is not possible) to the clone
+    except registries, which are always copied.
+
+    Parameters
+    ----------
+    src : `str`
+        Location of the repository to clone.
+    dst : `str`
+        Location of the clone.
+    atomic : `bool`, optional
+        If True, the repository is cloned to a temporary location first and
+        then moved to the destination, so the clone is never seen incomplete.
+        If the destination was created in the meantime, e.g. by another
+        process, the clone is discarded. Defaults to False.
+
+    Raises
+    ------
+    ValueError
+        If a dataset repository already exists at the destination and the
+        cloning is not atomic.
+    """
+
+    resumable = True
+
+    def __init__(self, src, dst, atomic=False):
+        self.src = os.path.abspath(src)
+        self.path = os.path.abspath(dst)
+        self.atomic = atomic
+
+    def __repr__(self):
+        tmpl = '{cmd}({src!r}, {dst!r}, atomic={atomic})'
+        return tmpl.format(cmd=self.__class__.__name__, src=self.src,
+                           dst=self.path, atomic=self.atomic)
+
+    def __str__(self):
+        tmpl = 'clone {src} to {dst}'
+        return tmpl.format(src=self.src, dst=self.path)
+
+    def execute(self):
+        start = time.time()
+        if not self.atomic:
+            if os.path.exists(self.path):
+                msg = 'Dataset repository exists at \'{}\''.format(self.path)
+                logger.error(msg)
+                raise ValueError(msg)
+            clone_tree(self.src, self.path)
+        else:
+            if os.path.exists(self.path):
+                logger.info('Repository \'{}\' already exists; '
+                            'skipping.'.format(self.path))
+                return
+            makedirs(os.path.dirname(self.path))
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(self.path),
+                                   prefix='.clone')
+            try:
+                clone = os.path.join(tmp, 'repo')
+                clone_tree(self.src, clone)
+                try:
+                    os.rename(clone, self.path)
+                except OSError:
+                    if not os.path.isdir(self.path):
+                        raise
+                    logger.info('Repository \'{}\' created concurrently; '
+                                'discarding the clone.'.format(self.path))
+                    return
+            finally:
+                shutil.rmtree(tmp)
+        logger.info('Cloned \'{}\' to \'{}\' in {:.2f} s.'
+                    .format(self.src, self.path, time.time() - start))
+
+
 class IngestCalibs(Command):
     """Ingest calibration files to a butler repository.
 
@@ -74,8 +211,9 @@ class IngestCalibs(Command):
     ----------
     path : `str`
         Location of the butler repository.
-    records : `list` of `dict`
-        Records describing files to ingest. Each record should contain at
+    records : iterable of `dict`
+        Records describing files to ingest, e.g. a list or
+        a :class:`executor.records.RecordStream`. Each record should contain at
         least two fields:
 
         * **pfn**: physical file name,
@@ -91,34 +229,360 @@ class IngestCalibs(Command):
                 'meta': {
                     'date': '2013-11-03',
                     'ccd': 4,
-                    'template': 'BIAS/{date:s}/NONE/BIAS-{date:s}-{ccd:03d}.fits'
+                    'template': 'BIAS/{date:s}/NONE/'
+                                'BIAS-{date:s}-{ccd:03d}.fits'
                 }
             }
 
+    workers : `int`, optional
+        Number of files placed concurrently. Defaults to 1.
+    mode : {'copy', 'hardlink', 'symlink', 'reflink'}, optional
+        Method of placing the files in the repository, see
+        :func:`executor.files.place`. Defaults to 'copy'.
+    cache : `executor.cache.CalibCache`, optional
+        Cache of calibration files shared between jobs. If specified, files
+        are placed in the repository via the cache, i.e. hard linked from it,
+        and `mode` is ignored.
+    manifest : `executor.manifest.Manifest`, optional
+        Manifest of the repository. If specified, files are recorded in it
+        before they are placed and their sizes, modification times, and
+        checksums once they are placed.  Files it lists as placed by an
+        earlier, interrupted execution are not placed again.
+
+    Attributes
+    ----------
+    stats : `dict`
+        Number of placed files, their total size (in bytes), time it took
+        (in seconds), the throughput (in MB/s), and the number of files
+        found in the cache. Available after the command was executed.
     """
 
-    def __init__(self, path, records):
+    resumable = True
+
+    def __init__(self, path, records, workers=1, mode='copy', cache=None,
+                 manifest=None):
         self.records = [records] if isinstance(records, dict) else records
         self.path = os.path.abspath(path)
+        self.workers = workers
+        self.mode = mode
+        self.cache = cache
+        self.manifest = manifest
+        self.stats = None
 
     def __repr__(self):
-        tmpl = '{cmd}({path!r}, records={recs})'
+        tmpl = '{cmd}({path!r}, records={recs}, workers={num}, mode={mode!r})'
         return tmpl.format(cmd=self.__class__.__name__, path=self.path,
-                           recs=self.records)
+                           recs=self.records, num=self.workers, mode=self.mode)
+
+    def __str__(self):
+        tmpl = '{mode} {recs} to {path}'
+        return tmpl.format(mode=self.mode,
+                           recs=describe(self.records, 'calibration file(s)'),
+                           path=self.path)
+
+    def fingerprint(self):
+        return _digest(self.__class__.__name__, self.path)
 
     def execute(self):
-        for rec in self.records:
-            meta = rec['meta']
-            subpath = meta['template'].format(**meta)
-            dest = os.path.join(self.path, subpath)
-            if not os.path.exists(os.path.dirname(dest)):
-                os.makedirs(os.path.dirname(dest))
-            shutil.copy(rec['pfn'], dest)
+        start = time.time()
+        count, total, cached, kept = 0, 0, 0, 0
+        created = set()
+        pool = ThreadPool(max(1, self.workers))
+        try:
+            for chunk in chunks(self.records, CHUNK_SIZE):
+                pairs = []
+                for rec in chunk:
+                    meta = rec['meta']
+                    subpath = meta['template'].format(**meta)
+                    dst = os.path.join(self.path, subpath)
+                    pairs.append((rec['pfn'], dst))
+                if self.manifest is not None:
+                    pairs, placed = self._resume(pairs)
+                    kept += placed
+                    self.manifest.expect(pairs)
+
+                # Create required directories before placing the files so
+                # threads placing them do not have to check if they exist.
+                dirnames = set(os.path.dirname(dst) for _, dst in pairs)
+                for dirname in sorted(dirnames - created):
+                    makedirs(dirname)
+                created.update(dirnames)
+
+                results = pool.map(self._place, pairs)
+                count += len(pairs)
+                total += sum(size for size, _, _ in results)
+                cached += sum(1 for _, hit, _ in results if hit)
+                if self.manifest is not None:
+                    self.manifest.confirm(entry for _, _, entry in results)
+        finally:
+            pool.close()
+            pool.join()
+
+        duration = time.time() - start
+        self.stats = {
+            'files': count,
+            'bytes': total,
+            'elapsed': duration,
+            'throughput': total / MB / duration if duration > 0 else 0.0,
+            'cached': cached
+        }
+        msg = 'Placed {files} calibration file(s), {size:.1f} MB ' \
+              'in {elapsed:.2f} s ({throughput:.1f} MB/s)'
+        if self.cache is not None:
+            msg += ', {cached} found in the cache'
+        logger.info((msg + '.').format(size=total / MB, **self.stats))
+        if kept:
+            logger.info('{} calibration file(s) placed earlier; skipped.'
+                        .format(kept))
+
+    def _resume(self, pairs):
+        """Skip files placed by an earlier execution.
+
+        Files the manifest lists as placed are skipped if they are still in
+        the repository and have the recorded size.  Leftovers of the other
+        recorded files, which may be incomplete, are removed.
+
+        Parameters
+        ----------
+        pairs : `list` of `tuple` of `str`
+            Sources and destinations of the files.
+
+        Returns
+        -------
+        `list` of `tuple` of `str`
+            Sources and destinations of the files which must be placed.
+        `int`
+            Number of skipped files.
+        """
+        known = self.manifest.lookup(dst for _, dst in pairs)
+        if not known:
+            return pairs, 0
+        remaining = []
+        for src, dst in pairs:
+            rec = known.get(dst)
+            if rec is not None:
+                if rec['state'] == 'done' and rec['pfn'] == src:
+                    try:
+                        if os.path.getsize(dst) == rec['size']:
+                            continue
+                    except OSError:
+                        pass
+                if os.path.lexists(dst):
+                    os.remove(dst)
+            remaining.append((src, dst))
+        return remaining, len(pairs) - len(remaining)
+
+    def _place(self, pair):
+        """Place a file in the repository.
+
+        Parameters
+        ----------
+        pair : `tuple` of `str`
+            Source and destination of the file.
+
+        Returns
+        -------
+        `int`
+            Size of the file in bytes.
+        `bool`
+            True if the file was found in the cache.
+        `tuple` or None
+            Entry describing the file in the manifest, see
+            :meth:`executor.manifest.Manifest.entry`, or None if there is no
+            manifest.
+        """
+        src, dst = pair
+        start = time.time()
+        hit = False
+        digest = new_hash() if self.manifest is not None else None
+        if self.cache is not None:
+            hit, digest = self.cache.place(src, dst,
+                                           checksum=digest is not None)
+            mode = 'cache hit' if hit else 'cache miss'
+        else:
+            mode = place(src, dst, mode=self.mode, digest=digest)
+        duration = time.time() - start
+        size = os.path.getsize(dst)
+        rate = size / MB / duration if duration > 0 else 0.0
+        msg = 'Placed \'{src}\' at \'{dst}\' ({mode}), {size:.1f} MB ' \
+              'in {sec:.3f} s ({rate:.1f} MB/s).'
+        logger.debug(msg.format(src=src, dst=dst, mode=mode, size=size / MB,
+                                sec=duration, rate=rate))
+        entry = None
+        if digest is not None:
+            entry = Manifest.entry(src, dst, digest)
+        return size, hit, entry
+
+
+class StageFiles(Command):
+    """Place files in a staging area of a butler repository.
+
+    The LSST task ingesting data can only copy, move, or symbolically link
+    files to the repository.  To get them there in a different way, e.g. by
+    a hard link, place them in a staging area within the repository first
+    and then let the task move them to their final locations.
+
+    Parameters
+    ----------
+    path : `str`
+        Location of the staging area.
+    files : iterable of `str`
+        Names of the files to place in the staging area.
+    workers : `int`, optional
+        Number of files placed concurrently. Defaults to 1.
+    mode : {'copy', 'hardlink', 'symlink', 'reflink'}, optional
+        Method of placing the files in the staging area, see
+        :func:`executor.files.place`. Defaults to 'copy'.
+    manifest : `executor.manifest.Manifest`, optional
+        Manifest of the repository. If specified, the files are recorded in
+        it as staged, with their checksums computed while they are placed.
+
+    Attributes
+    ----------
+    staged : iterable of `str`
+        Names the files will have in the staging area.
+    """
+
+    resumable = True
+
+    def __init__(self, path, files, workers=1, mode='copy', manifest=None):
+        self.path = os.path.abspath(path)
+        self.files = [files] if isinstance(files, six.string_types) else files
+        self.workers = workers
+        self.mode = mode
+        self.manifest = manifest
+        self.staged = pluck(self.files, self.stage)
+
+    def stage(self, filename):
+        """Return the name a file will have in the staging area.
+
+        See :func:`executor.files.spread` for the naming scheme.
+
+        Parameters
+        ----------
+        filename : `str`
+            Name of the file.
+
+        Returns
+        -------
+        `str`
+            Name of the file in the staging area.
+        """
+        return spread(self.path, filename)
+
+    def __repr__(self):
+        tmpl = '{cmd}({path!r}, {files}, workers={num}, mode={mode!r})'
+        return tmpl.format(cmd=self.__class__.__name__, path=self.path,
+                           files=self.files, num=self.workers, mode=self.mode)
+
+    def __str__(self):
+        tmpl = '{mode} {files} to {path}'
+        return tmpl.format(mode=self.mode,
+                           files=describe(self.files, 'file(s)'),
+                           path=self.path)
+
+    def fingerprint(self):
+        return _digest(self.__class__.__name__, self.path, origin(self.files))
+
+    def execute(self):
+        fallbacks = 0
+        created = set()
+        pool = ThreadPool(max(1, self.workers))
+        try:
+            for chunk in chunks(self.files, CHUNK_SIZE):
+                pairs = [(src, self.stage(src)) for src in chunk]
+                dirnames = set(os.path.dirname(dst) for _, dst in pairs)
+                for dirname in sorted(dirnames - created):
+                    makedirs(dirname)
+                created.update(dirnames)
+                if self.manifest is not None:
+                    self.manifest.expect(pairs)
+                results = pool.map(self._place, pairs)
+                fallbacks += sum(1 for mode, _ in results if mode != self.mode)
+                if self.manifest is not None:
+                    self.manifest.confirm((entry for _, entry in results),
+                                          state='staged')
+        finally:
+            pool.close()
+            pool.join()
+        if fallbacks:
+            logger.warning('{} file(s) copied instead of using \'{}\'.'
+                           .format(fallbacks, self.mode))
+
+    def _place(self, pair):
+        """Place a file in the staging area.
+
+        Returns
+        -------
+        `str`
+            The method actually used to place the file.
+        `tuple` or None
+            Entry describing the file in the manifest or None if there is no
+            manifest.
+        """
+        src, dst = pair
+        if self.manifest is None:
+            return place(src, dst, mode=self.mode), None
+        digest = new_hash()
+        mode = place(src, dst, mode=self.mode, digest=digest)
+        return mode, Manifest.entry(src, dst, digest)
+
+
+class Prefetch(Command):
+    """Start prefetching files to a node-local scratch space.
+
+    The command returns immediately, files are copied in the background.
+    It does not depend on any other command, so the files are being
+    prefetched while the repository is initialized and commands using them
+    can start as soon as the first ones arrive.
+
+    Parameters
+    ----------
+    stager : `executor.staging.Stager`
+        Stager prefetching the files.
+    files : iterable of `str`
+        Names of the files to prefetch.
+    """
+
+    # The local copies are removed once the job is finished, so they have to
+    # be prefetched again anyway.
+    resumable = False
+
+    def __init__(self, stager, files):
+        self.stager = stager
+        self.files = [files] if isinstance(files, six.string_types) else files
+
+    def __repr__(self):
+        tmpl = '{cmd}({stager!r}, {files!r})'
+        return tmpl.format(cmd=self.__class__.__name__, stager=self.stager,
+                           files=self.files)
+
+    def __str__(self):
+        tmpl = 'prefetch {files} to {path}'
+        return tmpl.format(files=describe(self.files, 'file(s)'),
+                           path=self.stager.root)
+
+    def execute(self):
+        self.stager.start(self.files)
 
 
 class IngestData(Command):
     """Ingest data files to the data butler repository.
 
+    Files are ingested in chunks, each by a separate invocation of the task,
+    to keep its argument list short.  By default, chunks are ingested one
+    after another.  With many workers, each chunk is ingested concurrently
+    in a separate process to a repository of its own within the staging area
+    of the target repository.  Once a chunk is ingested, its files are moved
+    to the target repository and its registries are merged with the ones of
+    the target repository, in the order of chunks.
+
+    If a chunk fails, no new chunks are started and the ones being ingested
+    are stopped.  Merging a chunk is not atomic, so if it fails, the target
+    repository may hold a part of the chunk.  Like any partly executed
+    ingestion, such a repository is built again from scratch when the job
+    is resumed, see :attr:`Command.idempotent`.
+
     Parameters
     ----------
     task : CmdLineTask
@@ -126,36 +590,276 @@ class IngestData(Command):
     path : `str`
         Location of data butler repository.
     opts : `list` of `str`
-        List of task's options.
+        List of task's options.  Options equal to `path` are replaced by the
+        locations of chunks' repositories when chunks are ingested
+        concurrently.
     files : iterable of `str`
         Names of the data files which should be ingested to the repository.
+    chunk_size : `int`, optional
+        Maximal number of files ingested by a single invocation of the task.
+        Defaults to 1000.
+    workers : `int`, optional
+        Number of chunks ingested concurrently. Defaults to 1.
+    runner : `WorkerPool`, optional
+        Pool of worker processes. If given, chunks ingested one after
+        another are ingested in isolated processes, so the task does not
+        need exclusive access to `sys.argv` of the executor.
+    manifest : `executor.manifest.Manifest`, optional
+        Manifest of the repository. If specified, files the manifest lists
+        as staged are recorded at the locations the task moved them to.
+        The locations are found by walking the repository once all chunks
+        are ingested and matching the files by their inodes, which a move
+        within a file system preserves.
+
+    Attributes
+    ----------
+    stats : `dict`
+        Number of ingested files and chunks, time it took (in seconds), and
+        the throughput (in files per second). Available after the command
+        was executed.
     """
 
-    def __init__(self, task, path, opts, files):
+    # The task parses its arguments directly from sys.argv.
+    resources = frozenset(['sys.argv'])
+
+    # Directory within the repository where chunks are ingested to.
+    chunk_area = '_chunks'
+
+    # Files of the chunks already ingested would be ingested again, and the
+    # ones moved to the repository are not in the staging area anymore.
+    resumable = True
+    idempotent = False
+
+    def __init__(self, task, path, opts, files, chunk_size=CHUNK_SIZE,
+                 workers=1, runner=None, manifest=None):
         self.receiver = task
-        self.name = getattr(self.receiver, '_DefaultName')
         self.path = path
         self.opts = opts
         self.files = [files] if isinstance(files, six.string_types) else files
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.runner = runner
+        self.manifest = manifest
+        self.inodes = {}
+        if self.runner is not None:
+            self.resources = frozenset()
+        self.stats = None
 
     def __repr__(self):
         tmpl = '{cmd}({task}, {path!r}, {opts}, {files})'
         return tmpl.format(cmd=self.__class__.__name__, task=self.receiver,
                            path=self.path, opts=self.opts, files=self.files)
 
+    @property
+    def name(self):
+        """`str`: Name of the task."""
+        return getattr(self.receiver, '_DefaultName')
+
     def __str__(self):
         name = self.name + '.py'
-        args = ' '.join(self.opts + self.files)
+        if isinstance(self.files, list):
+            files = self.files
+        else:
+            files = [describe(self.files, 'file(s)')]
+        args = ' '.join(self.opts + files)
         tmpl = '{task} {root} {argv}'
         return tmpl.format(task=name, root=self.path, argv=args)
 
+    def fingerprint(self):
+        return _digest(self.__class__.__name__, self.name, self.path,
+                       *self.opts)
+
     def execute(self):
-        sys.argv = [self.name, self.path]
-        sys.argv.extend(self.opts)
-        sys.argv.extend(self.files)
-        print sys.argv
+        start = time.time()
+        self.stats = {'files': 0, 'chunks': 0}
+        self.inodes = {}
+        if self.workers > 1:
+            self._ingest_concurrently()
+        else:
+            for num, chunk in enumerate(chunks(self.files, self.chunk_size),
+                                        start=1):
+                begin = time.time()
+                self._remember(chunk)
+                self._ingest(self.path, self.opts, chunk, runner=self.runner)
+                self._report(num, len(chunk), time.time() - begin)
+        if self.inodes:
+            self._relocate()
+        duration = time.time() - start
+        count = self.stats['files']
+        self.stats.update({
+            'elapsed': duration,
+            'throughput': count / duration if duration > 0 else 0.0,
+        })
+        logger.info('Ingested {files} file(s) in {chunks} chunk(s) in '
+                    '{elapsed:.2f} s ({throughput:.1f} files/s).'
+                    .format(**self.stats))
+
+    def _ingest(self, root, opts, files, runner=None):
+        """Ingest files to a repository.
+
+        Parameters
+        ----------
+        root : `str`
+            Location of the repository.
+        opts : `list` of `str`
+            Task's options.
+        files : `list` of `str`
+            Names of the files to ingest.
+        runner : `WorkerPool`, optional
+            Pool of worker processes to run the task in. If None (default),
+            the task is run in the current process.
+        """
+        if runner is not None:
+            runner.run(self.receiver, [root] + opts + files, use_argv=True)
+            return
+        sys.argv = [self.name, root]
+        sys.argv.extend(opts)
+        sys.argv.extend(files)
+        logger.debug('Task arguments: {}'.format(sys.argv))
         self.receiver.parseAndRun()
 
+    def _ingest_concurrently(self):
+        """Ingest chunks concurrently to separate repositories and merge them.
+        """
+        area = os.path.join(self.path, self.chunk_area)
+        completed = {}
+        merged = 0
+        errors = []
+
+        def pending():
+            for num, chunk in enumerate(chunks(self.files, self.chunk_size),
+                                        start=1):
+                if errors:
+                    return
+                root = os.path.join(area, str(num))
+                self._remember(chunk)
+                self._prepare(root)
+                opts = [root if opt == self.path else opt
+                        for opt in self.opts]
+                yield num, root, opts, chunk
+
+        results = fork_map(self._run_chunk, pending(), self.workers)
+        try:
+            for (num, _, _, chunk), _, error, elapsed in results:
+                if error is not None:
+                    errors.append('chunk {}: {}'.format(num, error))
+                    continue
+                completed[num] = (len(chunk), elapsed)
+
+                # Merge chunks in order, so the content of the registries
+                # does not depend on the order in which chunks complete.
+                while not errors and merged + 1 in completed:
+                    merged += 1
+                    count, duration = completed.pop(merged)
+                    self._merge(os.path.join(area, str(merged)))
+                    self._report(merged, count, duration)
+        finally:
+            # Stop the chunks still being ingested before removing their
+            # repositories.
+            results.close()
+            shutil.rmtree(area, ignore_errors=True)
+        if errors:
+            msg = 'Ingesting files to \'{}\' failed, {}.'.format(self.path,
+                                                                 errors[0])
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+    def _remember(self, files):
+        """Remember inodes of the files, if they are to be recorded.
+
+        Parameters
+        ----------
+        files : `list` of `str`
+            Names of the files the task is about to ingest.
+        """
+        if self.manifest is None:
+            return
+        for path in files:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            self.inodes[(st.st_dev, st.st_ino)] = os.path.abspath(path)
+
+    def _relocate(self):
+        """Record the locations the task moved the staged files to.
+        """
+        start = time.time()
+        moves = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                path = os.path.abspath(os.path.join(dirpath, name))
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                src = self.inodes.get((st.st_dev, st.st_ino))
+                if src is not None and src != path:
+                    moves.append((src, path))
+        count = self.manifest.relocate(moves)
+        logger.info('Recorded {} ingested file(s) in the manifest in '
+                    '{:.2f} s.'.format(count, time.time() - start))
+
+    def _prepare(self, root):
+        """Create a repository for a chunk.
+
+        The repository uses the same mapper as the target repository.
+        """
+        makedirs(root)
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.startswith('_mapper') and os.path.isfile(path):
+                shutil.copy2(path, os.path.join(root, name))
+
+    def _run_chunk(self, item):
+        """Ingest a chunk in a worker process.
+        """
+        _, root, opts, files = item
+        self._ingest(root, opts, files)
+
+    def _merge(self, root):
+        """Merge a chunk's repository into the target repository.
+
+        Parameters
+        ----------
+        root : `str`
+            Location of the chunk's repository.
+        """
+        skipped = set()
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.startswith('_mapper'):
+                skipped.add(name)
+            elif name.endswith(('.sqlite3', '.sqlite')):
+                skipped.add(name)
+                target = os.path.join(self.path, name)
+                if os.path.exists(target):
+                    merge(target, path)
+                else:
+                    os.rename(path, target)
+        move_tree(root, self.path, skipped=skipped)
+        shutil.rmtree(root)
+
+    def _report(self, num, count, duration):
+        """Report the progress of the ingestion.
+
+        Parameters
+        ----------
+        num : `int`
+            Ordinal number of the chunk ingested most recently.
+        count : `int`
+            Number of files in the chunk.
+        duration : `float`
+            Time it took to ingest the chunk, in seconds.
+        """
+        self.stats['files'] += count
+        self.stats['chunks'] += 1
+        rate = count / duration if duration > 0 else 0.0
+        logger.info('Ingested chunk {num} ({count} file(s)) to \'{path}\' in '
+                    '{sec:.2f} s ({rate:.1f} files/s), {total} file(s) so far.'
+                    .format(num=num, count=count, path=self.path, sec=duration,
+                            rate=rate, total=self.stats['files']))
+
 
 class RunTask(Command):
     """Run an LSST task.
@@ -168,13 +872,16 @@ class RunTask(Command):
         Location of dataset repository.
     args : `list` of `str`
         Task's optional arguments.
+    runner : `WorkerPool`, optional
+        Pool of worker processes. If given, the task is run in an isolated
+        process, otherwise it is run in the current one.
     """
 
-    def __init__(self, task, path, args):
+    def __init__(self, task, path, args, runner=None):
         self.receiver = task
-        self.name = getattr(self.receiver, '_DefaultName')
         self.path = path
         self.args = args
+        self.runner = runner
 
     def __repr__(self):
         args = ' '.join([self.path] + self.args)
@@ -182,6 +889,11 @@ class RunTask(Command):
         return tmpl.format(cmd=self.__class__.__name__, task=self.receiver,
                            path=self.path, argv=args)
 
+    @property
+    def name(self):
+        """`str`: Name of the task."""
+        return getattr(self.receiver, '_DefaultName')
+
     def __str__(self):
         name = self.name + '.py'
         args = ' '.join(self.args)
@@ -190,4 +902,202 @@ class RunTask(Command):
 
     def execute(self):
         argv = [self.path] + self.args
-        self.receiver.parseAndRun(args=argv)
+        if self.runner is not None:
+            self.runner.run(self.receiver, argv)
+        else:
+            self.receiver.parseAndRun(args=argv)
+
+
+class ValidateRepo(Command):
+    """Validate a butler repository.
+
+    Checks if the files described by the records are present in the
+    repository at the locations given by their templates (see
+    :class:`IngestCalibs` for the description of records).  Files described
+    by records without templates, e.g. raw data placed by an ingest task,
+    are looked for at the locations the repository's manifest lists for
+    them, if any.  The remaining ones cannot be checked, a warning says how
+    many of them there are.
+
+    Directories containing the files are walked only once to find out which
+    ones exist. Then, sizes of the files present in the repository, and
+    optionally their checksums, are compared concurrently with the sizes
+    (checksums) of the files the records describe, if they are accessible.
+
+    If the repository has a manifest (see :class:`executor.manifest.Manifest`)
+    listing a file as placed from the same source, and the source has not
+    changed since, the file is compared with the recorded size and checksum
+    instead, so the source is not read at all.
+
+    Parameters
+    ----------
+    path : `str`
+        Location of the butler repository.
+    records : iterable of `dict`
+        Records describing files which should be in the repository.
+    workers : `int`, optional
+        Number of files checked concurrently. Defaults to 1.
+    checksums : `bool`, optional
+        If True, checksums of the files are compared as well. Defaults to
+        False.
+
+    Raises
+    ------
+    ValueError
+        If any file is missing or differs from the one the record describes.
+    """
+
+    def __init__(self, path, records, workers=1, checksums=False):
+        self.path = os.path.abspath(path)
+        self.records = [records] if isinstance(records, dict) else records
+        self.workers = workers
+        self.checksums = checksums
+
+    def __repr__(self):
+        tmpl = '{cmd}({path!r}, records={recs}, workers={num}, ' \
+               'checksums={chk})'
+        return tmpl.format(cmd=self.__class__.__name__, path=self.path,
+                           recs=self.records, num=self.workers,
+                           chk=self.checksums)
+
+    def __str__(self):
+        tmpl = 'validate {recs} in {path}'
+        return tmpl.format(recs=describe(self.records, 'file(s)'),
+                           path=self.path)
+
+    def execute(self):
+        start = time.time()
+        untemplated = []
+        expected = {}
+        for rec in self.records:
+            meta = rec['meta']
+            if 'template' not in meta:
+                untemplated.append(rec['pfn'])
+                continue
+            subpath = os.path.normpath(meta['template'].format(**meta))
+            expected[subpath] = rec['pfn']
+        total = len(expected) + len(untemplated)
+
+        # The ingest task decides where the files without templates go, only
+        # the manifest knows it.
+        manifest = Manifest(self.path)
+        located = 0
+        if untemplated and manifest.exists():
+            for chunk in chunks(untemplated, 10 * CHUNK_SIZE):
+                for pfn, dst in manifest.locate(chunk).items():
+                    expected[os.path.relpath(dst, self.path)] = pfn
+                    located += 1
+        skipped = len(untemplated) - located
+        count = len(expected)
+
+        # Walk the repository once for all the files, then check the ones
+        # which are there in chunks.
+        found = scan(self.path, expected)
+        problems = ['missing: {}'.format(path)
+                    for path in sorted(set(expected) - found)]
+        pool = ThreadPool(max(1, self.workers))
+        try:
+            for chunk in chunks(sorted(found), 10 * CHUNK_SIZE):
+                known = manifest.lookup(os.path.join(self.path, path)
+                                        for path in chunk)
+                results = pool.map(self._check, [
+                    (expected[path], path,
+                     known.get(os.path.join(self.path, path)))
+                    for path in chunk])
+                problems.extend(result for result in results
+                                if result is not None)
+        finally:
+            pool.close()
+            pool.join()
+        if skipped:
+            msg = '{} of {} file(s) not validated: their records have no ' \
+                  'templates and the manifest of the repository does not ' \
+                  'list them.'.format(skipped, total)
+            if 2 * skipped > total:
+                msg += ' Most of the repository was not validated.'
+            logger.warning(msg)
+
+        logger.info('Validated {} file(s) in {:.3f} s.'
+                    .format(count, time.time() - start))
+        if problems:
+            limit = 10
+            for problem in problems[:limit]:
+                logger.error('Invalid repository file, {}'.format(problem))
+            if len(problems) > limit:
+                logger.error('... and {} more.'.format(len(problems) - limit))
+            msg = 'Dataset repository at \'{}\' is invalid: {} problem(s) ' \
+                  'found.'.format(self.path, len(problems))
+            logger.error(msg)
+            raise ValueError(msg)
+
+    def _check(self, item):
+        """Compare a file in the repository with its source.
+
+        Parameters
+        ----------
+        item : `tuple`
+            Source file name, the path to the file in the repository,
+            relative to its root, and its record in the manifest (None if
+            it is not recorded).
+
+        Returns
+        -------
+        `str` or None
+            Description of the problem, if any.
+        """
+        src, subpath, rec = item
+        dst = os.path.join(self.path, subpath)
+        try:
+            size = os.path.getsize(dst)
+        except OSError:
+            return 'unreadable: {}'.format(subpath)
+        expected, digest = self._expect(src, rec)
+        if expected is None:
+            return None
+        if size != expected:
+            return 'size mismatch: {} ({} != {})'.format(subpath, size,
+                                                        expected)
+        if self.checksums and checksum(dst) != (digest or checksum(src)):
+            return 'checksum mismatch: {}'.format(subpath)
+        return None
+
+    @staticmethod
+    def _expect(src, rec):
+        """Find out what size and checksum a file should have.
+
+        The file's record in the manifest is used if it describes the same
+        source and the source has not changed since the file was placed (or
+        it is not accessible anymore).  Otherwise, the source is examined.
+
+        Returns
+        -------
+        `int` or None
+            Size of the file, None if the source is not accessible and the
+            file is not recorded.
+        `str` or None
+            Checksum of the file, None if it must be computed from the source.
+        """
+        try:
+            st = os.stat(src)
+        except OSError:
+            st = None
+        if rec is not None and rec['state'] == 'done' and \
+                rec['pfn'] == src and rec['algorithm'] == new_hash().name:
+            if st is None or (st.st_size == rec['size'] and
+                              st.st_mtime == rec['mtime']):
+                return rec['size'], rec['checksum']
+        if st is None:
+            return None, None
+        return st.st_size, None
+
+
+def _digest(*parts):
+    """Compute a hash of strings.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -0,0 +1,354 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Number of bytes in a megabyte, used when reporting sizes and throughputs.
+MB = 1024.0 * 1024
+
+
+def makedirs(path):
+    """Create a directory, including all intermediate ones.
+
+    Unlike :func:`os.makedirs`, it is not an error if the directory already
+    exists, e.g. because it was created by another thread in the meantime.
+
+    Parameters
+    ----------
+    path : `str`
+        Directory to create.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def spread(root, filename):
+    """Return the name a file gets when it is placed in a given directory.
+
+    Files are placed in subdirectories, one for each directory they come
+    from, to avoid clashes between files with the same names; the original
+    names are kept as LSST tasks may need them to work out the metadata.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory the file is placed in.
+    filename : `str`
+        Name of the file.
+
+    Returns
+    -------
+    `str`
+        Name of the file within the directory.
+    """
+    dirname, name = os.path.split(os.path.abspath(filename))
+    key = hashlib.md5(dirname.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(root, key, name)
+
+
+# Supported methods of placing files in a repository.
+MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+# Linux ioctl request cloning a file (FICLONE), see ioctl_ficlone(2).
+FICLONE = 0x40049409
+
+
+def place(src, dst, mode='copy', digest=None):
+    """Place a file at a given location.
+
+    Parameters
+    ----------
+    src : `str`
+        Source file.
+    dst : `str`
+        Destination.  If it exists, it is replaced unless it already is
+        a link to the source made with the given method (a hard link or
+        a symbolic link), so the file can be placed again, e.g. when an
+        interrupted execution is resumed.
+    mode : {'copy', 'hardlink', 'symlink', 'reflink'}, optional
+        Method of placing the file:
+
+        * **copy**: make a copy of the file,
+        * **hardlink**: create a hard link to the file,
+        * **symlink**: create a symbolic link to the file,
+        * **reflink**: create a copy-on-write clone of the file.
+
+        If a hard link or a clone cannot be made, e.g. because the source and
+        the destination are on different devices or the file system does not
+        support cloning, the file is copied instead. Defaults to 'copy'.
+    digest : hash object, optional
+        If specified, it is fed with the content of the file, see
+        :func:`new_hash`.  If the file is copied, it happens in the same pass,
+        otherwise the placed file is read afterwards.
+
+    Returns
+    -------
+    `str`
+        The method actually used to place the file.
+
+    Raises
+    ------
+    ValueError
+        If the mode is not supported.
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown mode \'{}\'.'.format(mode))
+    if os.path.lexists(dst):
+        if _linked(src, dst, mode):
+            if digest is not None:
+                checksum(dst, digest=digest)
+            return mode
+        os.remove(dst)
+    placed = _link(src, dst, mode)
+    if placed is None:
+        _copy(src, dst, digest=digest)
+        return 'copy'
+    if digest is not None:
+        checksum(dst, digest=digest)
+    return placed
+
+
+def _linked(src, dst, mode):
+    """Check if a file is already linked to its destination.
+
+    Copies and clones are never considered complete, as they may have been
+    interrupted.
+    """
+    if mode == 'symlink':
+        return os.path.islink(dst) and \
+            os.readlink(dst) == os.path.abspath(src)
+    if mode == 'hardlink':
+        try:
+            return os.path.samestat(os.stat(src), os.lstat(dst))
+        except OSError:
+            return False
+    return False
+
+
+def _link(src, dst, mode):
+    """Link or clone a file, if the mode requires it and it is possible.
+
+    Returns the mode used or None if the file should be copied instead.
+    """
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return mode
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+        except OSError as ex:
+            if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+        else:
+            return mode
+    if mode == 'reflink':
+        try:
+            _clone(src, dst)
+        except (IOError, OSError) as ex:
+            if ex.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY,
+                                errno.EINVAL, errno.ENOSYS):
+                raise
+        else:
+            return mode
+    return None
+
+
+def _copy(src, dst, digest=None):
+    """Copy a file, feeding its content to the hash object, if any.
+    """
+    if digest is None:
+        shutil.copy(src, dst)
+        return
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            for block in iter(lambda: fsrc.read(BLOCK_SIZE), b''):
+                digest.update(block)
+                fdst.write(block)
+    shutil.copymode(src, dst)
+
+
+def _clone(src, dst):
+    """Create a copy-on-write clone of a file.
+
+    If the clone cannot be made, the (empty) destination is removed.
+    """
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                fdst.close()
+                os.remove(dst)
+                raise
+    shutil.copymode(src, dst)
+
+
+# Size of blocks files are read in.
+BLOCK_SIZE = 1024 * 1024
+
+
+def new_hash():
+    """Create a hash object computing file checksums.
+
+    The fastest available algorithm is used: xxh64 if `xxhash` package is
+    installed, BLAKE2b if supported by :mod:`hashlib`, and MD5 otherwise.
+
+    Returns
+    -------
+    hash object
+        Object providing :mod:`hashlib` interface, its `name` attribute is
+        the name of the algorithm.
+    """
+    if xxhash is not None:
+        return xxhash.xxh64()
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.md5()
+
+
+def checksum(path, digest=None):
+    """Compute the checksum of a file.
+
+    Parameters
+    ----------
+    path : `str`
+        File name.
+    digest : hash object, optional
+        Hash object to feed the content of the file to. If None (default),
+        a new one is created with :func:`new_hash`.
+
+    Returns
+    -------
+    `str`
+        Hexadecimal digest of the file's content computed with the algorithm
+        returned by :func:`new_hash`.
+    """
+    if digest is None:
+        digest = new_hash()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(root, subpaths):
+    """Find which of the given files exist within a directory.
+
+    Instead of checking each file separately, the directory trees containing
+    the files are walked once.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory to search.
+    subpaths : iterable of `str`
+        Normalized paths of the files, relative to the root.
+
+    Returns
+    -------
+    `set` of `str`
+        Relative paths of the files which exist.
+    """
+    wanted = set(subpaths)
+    tops = set(path.split(os.sep, 1)[0] for path in wanted)
+    found = set()
+    for top in tops:
+        start = os.path.join(root, top)
+        if not os.path.isdir(start):
+            if top in wanted and os.path.lexists(start):
+                found.add(top)
+            continue
+        for dirpath, dirnames, filenames in os.walk(start):
+            reldir = os.path.relpath(dirpath, root)
+            for name in filenames:
+                path = os.path.join(reldir, name)
+                if path in wanted:
+                    found.add(path)
+    return found
+
+
+def clone_tree(src, dst, mode='hardlink', copied=('.sqlite3', '.sqlite')):
+    """Clone a directory tree.
+
+    Directories are recreated, symbolic links are copied as they are, and
+    files are placed at the destination with the given method except files
+    which may be modified later, e.g. registries, which are always copied
+    (or cloned, if `mode` is 'reflink').
+
+    Parameters
+    ----------
+    src : `str`
+        Directory to clone.
+    dst : `str`
+        Location of the clone, it must not exist.
+    mode : {'copy', 'hardlink', 'symlink', 'reflink'}, optional
+        Method of placing the files at the destination, see :func:`place`.
+        Defaults to 'hardlink'.
+    copied : `tuple` of `str`, optional
+        Extensions of files which must be copied.
+    """
+    os.makedirs(dst)
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        for name in dirnames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            else:
+                os.mkdir(os.path.join(target, name))
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            elif name.endswith(copied):
+                how = 'reflink' if mode == 'reflink' else 'copy'
+                place(path, os.path.join(target, name), mode=how)
+            else:
+                place(path, os.path.join(target, name), mode=mode)
+
+
+def move_tree(src, dst, skipped=()):
+    """Move the content of a directory tree into another one.
+
+    Files are renamed, so both directories must be on the same file system.
+    Existing files at the destination are replaced.
+
+    Parameters
+    ----------
+    src : `str`
+        Directory which content should be moved.
+    dst : `str`
+        Destination directory.
+    skipped : `tuple` of `str`, optional
+        Paths of the files, relative to `src`, which should not be moved.
+
+    Returns
+    -------
+    `int`
+        Number of moved files.
+    """
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(src):
+        reldir = os.path.relpath(dirpath, src)
+        target = os.path.normpath(os.path.join(dst, reldir))
+        created = False
+        for name in filenames:
+            path = os.path.normpath(os.path.join(reldir, name))
+            if path in skipped:
+                continue
+            if not created:
+                makedirs(target)
+                created = True
+            os.rename(os.path.join(dirpath, name), os.path.join(target, name))
+            count += 1
+    return count
@@ -0,0 +1,26 @@
+import importlib
+
+
+def load(name, package=None):
+    """Import a module which is slow to import, once it is needed.
+
+    Modules are imported at the top of the modules using them, except the
+    ones which take long to import and are not needed by every job, e.g.
+    :mod:`jsonschema`, :mod:`sqlite3`, the HTTP server, or the modules of the
+    LSST Stack.
+    Those are imported through this function where they are used, so
+    commands which do not need them, e.g. a dry run, do not pay for them.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the module.
+    package : `str`, optional
+        Package the name is relative to, if it is a relative one.
+
+    Returns
+    -------
+    module
+        The module.
+    """
+    return importlib.import_module(name, package)
@@ -0,0 +1,201 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+try:
+    from thread import get_ident
+except ImportError:
+    from threading import get_ident
+
+
+class Recorder(object):
+    """Record time and resources spent in execution phases.
+
+    For each phase, the recorder measures its wall clock time, the CPU time
+    (user and system) used by the process and its terminated children, peak
+    resident set size of the process, the number of bytes read and written
+    by the process, and the number of modules it imported.  Apart from the
+    wall clock time, the measurements are process-wide, so measurements of
+    phases executed concurrently overlap.
+
+    Parameters
+    ----------
+    origin : `float`, optional
+        Time (in seconds since the epoch) the phases' start times are measured
+        from. Defaults to the time the recorder was created.
+
+    Attributes
+    ----------
+    phases : `list` of `dict`
+        Measurements of the completed phases.
+    """
+
+    def __init__(self, origin=None):
+        self.origin = time.time() if origin is None else origin
+        self.phases = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name, category='phase'):
+        """Measure the execution of a block of code.
+
+        Parameters
+        ----------
+        name : `str`
+            Name of the phase.
+        category : `str`, optional
+            Category of the phase, e.g. 'startup' or 'command'.
+        """
+        before = sample()
+        try:
+            yield
+        finally:
+            after = sample()
+            record = {
+                'name': name,
+                'category': category,
+                'thread': get_ident(),
+                'start': before['wall'] - self.origin,
+                'wall': after['wall'] - before['wall'],
+                'cpu': after['cpu'] - before['cpu'],
+                'peak_rss': after['peak_rss'],
+                'modules': after['modules'] - before['modules'],
+            }
+            for key in ('bytes_read', 'bytes_written'):
+                if before[key] is not None and after[key] is not None:
+                    record[key] = after[key] - before[key]
+                else:
+                    record[key] = None
+            with self.lock:
+                self.phases.append(record)
+
+    def breakdown(self, category=None):
+        """Describe the time spent in the phases.
+
+        Parameters
+        ----------
+        category : `str`, optional
+            Category of the phases to describe. If None (default), all
+            phases are described.
+
+        Returns
+        -------
+        `str`
+            Wall clock time of each phase and the number of modules imported
+            during it, followed by the total time.
+        """
+        phases = [record for record in self.phases
+                  if category is None or record['category'] == category]
+        parts = ['{name} {ms:.1f} ms (+{modules} modules)'
+                 .format(ms=record['wall'] * 1e3, **record)
+                 for record in phases]
+        total = sum(record['wall'] for record in phases)
+        parts.append('total {:.1f} ms'.format(total * 1e3))
+        return ', '.join(parts)
+
+    def hook(self, cmd):
+        """Measure the execution of a command, see :class:`Scheduler`.
+
+        Parameters
+        ----------
+        cmd : `Command`
+            The command.
+        """
+        return self.phase(str(cmd), category=cmd.__class__.__name__)
+
+    def trace(self, pid=None):
+        """Represent the phases as trace events.
+
+        Parameters
+        ----------
+        pid : `int`, optional
+            Process id events are assigned to. Defaults to the id of the
+            current process.
+
+        Returns
+        -------
+        `list` of `dict`
+            Complete events in Chrome trace event format, viewable in
+            `chrome://tracing` or Perfetto UI.
+        """
+        pid = os.getpid() if pid is None else pid
+        events = []
+        for record in self.phases:
+            args = {key: val for key, val in record.items()
+                    if key not in ('name', 'category', 'thread', 'start',
+                                   'wall')}
+            events.append({
+                'name': record['name'],
+                'cat': record['category'],
+                'ph': 'X',
+                'ts': int((self.origin + record['start']) * 1e6),
+                'dur': int(record['wall'] * 1e6),
+                'pid': pid,
+                'tid': record['thread'],
+                'args': args,
+            })
+        return events
+
+
+def sample():
+    """Take a snapshot of the resources used by the current process.
+
+    Returns
+    -------
+    `dict`
+        Current time and the resources used by the process so far: CPU time
+        (in seconds), peak resident set size (in bytes), the number of bytes
+        read and written (None if unknown), and the number of modules
+        imported.
+    """
+    wall = time.time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    read, written = _io_counters()
+    return {
+        'wall': wall,
+        'cpu': cpu,
+        'peak_rss': own.ru_maxrss * 1024,
+        'bytes_read': read,
+        'bytes_written': written,
+        'modules': len(sys.modules),
+    }
+
+
+def _io_counters():
+    """Get the number of bytes read and written by the current process.
+
+    Returns
+    -------
+    `tuple` of `int`
+        Bytes read and written, as reported by `/proc/self/io`, or Nones if
+        the file is not available.
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+    except (IOError, OSError):
+        return None, None
+    return int(counters['rchar']), int(counters['wchar'])
+
+
+def write_report(path, report):
+    """Write a report in JSON format.
+
+    Parameters
+    ----------
+    path : `str`
+        File name.
+    report : `dict`
+        The report.
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
@@ -1,12 +1,40 @@
 import argparse
+import copy
+import functools
 import json
-import jsonschema
 import logging
-import logging.config
 import os
-from .mapper import TaskMapper
-from .commands import InitRepo, IngestCalibs, IngestData, RunTask
-from .schema import default
+import shutil
+import six
+import sys
+import tempfile
+import time
+from logging.config import dictConfig
+from .files import MB, makedirs
+from .imports import load
+from .instrument import Recorder, write_report
+from .journal import Journal, locate
+from .manifest import Manifest
+from .processes import describe_error, fork_map
+from .profiling import PROFILERS, Profiler
+from .mapper import INDEX_PATH, TaskIndex, TaskMapper
+from .cache import CalibCache
+from .commands import (CHUNK_SIZE, CloneRepo, InitRepo, IngestCalibs,
+                       IngestData, Prefetch, RunTask, StageFiles,
+                       ValidateRepo)
+from .records import Mapped, RecordStream, concat, partition, pluck
+from .scheduler import Scheduler
+from .snapshots import TemplateStore
+from .staging import Staged, Stager
+from .workers import WorkerPool
+from .schema import default, get_validator, validate
+
+
+# Name of the staging area within a dataset repository.
+STAGING_AREA = '_staging'
+
+
+logger = logging.getLogger(__name__)
 
 
 def setup_logging(path='logging.json', level=logging.INFO):
@@ -22,7 +50,11 @@ def setup_logging(path='logging.json', level=logging.INFO):
     if os.path.exists(path):
         with open(path, 'r') as f:
             config = json.load(f)
-        logging.config.dictConfig(config)
+
+        # Loggers of executor's modules are created when they are imported,
+        # i.e., before logging is configured. Don't disable them.
+        config.setdefault('disable_existing_loggers', False)
+        dictConfig(config)
     else:
         logging.basicConfig(level=level)
     return logging.getLogger(__name__)
@@ -37,18 +69,100 @@ def create_parser():
         An object with attributes representing command line options.
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument('file', type=str,
-                        help='job specification')
+    parser.add_argument('files', type=str, nargs='*', metavar='file',
+                        help='job specification(s); JSON Lines files (.jsonl) '
+                             'may contain many, \'-\' (or none, if stdin is '
+                             'not a terminal) reads them from stdin')
     parser.add_argument('-d', '--dry-run', dest='dryrun', action='store_false',
                         help='print commands instead execute')
     parser.add_argument('-l', '--logging', type=str,
                         help='logging configuration', default=None)
     parser.add_argument('-s', '--schema', type=str,
                         help='JSON schema', default=None)
+    parser.add_argument('-i', '--index', type=str,
+                        help='task index location', default=INDEX_PATH)
+    parser.add_argument('--rebuild-index', dest='rebuild', action='store_true',
+                        help='rebuild task index from scratch')
+    parser.add_argument('--lazy', action='store_true',
+                        help='resolve tasks only when they are needed')
+    parser.add_argument('--io-workers', dest='io_workers', type=int,
+                        help='number of concurrent file operations',
+                        default=4)
+    parser.add_argument('--ingest-chunk-size', dest='chunk_size', type=int,
+                        help='maximal number of files ingested at once',
+                        default=CHUNK_SIZE)
+    parser.add_argument('--ingest-workers', dest='ingest_workers', type=int,
+                        help='number of chunks of data files ingested '
+                             'concurrently', default=1)
+    parser.add_argument('--scratch', type=str,
+                        help='node-local directory to prefetch input files '
+                             'to (prefetched data files are moved to the '
+                             'repository whatever the ingest mode is)',
+                        default=None)
+    parser.add_argument('--prefetch-workers', dest='prefetch_workers',
+                        type=int, help='number of files prefetched '
+                                       'concurrently', default=4)
+    parser.add_argument('--prefetch-bandwidth', dest='prefetch_bandwidth',
+                        type=float, help='prefetch bandwidth limit in MB/s',
+                        default=None)
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help='execute all commands, even the ones completed '
+                             'by an earlier run')
+    parser.add_argument('-r', '--results', type=str,
+                        help='file to write job results to (JSON Lines)',
+                        default=None)
+    parser.add_argument('--summary', type=str,
+                        help='file to write the summary report to (JSON)',
+                        default=None)
+    parser.add_argument('-p', '--processes', type=int,
+                        help='number of jobs executed concurrently',
+                        default=1)
+    parser.add_argument('--verify-checksums', dest='checksums',
+                        action='store_true',
+                        help='verify checksums of files in input repository')
+    parser.add_argument('--manifest', action='store_true',
+                        help='record files placed in input repository, with '
+                             'their checksums, in its manifest')
+    parser.add_argument('--calib-cache', dest='calib_cache', type=str,
+                        help='node-local cache of calibration files',
+                        default=None)
+    parser.add_argument('--calib-cache-size', dest='calib_cache_size',
+                        type=float, help='calibration cache size limit in MB',
+                        default=None)
+    parser.add_argument('--templates', type=str,
+                        help='store of repository templates', default=None)
+    parser.add_argument('--report', type=str,
+                        help='file to write the job\'s execution report to '
+                             '(JSON); \'{index}\' is replaced by the job\'s '
+                             'ordinal number', default=None)
+    parser.add_argument('--trace', type=str,
+                        help='file to write the job\'s execution timeline to '
+                             '(Chrome trace format); \'{index}\' is replaced '
+                             'by the job\'s ordinal number', default=None)
+    parser.add_argument('--profile', type=str, choices=['all', 'RunTask'],
+                        help='profile all commands or the LSST task only',
+                        default=None)
+    parser.add_argument('--profiler', type=str, choices=sorted(PROFILERS),
+                        help='profiler to use', default='cprofile')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of commands executed concurrently',
+                        default=1)
+    parser.add_argument('--isolate', action='store_true',
+                        help='run LSST tasks in pre-warmed worker processes')
+    parser.add_argument('--pool-size', dest='pool_size', type=int,
+                        help='number of worker processes running LSST tasks '
+                             '(defaults to the number of concurrent commands)',
+                        default=None)
+    parser.add_argument('--serve', type=str, metavar='ADDRESS',
+                        help='accept jobs over HTTP on [host:]port or a Unix '
+                             'socket (a path with a slash) instead of reading '
+                             'job files', default=None)
     return parser
 
 
-def create_repo(job, mapper):
+def create_repo(job, mapper, io_workers=1, cache=None, templates=None,
+                chunk_size=CHUNK_SIZE, ingest_workers=1, stager=None,
+                runner=None, manifest=False):
     """Create a sequence of commands required to build a dataset repository.
 
     Parameters
@@ -58,53 +172,144 @@ def create_repo(job, mapper):
     mapper : `TaskMapper`
         A map between task names and their code (names of modules they are
         defined in and class names).
+    io_workers : `int`, optional
+        Number of concurrent file operations, defaults to 1.
+    cache : `CalibCache`, optional
+        Node-local cache of calibration files. If specified, calibration
+        files are placed in the repository via the cache.
+    templates : `TemplateStore`, optional
+        Store of repository templates. If specified and a template built from
+        the same input exists, the repository is cloned from it. Otherwise,
+        the repository built from scratch is added to the store.
+    chunk_size : `int`, optional
+        Maximal number of files ingested by a single invocation of an ingest
+        task, defaults to 1000.
+    ingest_workers : `int`, optional
+        Number of chunks of data files ingested concurrently, defaults to 1.
+    stager : `Stager`, optional
+        Stager prefetching files to a node-local scratch space. If specified,
+        files are prefetched while the repository is initialized and they are
+        ingested from there as soon as they arrive.  The local copies of data
+        files are moved to the repository, regardless of the ingest mode.
+    runner : `WorkerPool`, optional
+        Pool of worker processes. If specified, ingest tasks are run in them.
+    manifest : `bool`, optional
+        If True, files placed in the repository are recorded in its manifest
+        with their checksums, see :class:`Manifest`. Data files are then
+        always placed in the staging area first, so their checksums are
+        computed while they are placed.  Files prefetched to a node-local
+        scratch space cannot be recorded, so it cannot be used with
+        `stager`. Defaults to False.
 
     Return
     ------
     `list` of `Commands`
         A list of commands allowing to build a dataset repository from scratch.
+        Commands placing and ingesting files depend only on the command
+        initializing the repository, so they can be executed concurrently.
+
+    Raises
+    ------
+    ValueError
+        If both `manifest` and `stager` are specified.
     """
+    if manifest and stager is not None:
+        raise ValueError('Prefetched files cannot be recorded in '
+                         'the manifest.')
     queue = []
 
     # Add the command that will create an empty butler repository at a
     # given location with a required mapper.
     repo = job['input']
     root, mapping = repo['root'], repo['mapper']
-    cmd = InitRepo(root, mapping)
-    queue.append(cmd)
 
-    # Add the command which will ingest raw data.
+    # Clone the repository from a template built from the same input, if
+    # there is one.
+    if templates is not None:
+        fingerprint = templates.fingerprint(job)
+        template = templates.path(fingerprint)
+        if templates.has(fingerprint):
+            logger.info('Found repository template \'{}\'.'.format(template))
+            queue.append(CloneRepo(template, root))
+            return queue
+
+    # Start prefetching the files first, they do not depend on anything,
+    # so they are fetched while the repository is initialized and the files
+    # which arrived are ingested.  Calibration files are not prefetched if
+    # they are placed in the repository via the cache, it keeps local copies
+    # of them anyway.
     data = job['data']
+    calibs = job.get('calibs')
+    files = pluck(data, _get_pfn)
+    prefetched = stager is not None and cache is None and calibs is not None
+    if stager is not None:
+        queue.append(Prefetch(stager, files))
+    if prefetched:
+        queue.append(Prefetch(stager, pluck(calibs, _get_pfn)))
+
+    init = InitRepo(root, mapping)
+    queue.append(init)
+    record = Manifest(root) if manifest else None
+
+    # Add the command which will ingest raw data.  The ingest task can
+    # only copy or symbolically link files to the repository so any other
+    # files are placed in a staging area first and then moved to their
+    # final locations by the task.
+    mode = repo.get('ingest_mode', 'copy')
     name = 'ingestImages'
     tmpl = '--mode {mod}'
     task = mapper.get_task(name)
-    opts = tmpl.format(mod='copy').split()
-    files = [rec['pfn'] for rec in data]
-    cmd = IngestData(task, root, opts, files)
-    queue.append(cmd)
+    last = init
+    if stager is not None:
+        # Prefetched files are private copies, so the task may move them.
+        if mode != 'copy':
+            logger.info('Data files are prefetched, so they are moved to the '
+                        'repository instead of using ingest mode \'{}\'.'
+                        .format(mode))
+        opts = tmpl.format(mod='move').split()
+        files = Staged(stager, files, window=chunk_size)
+    elif mode in ('copy', 'symlink') and record is None:
+        opts = tmpl.format(mod='link' if mode == 'symlink' else mode).split()
+    else:
+        staging = os.path.join(root, STAGING_AREA)
+        stage = StageFiles(staging, files, workers=io_workers, mode=mode,
+                           manifest=record)
+        queue.append(stage.after(init))
+        opts = tmpl.format(mod='move').split()
+        files = stage.staged
+        last = stage
+    cmd = IngestData(task, root, opts, files, chunk_size=chunk_size,
+                     workers=ingest_workers, runner=runner,
+                     manifest=record)
+    queue.append(cmd.after(last))
 
-    # Add the commands which will ingest calibration data, if any.
-    calibs = job.get('calibs')
+    # Add the commands which will ingest calibration data, if any.  Files of
+    # the same type and validity are ingested by a single invocation of the
+    # task to avoid opening and closing the registry for every file.  The
+    # records are split into the groups in a single pass; records read from
+    # a file are read again, by their offsets, when they are ingested.
     if calibs is not None:
         name = 'ingestCalibs'
-        tmpl = '--calib {path} --validity {val}'
         task = mapper.get_task(name)
-        for rec in calibs:
-            filename, meta = rec['pfn'], rec['meta']
-            kind = meta.get('type')
+        groups = partition(calibs, _get_group)
+        for (kind, val), members in groups.items():
 
             # Kernel does not require ingesting to repository's registry.
             if kind == 'bfKernel':
                 continue
+            filenames = pluck(members, _get_pfn)
+            if prefetched:
+                filenames = Staged(stager, filenames, window=chunk_size)
+            tmpl = '--calib {path} --validity {val}'
 
             # Update option template if type is specified explicitly.
             if kind in ['bias', 'dark', 'defect', 'flat', 'fringe']:
                 tmpl += ' --calibType {type}'
 
-            val = str(meta.get('validity', 999))
             opts = tmpl.format(path=root, type=kind, val=val).split()
-            cmd = IngestData(task, root, opts, filename)
-            queue.append(cmd)
+            cmd = IngestData(task, root, opts, filenames,
+                             chunk_size=chunk_size, runner=runner)
+            queue.append(cmd.after(init))
 
         # And this is the place where things are getting really funny.
         # The LSST task responsible for ingesting calibration files to
@@ -112,18 +317,34 @@ def create_repo(job, mapper):
         # updates the repository's registry.  Placing the files in
         # the expected locations is apparently left as an exercise for
         # a reader.
-        cmd = IngestCalibs(root, calibs)
-        queue.append(cmd)
+        if prefetched:
+            records = Mapped(calibs, functools.partial(_localize, stager))
+            cmd = IngestCalibs(root, records, workers=io_workers,
+                               mode='hardlink')
+        else:
+            cmd = IngestCalibs(root, calibs, workers=io_workers, mode=mode,
+                               cache=cache, manifest=record)
+        queue.append(cmd.after(init))
+
+    # Save the repository as a template for jobs with the same input.
+    if templates is not None:
+        cmd = CloneRepo(root, template, atomic=True)
+        queue.append(cmd.after(*queue))
     return queue
 
 
-def validate_repo(job):
+def validate_repo(job, io_workers=1, checksums=False):
     """Validate pre-existing dataset repository.
 
     Parameters
     ----------
     job : `dict`
         Job description.
+    io_workers : `int`, optional
+        Number of concurrent file operations, defaults to 1.
+    checksums : `bool`, optional
+        If True, checksums of files in the repository are verified as well.
+        Defaults to False.
 
     Returns
     -------
@@ -131,55 +352,390 @@ def validate_repo(job):
         A list of commands allowing to validate pre-existing dataset
         repository.
     """
-    # TODO: Implement a protocol for dataset repository validation.
-    queue = []
-    return queue
+    root = job['input']['root']
+    records = concat(job.get('data', []), job.get('calibs', []))
+    cmd = ValidateRepo(root, records, workers=io_workers, checksums=checksums)
+    return [cmd]
 
 
-def execute(argv):
-    """Execute an LSST task in an arbitrary location.
+def _get_pfn(rec):
+    """Return the physical file name from a file record.
+    """
+    return rec['pfn']
+
+
+def _get_group(rec):
+    """Return the type and validity of a calibration file.
+    """
+    meta = rec['meta']
+    return meta.get('type'), str(meta.get('validity', 999))
+
+
+def _localize(stager, rec):
+    """Replace the physical file name in a record by its local copy.
+    """
+    return dict(rec, pfn=stager.get(rec['pfn']))
+
+
+def open_streams(job, schema=default):
+    """Replace names of files with file records by streams of the records.
 
     Parameters
     ----------
-    argv : list of `str`
-        List representing command line arguments.
+    job : `dict`
+        Job description.
+    schema : `dict`, optional
+        JSON schema the records must conform to. Defaults to the internal
+        schema.
     """
-    parser = create_parser()
-    args = parser.parse_args(argv[1:])
+    for key in ('data', 'calibs'):
+        if isinstance(job.get(key), six.string_types):
+            job[key] = RecordStream(job[key], schema=schema)
 
-    if args.logging is not None:
-        logger = setup_logging(path=args.logging)
-    else:
-        logger = setup_logging(level=logging.WARNING)
-    logger.info('Logger configured, starting logging events.')
 
-    logger.info('Reading job description from \'{}\'.'.format(args.file))
-    with open(args.file, 'r') as f:
+def read_jobs(paths):
+    """Iterate over job descriptions.
+
+    Parameters
+    ----------
+    paths : `list` of `str`
+        Files with job descriptions.  A file with extension `.jsonl` is
+        expected to contain one job description per line, any other file
+        a single job description. A dash means that job descriptions, one per
+        line, should be read from the standard input.
+
+    Yields
+    ------
+    source : `str`
+        Where the job description comes from, i.e., the file name optionally
+        followed by the line number.
+    load : callable
+        A function returning the job description.  Job descriptions are
+        parsed only when requested, so a malformed one can be reported
+        without affecting the remaining ones.  Relative names of files with
+        data and calibration records are resolved with respect to the
+        directory containing the job description.
+    """
+    for path in paths:
+        if path == '-':
+            lines = enumerate(sys.stdin, start=1)
+            base = os.getcwd()
+            for source, line in _iter_lines(lines, '<stdin>'):
+                yield source, functools.partial(_load_line, line, base)
+        elif path.endswith('.jsonl'):
+            base = os.path.dirname(os.path.abspath(path))
+            with open(path, 'r') as f:
+                for source, line in _iter_lines(enumerate(f, start=1), path):
+                    yield source, functools.partial(_load_line, line, base)
+        else:
+            yield path, functools.partial(_load_json, path)
+
+
+def _iter_lines(lines, name):
+    """Skip blank lines of a JSON Lines stream and label the remaining ones.
+    """
+    for num, line in lines:
+        if line.strip():
+            yield '{}:{}'.format(name, num), line
+
+
+def _load_json(path):
+    """Read a job description from a file.
+    """
+    with open(path, 'r') as f:
         job = json.load(f)
+    return _resolve(job, os.path.dirname(os.path.abspath(path)))
 
-    msg = 'Validating job description; '
-    if args.schema is not None:
-        with open(args.schema, 'r') as s:
-            schema = json.load(s)
-        msg += 'using schema from \'{}\'.'.format(args.schema)
-    else:
-        schema = default
-        msg += 'using internal schema.'
-    logger.info(msg)
-    jsonschema.validate(job, schema)
+
+def _load_line(line, base):
+    """Read a job description from a line of a JSON Lines stream.
+    """
+    return _resolve(json.loads(line), base)
+
+
+def _resolve(job, base):
+    """Make names of files with file records absolute.
+    """
+    if isinstance(job, dict):
+        for key in ('data', 'calibs'):
+            if isinstance(job.get(key), six.string_types):
+                job[key] = os.path.join(base, job[key])
+    return job
+
+
+def load_schema(path=None):
+    """Read the schema describing valid job descriptions.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        File with the JSON schema. If None (default), internal schema is used.
+
+    Returns
+    -------
+    `dict`
+        The schema.
+    """
+    if path is None:
+        logger.info('Using internal schema.')
+        return default
+    logger.info('Using schema from \'{}\'.'.format(path))
+    with open(path, 'r') as s:
+        return json.load(s)
+
+
+def create_mapper(args):
+    """Build a map between task names and their code.
+
+    Parameters
+    ----------
+    args : `argparse.Namespace`
+        Command line options.
+
+    Returns
+    -------
+    `TaskMapper`
+        A map between task names and modules and classes implementing them.
+    """
+    snowflakes = {
+        'ingestImages': ('lsst.pipe.tasks.ingest', 'IngestTask'),
+    }
+    index = TaskIndex(args.index, rebuild=args.rebuild)
+
+    # During a dry run tasks are only located, their modules are imported
+    # only if they are used.
+    return TaskMapper(['lsst.pipe.tasks'], special=snowflakes, index=index,
+                      lazy=args.lazy, defer=args.dryrun is not True)
+
+
+class Session(object):
+    """State shared by all jobs executed by the executor.
+
+    Parameters
+    ----------
+    args : `argparse.Namespace`
+        Command line options.
+
+    Attributes
+    ----------
+    args : `argparse.Namespace`
+        Command line options.
+    schema : `dict`
+        JSON schema job descriptions must conform to.
+    mapper : `TaskMapper`
+        A map between task names and their code.
+    cache : `CalibCache` or None
+        Node-local cache of calibration files, if enabled.
+    templates : `TemplateStore` or None
+        Store of repository templates, if enabled.
+    recorder : `Recorder`
+        Measurements of the executor's startup phases.
+    pool : `WorkerPool` or None
+        Pool of worker processes running LSST tasks, if enabled.
+    """
+
+    def __init__(self, args, recorder=None):
+        self.args = args
+        self.recorder = Recorder() if recorder is None else recorder
+        with self.recorder.phase('load schema', category='startup'):
+            self.schema = load_schema(args.schema)
+
+        # The validator is compiled when it is needed for the first time,
+        # unless jobs are executed by forked processes which should inherit
+        # it.
+        if args.processes > 1 or args.serve is not None:
+            with self.recorder.phase('compile validator',
+                                     category='startup'):
+                get_validator(self.schema)
+        with self.recorder.phase('build task map', category='startup'):
+            self.mapper = create_mapper(args)
+        self.cache = None
+        if args.calib_cache is not None:
+            budget = None
+            if args.calib_cache_size is not None:
+                budget = int(args.calib_cache_size * MB)
+            self.cache = CalibCache(args.calib_cache, budget=budget)
+        self.templates = None
+        if args.templates is not None:
+            self.templates = TemplateStore(args.templates)
+        self.pool = None
+        if args.isolate:
+            size = args.pool_size if args.pool_size is not None else args.jobs
+            self.pool = WorkerPool(size=size)
+
+
+def required_tasks(job):
+    """List the tasks required to execute a job.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+
+    Returns
+    -------
+    `list` of `str`
+        Names of the tasks.
+    """
+    names = [job['task']['name']]
+    if job.get('data') is not None and not job['input'].get('readonly', True):
+        names.append('ingestImages')
+        if job.get('calibs') is not None:
+            names.append('ingestCalibs')
+    return names
+
+
+def run_job(job, session, recorder=None):
+    """Execute an LSST task described by a job description.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+    session : `Session`
+        State shared between jobs.
+    recorder : `Recorder`, optional
+        Recorder measuring the execution phases of the job and its commands.
+    """
+    args, mapper = session.args, session.mapper
+    if recorder is None:
+        recorder = Recorder()
+    logger.info('Validating job description.')
+    with recorder.phase('validate job description'):
+        validate(job, session.schema)
+
+    # Data and calibration records may be listed in separate files, they are
+    # read (and validated) only when needed.
+    open_streams(job, schema=session.schema)
 
     # Mark input dataset repository as read only, unless specified otherwise
     # explicitly in job description.
     repo = job['input']
     repo.setdefault('readonly', True)
+    repo.setdefault('ingest_mode', 'copy')
 
-    # Build a map between task names and their code, i.e. modules and classes.
-    snowflakes = {
-        'ingestImages': ('lsst.pipe.tasks.ingest', 'IngestTask'),
-    }
-    mapper = TaskMapper(['lsst.pipe.tasks'], special=snowflakes)
+    # Resolve all the tasks the job requires upfront.
+    with recorder.phase('resolve tasks'):
+        mapper.preload(required_tasks(job))
+
+    # Workers are forked before any threads are started and once the tasks
+    # are imported, so they have them already.
+    if session.pool is not None and args.dryrun is True:
+        with recorder.phase('start worker processes'):
+            session.pool.start()
+
+    # Input files are prefetched to the scratch space only when they are
+    # going to be ingested.
+    stager = None
+    if args.scratch is not None and not repo['readonly']:
+        makedirs(args.scratch)
+        path = tempfile.mkdtemp(prefix='prefetch', dir=args.scratch)
+        stager = Stager(path, workers=args.prefetch_workers,
+                        bandwidth=args.prefetch_bandwidth)
 
     logger.info('Populating command queue...')
+    try:
+        with recorder.phase('populate command queue'):
+            queue = enqueue(job, session, stager=stager)
+        execute_queue(queue, job, session, recorder)
+    finally:
+        if stager is not None:
+            stager.close()
+            logger.info('Prefetched {files} file(s), {size:.1f} MB.'
+                        .format(files=stager.stats['files'],
+                                size=stager.stats['bytes'] / MB))
+
+
+def execute_queue(queue, job, session, recorder):
+    """Execute the commands of a job.
+
+    Parameters
+    ----------
+    queue : `list` of `Command`
+        The commands.
+    job : `dict`
+        Job description.
+    session : `Session`
+        State shared between jobs.
+    recorder : `Recorder`
+        Recorder measuring the execution of the commands.
+    """
+    args = session.args
+    logger.info('Finished building, starting to execute commands...')
+    hooks = [recorder.hook]
+    if args.profile is not None:
+        root = os.path.join(job['output']['root'], 'profile')
+        commands = None if args.profile == 'all' else [args.profile]
+        profiler = Profiler(root, kind=args.profiler, commands=commands)
+        hooks.append(profiler.hook)
+    if args.dryrun is True:
+        journal = open_journal(job, resume=args.resume)
+        scheduler = Scheduler(workers=args.jobs, hooks=hooks, journal=journal)
+        scheduler.run(queue)
+    else:
+        for cmd in queue:
+            logger.debug('Executing: {!r}'.format(cmd))
+
+
+def open_journal(job, resume=True):
+    """Open the journal of the commands building the job's input repository.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+    resume : `bool`, optional
+        If False, the existing journal is discarded. Defaults to True.
+
+    Returns
+    -------
+    `Journal` or None
+        The journal, or None if the job does not build the repository.
+
+    Notes
+    -----
+    If a command which cannot be safely executed again, e.g. ingesting
+    files, was interrupted, the repository is removed and the journal is
+    discarded, so the repository is built again from scratch.
+    """
+    repo = job['input']
+    if repo.get('readonly', True) or job.get('data') is None:
+        return None
+    root = repo['root']
+
+    # A journal of a repository which does not exist (anymore) is useless.
+    reset = not resume or not os.path.isdir(root)
+    journal = Journal(locate(root), TemplateStore.fingerprint(job),
+                      reset=reset)
+    interrupted = journal.interrupted()
+    if interrupted:
+        logger.warning('Building repository \'{}\' was interrupted while '
+                       'executing: {}; building it again from scratch.'
+                       .format(root, interrupted[0]))
+        shutil.rmtree(root, ignore_errors=True)
+        journal.reset()
+    return journal
+
+
+def enqueue(job, session, stager=None):
+    """Create the sequence of commands required to execute a job.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+    session : `Session`
+        State shared between jobs.
+    stager : `Stager`, optional
+        Stager prefetching input files to a node-local scratch space.
+
+    Returns
+    -------
+    `list` of `Commands`
+        Commands building or validating the input dataset repository, if
+        required, and running the LSST task.
+    """
+    args, mapper = session.args, session.mapper
     queue = []
 
     # If the job description contains list of file specifications, either
@@ -191,11 +747,18 @@ def execute(argv):
         if isreadonly:
             logger.info('Using pre-existing input dataset repository; '
                         'enqueuing instructions for validation.')
-            cmds = validate_repo(job)
+            cmds = validate_repo(job, io_workers=args.io_workers,
+                                 checksums=args.checksums)
         else:
             logger.info('Creating input dataset repository from scratch; '
                         'enqueuing instructions for building.')
-            cmds = create_repo(job, mapper)
+            cmds = create_repo(job, mapper, io_workers=args.io_workers,
+                               cache=session.cache,
+                               templates=session.templates,
+                               chunk_size=args.chunk_size,
+                               ingest_workers=args.ingest_workers,
+                               stager=stager, runner=session.pool,
+                               manifest=args.manifest)
         queue.extend(cmds)
     else:
         logger.warning('Using pre-existing input dataset repository; '
@@ -208,16 +771,279 @@ def execute(argv):
     tmpl = '--output {out} {args}'
     argv = tmpl.format(out=job['output']['root'], args=' '.join(argv)).split()
     task = mapper.get_task(name)
-    cmd = RunTask(task, root, argv)
-    queue.append(cmd)
+    cmd = RunTask(task, root, argv, runner=session.pool)
+    queue.append(cmd.after(*queue))
+    return queue
 
-    # Finally, execute the enqueued commands.
-    logger.info('Finished building, starting to execute commands...')
-    if args.dryrun is True:
-        for cmd in queue:
-            logger.info('Executing: {}'.format(cmd))
-            cmd.execute()
+
+def execute(argv):
+    """Execute LSST tasks in arbitrary locations.
+
+    By default, all jobs are executed in the same process, one after another,
+    so the map between task names and their code, the classes implementing
+    the tasks, and the schema are shared between them.  Alternatively, they
+    can be executed concurrently by worker processes forked from the current
+    one, see :func:`run_parallel`.  A failing job does not prevent the
+    remaining ones from being executed.
+
+    Parameters
+    ----------
+    argv : list of `str`
+        List representing command line arguments.
+
+    Returns
+    -------
+    `int`
+        Exit status, 0 if all jobs succeeded, 1 otherwise.
+    """
+    recorder = Recorder()
+    with recorder.phase('parse arguments', category='startup'):
+        parser = create_parser()
+        args = parser.parse_args(argv[1:])
+        if args.manifest and args.scratch is not None:
+            parser.error('argument --manifest: not allowed with argument '
+                         '--scratch, prefetched files cannot be recorded')
+
+        # Without any files, job descriptions are read from the standard
+        # input only if they are piped in, not to wait for a user typing
+        # them.
+        if not args.files and args.serve is None and sys.stdin.isatty():
+            parser.error('no job specifications given, use \'-\' to read '
+                         'them from the standard input')
+
+    with recorder.phase('set up logging', category='startup'):
+        if args.logging is not None:
+            setup_logging(path=args.logging)
+        else:
+            setup_logging(level=logging.WARNING)
+    logger.info('Logger configured, starting logging events.')
+
+    session = Session(args, recorder=recorder)
+    logger.info('Startup: {}.'.format(recorder.breakdown('startup')))
+    if args.serve is not None:
+        serve(session, args.serve)
+        logger.info('Done.')
+        return 0
+    jobs = enumerate(read_jobs(args.files or ['-']), start=1)
+    if args.processes > 1:
+        records = run_parallel(jobs, session)
     else:
-        for cmd in queue:
-            logger.debug('Executing: {!r}'.format(cmd))
+        records = (run_record(source, load, session, index=index)
+                   for index, (source, load) in jobs)
+
+    results = None
+    if args.results is not None:
+        if args.results == '-':
+            results = sys.stdout
+        else:
+            results = open(args.results, 'w')
+    start = time.time()
+    outcomes = []
+    try:
+        for record in records:
+            outcomes.append(record)
+            if results is not None:
+                results.write(json.dumps(record) + '\n')
+                results.flush()
+    finally:
+        if results is not None and results is not sys.stdout:
+            results.close()
+
+    summary = summarize(outcomes, time.time() - start)
+    msg = 'Executed {jobs} job(s) in {elapsed:.2f} s: {succeeded} ' \
+          'succeeded, {failed} failed.'.format(**summary)
+    if summary['failed']:
+        msg += ' Failed: {}.'.format(', '.join(summary['failures']))
+        logger.warning(msg)
+    else:
+        logger.info(msg)
+    if session.pool is not None:
+        session.pool.close()
+    if session.cache is not None and args.processes <= 1:
+        logger.info('Calibration cache \'{}\': {hits} hit(s), {misses} '
+                    'miss(es), {evictions} eviction(s).'
+                    .format(session.cache.root, **session.cache.stats))
+    if args.summary is not None:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=4)
     logger.info('Done.')
+    return 1 if summary['failed'] else 0
+
+
+def serve(session, address):
+    """Execute jobs submitted over HTTP until the server is stopped.
+
+    Up to `session.args.processes` jobs are executed at the same time, see
+    :class:`executor.server.JobServer`.  The server is imported only when
+    needed.
+
+    Parameters
+    ----------
+    session : `Session`
+        State shared between jobs.
+    address : `str`
+        Address to listen on, see :func:`executor.server.parse_address`.
+    """
+    module = load('.server', __package__)
+    server = module.JobServer(module.parse_address(address),
+                              functools.partial(_run_submitted, session),
+                              prepare=functools.partial(_preload, session),
+                              validate=functools.partial(
+                                  validate, schema=session.schema),
+                              limit=session.args.processes)
+    server.serve_forever()
+
+
+def _run_submitted(session, source, job, index):
+    """Execute a job submitted to the server in a worker process.
+    """
+    try:
+        return run_record(source, lambda: job, session, index=index)
+    finally:
+        if session.pool is not None:
+            session.pool.close()
+
+
+def _preload(session, job):
+    """Resolve the tasks a job requires.
+    """
+    session.mapper.preload(required_tasks(job))
+
+
+def run_record(source, load, session, index=1):
+    """Execute a job and describe its outcome.
+
+    If requested, a report with measurements of the startup phases and the
+    job's execution phases and commands, and the timeline of the execution
+    in Chrome trace event format are written as well.
+
+    Parameters
+    ----------
+    source : `str`
+        Where the job description comes from.
+    load : callable
+        Function returning the job description.
+    session : `Session`
+        State shared between jobs.
+    index : `int`, optional
+        Ordinal number of the job, defaults to 1.
+
+    Returns
+    -------
+    `dict`
+        The job's result record: its source, task, status (`succeeded` or
+        `failed`), error message, if any, and execution time.
+    """
+    logger.info('Reading job description from \'{}\'.'.format(source))
+    record = {'job': source, 'task': None, 'status': 'succeeded',
+              'error': None}
+    start = time.time()
+    recorder = Recorder(origin=session.recorder.origin)
+    try:
+        with recorder.phase('read job description'):
+            job = load()
+        record['task'] = job.get('task', {}).get('name')
+        run_job(job, session, recorder=recorder)
+    except Exception as ex:
+        logger.exception('Job \'{}\' failed.'.format(source))
+        record['status'] = 'failed'
+        record['error'] = describe_error(ex)
+    record['elapsed'] = time.time() - start
+
+    args = session.args
+    if args.report is not None:
+        report = dict(record)
+        report['startup'] = session.recorder.phases
+        report['phases'] = recorder.phases
+        write_report(args.report.format(index=index), report)
+    if args.trace is not None:
+        events = session.recorder.trace() + recorder.trace()
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        write_report(args.trace.format(index=index), trace)
+    return record
+
+
+def run_parallel(jobs, session):
+    """Execute jobs concurrently in separate processes.
+
+    Each job is executed in its own process forked from the current one.
+    Hence, the worker processes start with the LSST Stack already imported
+    and the tasks already resolved, and a job can neither affect others nor,
+    if it crashes, bring down the whole run.  Before forking, the parent
+    resolves the tasks each job requires so they are resolved only once.
+
+    Parameters
+    ----------
+    jobs : iterable of `tuple`
+        Ordinal numbers of the jobs, sources of job descriptions and functions
+        returning them, see :func:`read_jobs`.
+    session : `Session`
+        State shared between jobs, `session.args.processes` sets the maximal
+        number of jobs executed at the same time.
+
+    Yields
+    ------
+    `dict`
+        Result records of the jobs, in the order they finish.
+    """
+    def prepared():
+        for index, (source, load) in jobs:
+            # Resolve the required tasks here, so the following workers
+            # inherit them. If anything goes wrong, let the worker report it.
+            try:
+                job = load()
+                session.mapper.preload(required_tasks(job))
+            except Exception:
+                pass
+            else:
+                load = functools.partial(copy.deepcopy, job)
+            yield index, source, load
+
+    run = functools.partial(_run_worker, session=session)
+    for item, record, error, elapsed in fork_map(run, prepared(),
+                                                 session.args.processes):
+        if error is not None:
+            _, source, _ = item
+            logger.error('Job \'{}\' failed: {}.'.format(source, error))
+            record = {'job': source, 'task': None, 'status': 'failed',
+                      'error': error, 'elapsed': elapsed}
+        yield record
+
+
+def _run_worker(item, session):
+    """Execute a job in a worker process and return its record.
+    """
+    index, source, load = item
+    try:
+        return run_record(source, load, session, index=index)
+    finally:
+        if session.pool is not None:
+            session.pool.close()
+
+
+def summarize(records, elapsed):
+    """Aggregate result records of the jobs.
+
+    Parameters
+    ----------
+    records : `list` of `dict`
+        Result records of the jobs.
+    elapsed : `float`
+        Wall clock time it took to execute the jobs, in seconds.
+
+    Returns
+    -------
+    `dict`
+        The summary report: number of executed, succeeded and failed jobs,
+        wall clock time and the total time of all jobs, and the sources of
+        the failed jobs.
+    """
+    failures = [rec['job'] for rec in records if rec['status'] != 'succeeded']
+    return {
+        'jobs': len(records),
+        'succeeded': len(records) - len(failures),
+        'failed': len(failures),
+        'elapsed': elapsed,
+        'total': sum(rec['elapsed'] for rec in records),
+        'failures': failures,
+    }
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """Record of the commands of a job which were completed.
+
+    The journal is a JSON Lines file, each line describes a completed
+    command.  The lines are written (and synced to the disk) as soon as the
+    commands are completed, so the journal survives the executor's crash.
+    When the job is executed again, the commands already completed can be
+    skipped, see :class:`Scheduler`.  Commands which cannot be safely
+    executed again once they were interrupted, e.g. ingesting files, are
+    recorded when they are started as well, so such an interruption can be
+    detected, see :meth:`interrupted`.
+
+    The journal is valid only for the job's input it was created for.  If the
+    input changed, the existing journal is discarded.
+
+    Parameters
+    ----------
+    path : `str`
+        Location of the journal.
+    key : `str`
+        Fingerprint of the job's input.
+    reset : `bool`, optional
+        If True, the existing journal is discarded. Defaults to False.
+    """
+
+    def __init__(self, path, key, reset=False):
+        self.path = path
+        self.key = key
+        self.completed = set()
+        self.started = {}
+        self.lock = threading.Lock()
+        if reset:
+            self.reset()
+        else:
+            self.load()
+
+    def __repr__(self):
+        tmpl = '{cls}({path!r}, {key!r})'
+        return tmpl.format(cls=self.__class__.__name__, path=self.path,
+                           key=self.key)
+
+    def load(self):
+        """Read the journal.
+
+        Lines which cannot be parsed, e.g. a line partially written when the
+        executor crashed, are ignored.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                key, command = entry['input'], entry['command']
+            except (ValueError, KeyError, TypeError):
+                continue
+            if key != self.key:
+                logger.warning('Journal \'{}\' was created for a different '
+                               'input; discarding it.'.format(self.path))
+                self.reset()
+                return
+            if 'completed' in entry:
+                self.completed.add(command)
+            else:
+                self.started[command] = entry.get('description', command)
+        if self.completed:
+            logger.info('Journal \'{}\': {} completed command(s).'
+                        .format(self.path, len(self.completed)))
+
+    def reset(self):
+        """Discard the journal.
+        """
+        self.completed = set()
+        self.started = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def has(self, cmd):
+        """Check if a command was completed.
+
+        Parameters
+        ----------
+        cmd : `Command`
+            The command.
+
+        Returns
+        -------
+        `bool`
+            True if the command was completed, False otherwise.
+        """
+        return cmd.fingerprint() in self.completed
+
+    def interrupted(self):
+        """List commands which were started but never completed.
+
+        Returns
+        -------
+        `list` of `str`
+            Descriptions of the commands.
+        """
+        return [description
+                for command, description in sorted(self.started.items())
+                if command not in self.completed]
+
+    def start(self, cmd):
+        """Record the start of a command.
+
+        Parameters
+        ----------
+        cmd : `Command`
+            The command.
+        """
+        fingerprint = cmd.fingerprint()
+        self._write(fingerprint, str(cmd), 'started')
+        with self.lock:
+            self.started[fingerprint] = str(cmd)
+
+    def record(self, cmd):
+        """Record the completion of a command.
+
+        Parameters
+        ----------
+        cmd : `Command`
+            The command.
+        """
+        fingerprint = cmd.fingerprint()
+        self._write(fingerprint, str(cmd), 'completed')
+        with self.lock:
+            self.completed.add(fingerprint)
+
+    def _write(self, fingerprint, description, event):
+        """Append an entry to the journal and sync it to the disk.
+        """
+        entry = {
+            'input': self.key,
+            'command': fingerprint,
+            'description': description,
+            event: time.time(),
+        }
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def locate(root):
+    """Return the location of the journal of a repository.
+
+    The journal is placed next to the repository, as a hidden file named
+    after it.
+
+    Parameters
+    ----------
+    root : `str`
+        Location of the repository.
+
+    Returns
+    -------
+    `str`
+        Location of the journal.
+    """
+    dirname, basename = os.path.split(os.path.abspath(root))
+    return os.path.join(dirname, '.{}.journal'.format(basename))
@@ -0,0 +1,298 @@
+import logging
+import os
+from .imports import load
+
+
+# Name of the manifest within a dataset repository.
+MANIFEST = 'manifest.sqlite3'
+
+# Maximal number of parameters of a single query.
+BATCH_SIZE = 500
+
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest(object):
+    """Record of files placed in a dataset repository.
+
+    For each file, the manifest holds its physical name, its location in the
+    repository, the size and the modification time of the source file, and
+    the checksum of its content.  Files are recorded before they are placed
+    (write-ahead) in the state 'pending', so if placing them is interrupted,
+    files which may be incomplete are known.  Once placed, their records are
+    completed and their state becomes 'done', or 'staged' if they were
+    placed in a staging area and will be moved to their final locations.
+
+    The manifest is an SQLite database within the repository, indexed by
+    the locations, the physical names, and the checksums of the files.  Locations are stored
+    relative to the root of the repository, so the manifest remains valid if
+    the repository is cloned.  Each method uses a connection of its own,
+    hence the manifest can be used by many threads at the same time.
+
+    Parameters
+    ----------
+    root : `str`
+        Location of the repository.
+
+    Attributes
+    ----------
+    path : `str`
+        Name of the database.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, MANIFEST)
+
+    def __repr__(self):
+        tmpl = '{cls}({root!r})'
+        return tmpl.format(cls=self.__class__.__name__, root=self.root)
+
+    def exists(self):
+        """Check if the manifest exists.
+        """
+        return os.path.isfile(self.path)
+
+    def expect(self, pairs):
+        """Record files which are about to be placed in the repository.
+
+        Earlier records of files at the same locations are replaced.
+
+        Parameters
+        ----------
+        pairs : iterable of `tuple` of `str`
+            Physical names of the files and their locations.
+        """
+        rows = [(pfn, self._relative(dst), 'pending') for pfn, dst in pairs]
+        query = 'INSERT OR REPLACE INTO files (pfn, dest, state) ' \
+                'VALUES (?, ?, ?)'
+        with self._connect() as conn:
+            conn.executemany(query, rows)
+
+    def confirm(self, entries, state='done'):
+        """Complete records of files which have been placed.
+
+        Parameters
+        ----------
+        entries : iterable of `tuple`
+            Entries describing the placed files, see :meth:`entry`.
+        state : {'done', 'staged'}, optional
+            State of the files. Defaults to 'done'.
+        """
+        rows = [(size, mtime, digest, algorithm, state, self._relative(dst))
+                for dst, size, mtime, digest, algorithm in entries]
+        query = 'UPDATE files SET size = ?, mtime = ?, checksum = ?, ' \
+                'algorithm = ?, state = ? WHERE dest = ?'
+        with self._connect() as conn:
+            conn.executemany(query, rows)
+
+    def relocate(self, moves):
+        """Record new locations of staged files.
+
+        Parameters
+        ----------
+        moves : iterable of `tuple` of `str`
+            Locations of the files in the staging area and their final
+            locations in the repository.
+
+        Returns
+        -------
+        `int`
+            Number of updated records.
+        """
+        rows = [(self._relative(dst), self._relative(src))
+                for src, dst in moves]
+        query = 'UPDATE OR REPLACE files SET dest = ?, state = \'done\' ' \
+                'WHERE dest = ? AND state = \'staged\''
+        count = 0
+        with self._connect() as conn:
+            for row in rows:
+                count += conn.execute(query, row).rowcount
+        return count
+
+    def lookup(self, paths):
+        """Find records of files at given locations.
+
+        Parameters
+        ----------
+        paths : iterable of `str`
+            Locations of the files.
+
+        Returns
+        -------
+        `dict`
+            Records of the recorded files, keyed by their locations as given.
+            Each record contains the fields **pfn**, **size**, **mtime**,
+            **checksum**, **algorithm**, and **state**.
+        """
+        wanted = dict((self._relative(path), path) for path in paths)
+        keys = list(wanted)
+        found = {}
+        if not keys or not self.exists():
+            return found
+        query = 'SELECT dest, pfn, size, mtime, checksum, algorithm, state ' \
+                'FROM files WHERE dest IN ({})'
+        with self._connect() as conn:
+            for start in range(0, len(keys), BATCH_SIZE):
+                batch = keys[start:start + BATCH_SIZE]
+                cursor = conn.execute(
+                    query.format(', '.join('?' * len(batch))), batch)
+                for row in cursor:
+                    found[wanted[row[0]]] = _record(row)
+        return found
+
+    def locate(self, pfns):
+        """Find where files from given sources were placed.
+
+        Parameters
+        ----------
+        pfns : iterable of `str`
+            Physical names of the files.
+
+        Returns
+        -------
+        `dict`
+            Locations of the placed files in the repository, keyed by their
+            physical names.  If a file was placed at many locations, the
+            first one in alphabetical order is given.
+        """
+        keys = list(set(pfns))
+        found = {}
+        if not keys or not self.exists():
+            return found
+        query = 'SELECT pfn, dest FROM files WHERE state = \'done\' AND ' \
+                'pfn IN ({}) ORDER BY dest DESC'
+        with self._connect() as conn:
+            for start in range(0, len(keys), BATCH_SIZE):
+                batch = keys[start:start + BATCH_SIZE]
+                cursor = conn.execute(
+                    query.format(', '.join('?' * len(batch))), batch)
+                for pfn, dest in cursor:
+                    found[pfn] = os.path.join(self.root, dest)
+        return found
+
+    def find(self, digest, algorithm):
+        """Find placed files with a given checksum, e.g. to deduplicate them.
+
+        Parameters
+        ----------
+        digest : `str`
+            Checksum of the file's content.
+        algorithm : `str`
+            Name of the algorithm the checksum was computed with.
+
+        Returns
+        -------
+        `list` of `str`
+            Locations of the files in the repository.
+        """
+        if not self.exists():
+            return []
+        query = 'SELECT dest FROM files WHERE checksum = ? AND ' \
+                'algorithm = ? AND state = \'done\' ORDER BY dest'
+        with self._connect() as conn:
+            rows = conn.execute(query, (digest, algorithm)).fetchall()
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    def incomplete(self):
+        """List files which may not have been placed completely.
+
+        Returns
+        -------
+        `list` of `str`
+            Locations of the files in the repository.
+        """
+        if not self.exists():
+            return []
+        query = 'SELECT dest FROM files WHERE state = \'pending\' ' \
+                'ORDER BY dest'
+        with self._connect() as conn:
+            rows = conn.execute(query).fetchall()
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    @staticmethod
+    def entry(src, dst, digest):
+        """Describe a placed file.
+
+        Parameters
+        ----------
+        src : `str`
+            Source file.
+        dst : `str`
+            Location of the file in the repository.
+        digest : hash object or `tuple` of `str`
+            Hash object the file's content was fed to, see
+            :func:`executor.files.new_hash`, or the checksum of the content
+            and the name of the algorithm it was computed with.
+
+        Returns
+        -------
+        `tuple`
+            Location, size and modification time of the source file, the
+            checksum and the name of the algorithm.
+        """
+        st = os.stat(src)
+        if isinstance(digest, tuple):
+            value, algorithm = digest
+        else:
+            value, algorithm = digest.hexdigest(), digest.name
+        return dst, st.st_size, st.st_mtime, value, algorithm
+
+    def _connect(self):
+        """Connect to the database, creating it if necessary.
+
+        Returns
+        -------
+        `_Connection`
+            Connection which can be used as a context manager, committing
+            the transaction and closing the connection on exit.
+        """
+        conn = load('sqlite3').connect(self.path, timeout=60.0)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                         'dest TEXT PRIMARY KEY, '
+                         'pfn TEXT NOT NULL, '
+                         'size INTEGER, '
+                         'mtime REAL, '
+                         'checksum TEXT, '
+                         'algorithm TEXT, '
+                         'state TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_checksum '
+                         'ON files (checksum)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_pfn '
+                         'ON files (pfn)')
+        return _Connection(conn)
+
+    def _relative(self, path):
+        """Return the location of a file relative to the repository's root.
+        """
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+
+class _Connection(object):
+    """Connection to the manifest used within a single transaction.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+        return False
+
+
+def _record(row):
+    """Convert a row of the manifest into a record.
+    """
+    keys = ('pfn', 'size', 'mtime', 'checksum', 'algorithm', 'state')
+    return dict(zip(keys, row[1:]))
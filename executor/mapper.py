@@ -1,7 +1,169 @@
+import collections
+import errno
 import importlib
 import inspect
+import json
+import logging
+import os
 import pkgutil
 import pyclbr
+import sys
+import tempfile
+import threading
+import types
+from multiprocessing.pool import ThreadPool
+from .imports import load
+
+
+logger = logging.getLogger(__name__)
+
+
+# Default location of the persistent task index.
+INDEX_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME',
+                   os.path.join(os.path.expanduser('~'), '.cache')),
+    'executor', 'tasks.json')
+
+
+class TaskIndex(object):
+    """Persistent index of the tasks defined in inspected modules.
+
+    Finding tasks in a package requires parsing every module it contains with
+    :mod:`pyclbr` which, for large packages, takes seconds.  The index stores
+    on disk the tasks found in each module together with the module's
+    modification time and size.  On subsequent runs only the modules which
+    changed since they were indexed are parsed again.
+
+    Entries are keyed by absolute paths of modules' source files so modules
+    from different installations of a package never share an entry.
+
+    Parameters
+    ----------
+    path : `str`
+        Location of the index file.
+    rebuild : `bool`, optional
+        If True, the existing index (if any) is discarded and built from
+        scratch. Defaults to False.
+    """
+
+    version = 1
+
+    def __init__(self, path, rebuild=False):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.modified = rebuild
+        if not rebuild:
+            self.load()
+
+    def __repr__(self):
+        tmpl = '{cls}({path!r})'
+        return tmpl.format(cls=self.__class__.__name__, path=self.path)
+
+    @property
+    def stats(self):
+        """`dict`: Index hit/miss counts and the number of its entries."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.entries)}
+
+    def load(self):
+        """Read the index from disk.
+
+        A missing, unreadable, or outdated index file is not an error, the
+        index is simply going to be rebuilt.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                content = json.load(f)
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                logger.warning('Cannot read task index \'{}\': {}; '
+                               'rebuilding it.'.format(self.path, ex))
+            return
+        except ValueError:
+            logger.warning('Task index \'{}\' is corrupted; '
+                           'rebuilding it.'.format(self.path))
+            return
+        if content.get('version') != self.version:
+            logger.info('Task index \'{}\' is outdated; '
+                        'rebuilding it.'.format(self.path))
+            return
+        self.entries = content['modules']
+
+    def save(self):
+        """Write the index to disk if it was modified.
+
+        The index is written to a temporary file first and then moved to its
+        final location so concurrently running executors never see a
+        partially written index.  Failing to save the index is not fatal.
+        """
+        if not self.modified:
+            return
+        content = {'version': self.version, 'modules': self.entries}
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        try:
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tasks')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as ex:
+            logger.warning('Cannot save task index to \'{}\': '
+                           '{}.'.format(self.path, ex))
+            return
+        self.modified = False
+
+    def lookup(self, filename):
+        """Return tasks defined in a module if its entry is up to date.
+
+        Parameters
+        ----------
+        filename : `str`
+            Absolute path to the module's source file.
+
+        Returns
+        -------
+        `dict` or None
+            Mapping between class names and names of the modules they are
+            defined in or None if the module was not indexed or changed since.
+        """
+        entry = self.entries.get(filename)
+        if entry is not None and entry['signature'] == self.sign(filename):
+            self.hits += 1
+            return entry['tasks']
+        self.misses += 1
+        return None
+
+    def update(self, filename, tasks):
+        """Record tasks defined in a module.
+
+        Parameters
+        ----------
+        filename : `str`
+            Absolute path to the module's source file.
+        tasks : `dict`
+            Mapping between class names and names of the modules they are
+            defined in.
+        """
+        signature = self.sign(filename)
+        if signature is None:
+            return
+        self.entries[filename] = {'signature': signature, 'tasks': tasks}
+        self.modified = True
+
+    @staticmethod
+    def sign(filename):
+        """Return the signature of a file, i.e., its mtime and size.
+
+        Returns None if the file does not exist.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_size]
 
 
 class TaskMapper(object):
@@ -27,19 +189,163 @@ class TaskMapper(object):
 
            'ingestImages': ('lsst.pipe.tasks.ingest', 'IngestTask')
 
+    index : `TaskIndex`, optional
+        Persistent index of the tasks. If specified, only modules which
+        changed since they were indexed are parsed.
+    lazy : `bool`, optional
+        If True, packages are not inspected when the mapper is created.
+        Instead, each task is resolved when it is requested for the first
+        time, see :meth:`resolve`. Defaults to False.
+    cache_size : `int`, optional
+        Maximal number of task classes kept in the cache of recently
+        requested tasks. Defaults to 128.
+    defer : `bool`, optional
+        If True, modules implementing the tasks are not imported when the
+        tasks are requested, :meth:`get_task` returns placeholders importing
+        them when they are used instead, see :class:`LazyTask`. Defaults to
+        False.
     """
 
-    def __init__(self, pkg_names, special=None):
-        self.map = {}
-        packages = [importlib.import_module(name) for name in pkg_names]
+    def __init__(self, pkg_names, special=None, index=None, lazy=False,
+                 cache_size=128, defer=False):
+        self.pkg_names = list(pkg_names)
+        self.special = dict(special) if special is not None else {}
+        self.index = index
+        self.defer = defer
+        self.scanned = False
+        self.map = dict(self.special)
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.RLock()
+        if not lazy:
+            self.scan()
+
+    def scan(self):
+        """Map all tasks in the inspected packages.
+
+        Task locations provided explicitly as special cases take precedence
+        over the ones found in the packages.
+        """
+        packages = [_find_package(name) for name in self.pkg_names]
         for pkg in packages:
-            self.map.update(self.map_tasks(pkg))
-        if special is not None:
-            self.map.update(special)
+            self.map.update(self.map_tasks(pkg, index=self.index))
+        self.map.update(self.special)
+        self.scanned = True
+        msg = 'Mapped {} task(s) in {}'.format(len(self.map),
+                                               ', '.join(self.pkg_names))
+        if self.index is not None:
+            self.index.save()
+            msg += '; task index \'{path}\': {hits} hit(s), {misses} ' \
+                   'miss(es).'.format(path=self.index.path, **self.index.stats)
+        else:
+            msg += '.'
+        logger.info(msg)
+
+    def resolve(self, task_name):
+        """Find the module and the class implementing a given task.
+
+        First, the task is looked for in a module named after the task
+        in each of the inspected packages, i.e. for the task `doSomething`
+        the class `DoSomethingTask` is looked for in modules `doSomething`
+        and `dosomething`.  Only if it is not there, all inspected packages
+        are scanned.
+
+        Parameters
+        ----------
+        task_name : `str`
+            Name of the LSST task.
+
+        Returns
+        -------
+        `tuple` of `str`
+            Names of the module and the class implementing the task.
+
+        Raises
+        ------
+        `ValueError`
+            If the task was not found.
+        """
+        with self.lock:
+            if task_name in self.map:
+                return self.map[task_name]
+            scanned = self.scanned
+        if not scanned:
+            location = self.guess(task_name)
+            with self.lock:
+                if location is not None:
+                    logger.debug('Task \'{}\' found in \'{}\'.'
+                                 .format(task_name, location[0]))
+                    return self.map.setdefault(task_name, location)
+                if not self.scanned:
+                    logger.info('Task \'{}\' does not follow naming '
+                                'conventions; scanning packages.'
+                                .format(task_name))
+                    self.scan()
+        try:
+            return self.map[task_name]
+        except KeyError:
+            raise ValueError('Task \'%s\' not found.' % task_name)
+
+    def guess(self, task_name):
+        """Look for a task in modules named after it.
+
+        Parameters
+        ----------
+        task_name : `str`
+            Name of the LSST task.
+
+        Returns
+        -------
+        `tuple` of `str` or None
+            Names of the module and the class implementing the task or None
+            if the task is not where the naming conventions say it should be.
+        """
+        if not task_name:
+            return None
+        cls_name = task_name[0].upper() + task_name[1:] + 'Task'
+        mod_names = [task_name]
+        if task_name.lower() != task_name:
+            mod_names.append(task_name.lower())
+        for pkg_name in self.pkg_names:
+            for mod_name in mod_names:
+                mod_name = pkg_name + '.' + mod_name
+                try:
+                    mod = load(mod_name)
+                except ImportError:
+                    continue
+                if inspect.isclass(getattr(mod, cls_name, None)):
+                    return mod_name, cls_name
+        return None
 
     def get_task(self, task_name):
         """Return the class representing a given task.
 
+        If the mapper defers imports, the task is only located and
+        a placeholder of its class is returned instead.
+
+        Parameters
+        ----------
+        task_name : `str`
+            Name of the LSST task.
+
+        Returns
+        -------
+        task : CmdLineTask or `LazyTask`
+            Class representing a given task.
+
+        Raises
+        ------
+        `ValueError`
+            If the task was not found.
+        """
+        if self.defer:
+            self.resolve(task_name)
+            return LazyTask(self, task_name)
+        return self.load(task_name)
+
+    def load(self, task_name):
+        """Return the class representing a given task, importing it.
+
         Parameters
         ----------
         task_name : `str`
@@ -55,17 +361,67 @@ class TaskMapper(object):
         `ValueError`
             If the task was not found.
         """
+        with self.lock:
+            try:
+                cls = self.cache.pop(task_name)
+            except KeyError:
+                pass
+            else:
+                self.cache[task_name] = cls
+                return cls
+        mod_name, cls_name = self.resolve(task_name)
+        mod = load(mod_name)
         try:
-            mod_name, cls_name = self.map[task_name]
-        except KeyError:
+            cls = getattr(mod, cls_name)
+        except AttributeError:
             raise ValueError('Task \'%s\' not found.' % task_name)
-        mod = importlib.import_module(mod_name)
-        classes = {name: cls
-                   for name, cls in inspect.getmembers(mod, inspect.isclass)}
-        return classes[cls_name]
+        with self.lock:
+            self.cache[task_name] = cls
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return cls
+
+    def preload(self, task_names, workers=4):
+        """Resolve multiple tasks concurrently.
+
+        Importing modules implementing the tasks is the most expensive part
+        of the task look up.  Use this method to resolve all the tasks a job
+        requires upfront, so subsequent calls to :meth:`get_task` are
+        merely cache look ups.  If the mapper defers imports, the tasks are
+        only located.
+
+        Parameters
+        ----------
+        task_names : iterable of `str`
+            Names of the LSST tasks.
+        workers : `int`, optional
+            Maximal number of threads resolving the tasks. Defaults to 4.
+
+        Returns
+        -------
+        `dict`
+            Classes representing the tasks, keyed by task names.
+
+        Raises
+        ------
+        `ValueError`
+            If any of the tasks was not found.
+        """
+        names = list(collections.OrderedDict.fromkeys(task_names))
+        if not names:
+            return {}
+        if self.defer:
+            return dict((name, self.get_task(name)) for name in names)
+        pool = ThreadPool(max(1, min(workers, len(names))))
+        try:
+            classes = pool.map(self.get_task, names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(names, classes))
 
     @staticmethod
-    def map_tasks(pkg):
+    def map_tasks(pkg, index=None):
         """Map task names to their modules and classes.
 
         The method assumes that the task name is practically identical with
@@ -81,13 +437,110 @@ class TaskMapper(object):
         ----------
         pkg : `str`
             Package to search.
+        index : `TaskIndex`, optional
+            Persistent index of the tasks. Modules with up to date entries
+            in the index are not parsed.
         """
         tasks = {}
-        for _, mod, _ in pkgutil.iter_modules(pkg.__path__):
-            classes = pyclbr.readmodule(mod, path=pkg.__path__)
-            tasks.update({name: pkg.__name__ + '.' + cls.module
-                          for name, cls in classes.items()
-                          if (cls.module == mod and
-                              cls.name.lower().endswith('task'))})
+        for importer, mod, ispkg in pkgutil.iter_modules(pkg.__path__):
+            filename = None
+            found = None
+            if index is not None:
+                filename = _get_source(importer, mod, ispkg)
+                if filename is not None:
+                    found = index.lookup(filename)
+            if found is None:
+                classes = pyclbr.readmodule(mod, path=pkg.__path__)
+                found = {name: pkg.__name__ + '.' + cls.module
+                         for name, cls in classes.items()
+                         if (cls.module == mod and
+                             cls.name.lower().endswith('task'))}
+                if filename is not None:
+                    index.update(filename, found)
+            tasks.update(found)
         return {cls[0].lower() + cls[1:-4]: (mod, cls)
                 for cls, mod in tasks.items()}
+
+
+class LazyTask(object):
+    """Placeholder of a task class, importing the class when it is used.
+
+    Accessing any attribute of the class, e.g. calling its `parseAndRun()`
+    method, through the placeholder imports the module implementing the task.
+
+    Parameters
+    ----------
+    mapper : `TaskMapper`
+        The mapper which located the task.
+    task_name : `str`
+        Name of the LSST task.
+    """
+
+    def __init__(self, mapper, task_name):
+        self.mapper = mapper
+        self.task_name = task_name
+
+    def __repr__(self):
+        mod_name, cls_name = self.mapper.resolve(self.task_name)
+        tmpl = '{cls}(\'{mod}.{name}\')'
+        return tmpl.format(cls=self.__class__.__name__, mod=mod_name,
+                           name=cls_name)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('mapper', 'task_name'):
+            raise AttributeError(name)
+        return getattr(self.mapper.load(self.task_name), name)
+
+
+def _find_package(name):
+    """Locate a package, avoiding importing it if possible.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the package.
+
+    Returns
+    -------
+    module
+        The package, if it was already imported or it cannot be located
+        otherwise, or a module object standing in for it, with the same name
+        and search path.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        return importlib.import_module(name)
+    spec = find_spec(name)
+    if spec is None or spec.submodule_search_locations is None:
+        return importlib.import_module(name)
+    pkg = types.ModuleType(name)
+    pkg.__path__ = list(spec.submodule_search_locations)
+    return pkg
+
+
+def _get_source(importer, mod, ispkg):
+    """Return the absolute path to the source file of a module.
+
+    Parameters
+    ----------
+    importer : importer
+        Importer which found the module, as reported by
+        :func:`pkgutil.iter_modules`.
+    mod : `str`
+        Name of the module.
+    ispkg : `bool`
+        True if the module is a package.
+
+    Returns
+    -------
+    `str` or None
+        Path to the source file or None if it cannot be determined.
+    """
+    path = getattr(importer, 'path', None)
+    if path is None:
+        return None
+    parts = [mod, '__init__.py'] if ispkg else [mod + '.py']
+    return os.path.join(os.path.abspath(path), *parts)
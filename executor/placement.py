@@ -0,0 +1,402 @@
+import argparse
+import collections
+import json
+import logging
+import math
+import os
+import six
+from .files import MB, makedirs
+from .invoker import read_jobs, setup_logging
+from .processes import describe_error
+from .records import RecordStream
+from .schema import validate
+
+
+logger = logging.getLogger(__name__)
+
+
+class Node(object):
+    """A node jobs can be placed on.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the node.
+    mounts : `list` of `str`, optional
+        Directories local to the node. Files within them can be read without
+        transferring them over the network.
+    slots : `int`, optional
+        Relative capacity of the node, e.g. the number of jobs it can execute
+        at the same time. Defaults to 1.
+
+    Attributes
+    ----------
+    jobs : `list` of `Job`
+        Jobs placed on the node.
+    resident : `dict`
+        Sizes of the input files of the jobs placed on the node, keyed by
+        their physical names.  Once a file is fetched to the node, e.g. to the
+        calibration cache, subsequent jobs can use it without fetching it
+        again.
+    """
+
+    def __init__(self, name, mounts=(), slots=1):
+        self.name = name
+        self.mounts = [os.path.realpath(path) for path in mounts]
+        self.slots = slots
+        self.jobs = []
+        self.resident = {}
+
+    def __repr__(self):
+        tmpl = '{cls}({name!r}, {mounts!r}, slots={slots})'
+        return tmpl.format(cls=self.__class__.__name__, name=self.name,
+                           mounts=self.mounts, slots=self.slots)
+
+    def is_local(self, path):
+        """Check if a file is local to the node.
+
+        Parameters
+        ----------
+        path : `str`
+            Real path of the file.
+        """
+        return any(path == mount or path.startswith(mount.rstrip(os.sep) +
+                                                    os.sep)
+                   for mount in self.mounts)
+
+
+class Job(object):
+    """A job to place.
+
+    Parameters
+    ----------
+    source : `str`
+        Where the job description comes from.
+    description : `dict`
+        Job description, as read.
+    inputs : `dict`
+        Sizes of the job's data and calibration files, keyed by their
+        physical names.
+    calibs : `frozenset` of `str`
+        Physical names of the job's calibration files.
+    """
+
+    def __init__(self, source, description, inputs, calibs=frozenset()):
+        self.source = source
+        self.description = description
+        self.inputs = inputs
+        self.calibs = calibs
+
+    def __repr__(self):
+        tmpl = '{cls}({source!r})'
+        return tmpl.format(cls=self.__class__.__name__, source=self.source)
+
+
+def load_inventory(path):
+    """Read the inventory of nodes.
+
+    The inventory is a JSON file listing the nodes, e.g.::
+
+        {
+            "nodes": [
+                {"name": "node01", "mounts": ["/data/node01"], "slots": 8},
+                {"name": "node02", "mounts": ["/data/node02"], "slots": 8}
+            ]
+        }
+
+    Only `name` is required, see :class:`Node` for the description of the
+    remaining fields.
+
+    Parameters
+    ----------
+    path : `str`
+        Name of the file.
+
+    Returns
+    -------
+    `list` of `Node`
+        The nodes, in the order they are listed.
+
+    Raises
+    ------
+    ValueError
+        If the inventory is invalid.
+    """
+    with open(path, 'r') as f:
+        content = json.load(f)
+    entries = content.get('nodes') if isinstance(content, dict) else None
+    if not entries:
+        raise ValueError('No nodes in \'{}\'.'.format(path))
+    nodes = []
+    for entry in entries:
+        name = entry.get('name')
+        if not isinstance(name, six.string_types) or not name or \
+                os.sep in name:
+            raise ValueError('Invalid node name \'{}\' in \'{}\'.'
+                             .format(name, path))
+        mounts = entry.get('mounts', [])
+        slots = entry.get('slots', 1)
+        if not isinstance(slots, int) or slots < 1:
+            raise ValueError('Invalid number of slots of node \'{}\'.'
+                             .format(name))
+        nodes.append(Node(name, mounts=mounts, slots=slots))
+    if len(set(node.name for node in nodes)) != len(nodes):
+        raise ValueError('Duplicate node names in \'{}\'.'.format(path))
+    return nodes
+
+
+def read_inputs(job):
+    """Find the data and calibration files a job reads.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+
+    Returns
+    -------
+    inputs : `dict`
+        Sizes of the files, keyed by their physical names.  Files which are
+        not accessible count as one byte.
+    calibs : `frozenset` of `str`
+        Physical names of the calibration files.
+    """
+    inputs = collections.OrderedDict()
+    calibs = set()
+    for key in ('data', 'calibs'):
+        records = job.get(key) or []
+        if isinstance(records, six.string_types):
+            records = RecordStream(records)
+        for rec in records:
+            pfn = rec['pfn']
+            if pfn not in inputs:
+                try:
+                    inputs[pfn] = os.stat(pfn).st_size
+                except OSError:
+                    inputs[pfn] = 1
+            if key == 'calibs':
+                calibs.add(pfn)
+    return inputs, frozenset(calibs)
+
+
+def place(jobs, nodes, imbalance=0.1):
+    """Assign jobs to nodes, so they read as much as possible locally.
+
+    Jobs using the same calibration files form groups, the groups reading
+    the most data are placed first, and jobs of a group are placed one after
+    another.  Each job is placed on the node which already has most of the
+    bytes the job reads, either because the files are local to the node or
+    because jobs placed there earlier read them too.  Ties go to the least
+    loaded node.  To keep nodes evenly loaded, a node gets no more jobs than
+    its share, proportional to its slots, increased by `imbalance`.
+
+    Parameters
+    ----------
+    jobs : `list` of `Job`
+        Jobs to place.
+    nodes : `list` of `Node`
+        Nodes to place the jobs on.
+    imbalance : `float`, optional
+        Fraction by which the number of jobs placed on a node may exceed its
+        share. Defaults to 0.1.
+
+    Raises
+    ------
+    ValueError
+        If `imbalance` is negative, so the nodes could not take all jobs.
+    """
+    if imbalance < 0:
+        raise ValueError('Imbalance must not be negative: {}.'
+                         .format(imbalance))
+    total = float(sum(node.slots for node in nodes))
+    quotas = dict((node.name, int(math.ceil(len(jobs) * node.slots / total *
+                                            (1.0 + imbalance))))
+                  for node in nodes)
+
+    groups = collections.OrderedDict()
+    for job in jobs:
+        groups.setdefault(job.calibs, []).append(job)
+    ordered = sorted(groups.values(),
+                     key=lambda group: -sum(sum(job.inputs.values())
+                                            for job in group))
+
+    local = _Locality(nodes)
+    for group in ordered:
+        for job in group:
+            candidates = [node for node in nodes
+                          if len(node.jobs) < quotas[node.name]]
+            best = max(candidates, key=lambda node: (
+                _score(node, job, local),
+                -len(node.jobs) / float(node.slots),
+                -nodes.index(node)))
+            best.jobs.append(job)
+            best.resident.update(job.inputs)
+
+
+def summarize(jobs, nodes):
+    """Estimate how much data the nodes read locally and over the network.
+
+    Each node is assumed to fetch a file which is not local to it only once,
+    no matter how many jobs placed on it read the file.  For comparison, the
+    same is estimated for jobs assigned to nodes in a round robin fashion.
+
+    Returns
+    -------
+    `dict`
+        Number of jobs, the number of jobs placed on each node and the bytes
+        it reads locally and fetches, and the total number of bytes fetched
+        with the jobs placed as planned and in a round robin fashion.
+    """
+    local = _Locality(nodes)
+    report = {'jobs': len(jobs), 'nodes': {}}
+    for node in nodes:
+        read, fetched = _traffic(node, node.jobs, local)
+        report['nodes'][node.name] = {
+            'jobs': len(node.jobs),
+            'local_bytes': read,
+            'fetched_bytes': fetched,
+        }
+    report['fetched_bytes'] = sum(stats['fetched_bytes']
+                                  for stats in report['nodes'].values())
+    baseline = 0
+    for num, node in enumerate(nodes):
+        baseline += _traffic(node, jobs[num::len(nodes)], local)[1]
+    report['round_robin_fetched_bytes'] = baseline
+    return report
+
+
+def write_plan(nodes, root):
+    """Write the jobs placed on each node to a file of its own.
+
+    Job descriptions are written, one per line, to `<root>/<node>.jsonl`,
+    so the file can be passed to the executor running on the node.  Nodes
+    without jobs get no file.
+
+    Parameters
+    ----------
+    nodes : `list` of `Node`
+        Nodes with jobs placed on them.
+    root : `str`
+        Directory to write the files to.
+    """
+    makedirs(root)
+    for node in nodes:
+        if not node.jobs:
+            continue
+        path = os.path.join(root, node.name + '.jsonl')
+        with open(path, 'w') as f:
+            for job in node.jobs:
+                f.write(json.dumps(job.description) + '\n')
+        logger.info('Wrote {} job(s) for node \'{}\' to \'{}\'.'
+                    .format(len(node.jobs), node.name, path))
+
+
+class _Locality(object):
+    """Memoized answers to the question which nodes a file is local to.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.owners = {}
+
+    def __call__(self, pfn):
+        owners = self.owners.get(pfn)
+        if owners is None:
+            path = os.path.realpath(pfn)
+            owners = frozenset(node.name for node in self.nodes
+                               if node.is_local(path))
+            self.owners[pfn] = owners
+        return owners
+
+
+def _score(node, job, local):
+    """Count the bytes a job reads which a node already has.
+    """
+    return sum(size for pfn, size in job.inputs.items()
+               if pfn in node.resident or node.name in local(pfn))
+
+
+def _traffic(node, jobs, local):
+    """Count the bytes a node reads locally and fetches for given jobs.
+    """
+    inputs = {}
+    for job in jobs:
+        inputs.update(job.inputs)
+    read = sum(size for pfn, size in inputs.items()
+               if node.name in local(pfn))
+    return read, sum(inputs.values()) - read
+
+
+def create_parser():
+    """Create command line parser.
+    """
+    parser = argparse.ArgumentParser(
+        description='Place jobs on nodes close to the files they read.')
+    parser.add_argument('files', type=str, nargs='*', metavar='file',
+                        help='job specifications (\'-\' or no file means '
+                             'the standard input)')
+    parser.add_argument('-n', '--nodes', type=str, required=True,
+                        help='inventory of nodes (JSON)')
+    parser.add_argument('-o', '--output', type=str, default='.',
+                        help='directory to write job lists of nodes to')
+    parser.add_argument('-l', '--logging', type=str,
+                        help='logging configuration', default=None)
+    parser.add_argument('--imbalance', type=float, default=0.1,
+                        help='fraction (non-negative) by which the number '
+                             'of jobs on a node may exceed its share')
+    parser.add_argument('--summary', type=str, default=None,
+                        help='file to write the summary of the plan to '
+                             '(JSON)')
+    return parser
+
+
+def main(argv):
+    """Place jobs on nodes and write job lists of the nodes.
+
+    Parameters
+    ----------
+    argv : list of `str`
+        List representing command line arguments.
+
+    Returns
+    -------
+    `int`
+        Exit status, 0 if all jobs were placed, 1 otherwise.
+    """
+    parser = create_parser()
+    args = parser.parse_args(argv[1:])
+    if args.imbalance < 0:
+        parser.error('argument --imbalance: must not be negative')
+    if args.logging is not None:
+        setup_logging(path=args.logging)
+    else:
+        setup_logging(level=logging.WARNING)
+
+    nodes = load_inventory(args.nodes)
+    jobs = []
+    failed = 0
+    for source, load in read_jobs(args.files or ['-']):
+        try:
+            job = load()
+            validate(job)
+            inputs, calibs = read_inputs(job)
+        except Exception as ex:
+            logger.error('Skipping job \'{}\': {}'
+                         .format(source, describe_error(ex)))
+            failed += 1
+            continue
+        jobs.append(Job(source, job, inputs, calibs=calibs))
+
+    place(jobs, nodes, imbalance=args.imbalance)
+    write_plan(nodes, args.output)
+    summary = summarize(jobs, nodes)
+    summary['skipped'] = failed
+    logger.info('Placed {jobs} job(s) on {nodes} node(s), {fetched:.1f} MB '
+                'to fetch ({baseline:.1f} MB if placed round robin).'
+                .format(jobs=len(jobs), nodes=len(nodes),
+                        fetched=summary['fetched_bytes'] / MB,
+                        baseline=summary['round_robin_fetched_bytes'] / MB))
+    if args.summary is not None:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=4)
+    return 1 if failed else 0
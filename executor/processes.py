@@ -0,0 +1,127 @@
+import multiprocessing
+import select
+import time
+
+
+def fork_context():
+    """Return the multiprocessing context creating processes by forking.
+
+    Forked processes start with everything the parent already loaded, e.g.
+    the LSST Stack and resolved tasks.  On Python 2, where contexts are not
+    available, :mod:`multiprocessing` itself, which always forks, is
+    returned.
+
+    Returns
+    -------
+    context
+        Object providing :mod:`multiprocessing` interface.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def fork_map(func, items, limit=1):
+    """Call a function for each item in a process forked from the current one.
+
+    At most `limit` processes run at the same time.  The next item is taken
+    only when a process can be started, so whatever is done in the current
+    process to produce it, e.g. by a generator, the process forked for it
+    inherits.  Each process sends the function's return value back.
+
+    If the caller stops the iteration early, e.g. it raises an exception or
+    closes the generator, the processes still running are terminated and
+    waited for, so none of them outlives the iteration.
+
+    Parameters
+    ----------
+    func : callable
+        Function called with an item in a forked process, its return value
+        must be picklable.
+    items : iterable
+        Items to call the function for.
+    limit : `int`, optional
+        Maximal number of processes running at the same time. Defaults to 1.
+
+    Yields
+    ------
+    item
+        The item, in the order the processes finish.
+    result
+        The function's return value, None if it failed.
+    error : `str` or None
+        Description of the failure, if the function raised an exception or
+        the process exited without sending anything back.
+    elapsed : `float`
+        Time the process ran, in seconds.
+    """
+    ctx = fork_context()
+    items = iter(items)
+    active = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(active) < max(1, limit):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                reader, writer = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=_call, args=(writer, func, item))
+                proc.start()
+                writer.close()
+                active[reader] = (proc, item, time.time())
+            if not active:
+                break
+
+            readable, _, _ = select.select(list(active), [], [])
+            for reader in readable:
+                proc, item, start = active.pop(reader)
+                try:
+                    result, error = reader.recv()
+                except EOFError:
+                    result = None
+                    error = 'worker exited with status {}'.format(
+                        proc.exitcode)
+                reader.close()
+                proc.join()
+                yield item, result, error, time.time() - start
+    finally:
+        for reader, (proc, _, _) in active.items():
+            if proc.is_alive():
+                proc.terminate()
+            proc.join()
+            reader.close()
+
+
+def describe_error(ex):
+    """Describe an exception in a single line.
+
+    Parameters
+    ----------
+    ex : `BaseException`
+        The exception.
+
+    Returns
+    -------
+    `str`
+        Name of the exception's type followed by the first line of its
+        message.
+    """
+    lines = str(ex).splitlines() or ['']
+    return '{}: {}'.format(type(ex).__name__, lines[0])
+
+
+def _call(conn, func, item):
+    """Call a function in a forked process and send the outcome back.
+    """
+    try:
+        try:
+            result = func(item)
+        except BaseException as ex:
+            conn.send((None, describe_error(ex)))
+        else:
+            conn.send((result, None))
+    finally:
+        conn.close()
@@ -0,0 +1,320 @@
+import collections
+import contextlib
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+
+from .files import makedirs
+
+try:
+    from thread import get_ident
+except ImportError:
+    from threading import get_ident
+
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler(object):
+    """Statistical profiler sampling the call stack of a single thread.
+
+    A background thread periodically takes a snapshot of the call stack of
+    the profiled thread and counts how many times each stack was seen.  The
+    overhead is bounded by the sampling interval and, unlike deterministic
+    profilers, it does not depend on the number of function calls made.
+
+    Parameters
+    ----------
+    ident : `int`
+        Identifier of the thread to profile.
+    interval : `float`, optional
+        Time (in seconds) between consecutive samples. Defaults to 0.005.
+    """
+
+    def __init__(self, ident, interval=0.005):
+        self.ident = ident
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start sampling."""
+        self.thread = threading.Thread(target=self._sample)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        self.done.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def dump(self, path):
+        """Write the collected stacks in collapsed (folded) format.
+
+        Each line contains the frames of a stack, outermost first, separated
+        by semicolons, followed by the number of times the stack was seen.
+        The file can be turned into a flame graph by `flamegraph.pl` or
+        loaded into speedscope.
+
+        Parameters
+        ----------
+        path : `str`
+            File name.
+        """
+        _write_folded(path, self.stacks)
+
+    def dump_stats(self, path):
+        """Write statistics estimated from the samples in pstats format.
+
+        A function's own and cumulative times are the numbers of samples
+        with the function at the top of the stack and anywhere in it,
+        respectively, multiplied by the sampling interval.  Numbers of calls
+        are the numbers of samples, as the actual calls are not observed.
+
+        Parameters
+        ----------
+        path : `str`
+            File name.
+        """
+        stats = {}
+        for stack, count in self.stacks.items():
+            spent = count * self.interval
+            seen = set()
+            for num, func in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.setdefault(
+                    func, (0, 0, 0.0, 0.0, {}))
+                own = spent if num == len(stack) - 1 else 0.0
+                if func not in seen:
+                    cc, nc, ct = cc + count, nc + count, ct + spent
+                    seen.add(func)
+                stats[func] = (cc, nc, tt + own, ct, callers)
+                if num > 0:
+                    ccc, cnc, ctt, cct = callers.get(stack[num - 1],
+                                                     (0, 0, 0.0, 0.0))
+                    callers[stack[num - 1]] = (ccc + count, cnc + count,
+                                               ctt + own, cct + spent)
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
+
+    def _sample(self):
+        """Sample the stack of the profiled thread until stopped."""
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+
+class Profiler(object):
+    """Profile the execution of selected commands.
+
+    Use :meth:`hook` as a :class:`Scheduler` hook.  The profile of each
+    selected command is written to a separate file in a given directory,
+    named after the command's position in the order of execution and its
+    type, e.g. `03-RunTask`.  Whichever profiler is used, two files are
+    written: statistics readable by :mod:`pstats` (`.prof`) and collapsed
+    stacks suitable for flame graphs (`.folded`).  Profiles of commands
+    which failed are written as well.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory to write the profiles to.
+    kind : {'cprofile', 'sampling'}, optional
+        Profiler to use, either a deterministic ('cprofile') or a sampling
+        one ('sampling'). Stacks collapsed from the deterministic profile,
+        and statistics estimated from the samples, are approximations, see
+        :func:`collapse` and :meth:`SamplingProfiler.dump_stats`. Defaults
+        to 'cprofile'.
+    commands : `list` of `str`, optional
+        Types of the commands to profile, e.g. `['RunTask']`. If None
+        (default), all commands are profiled.
+    """
+
+    def __init__(self, root, kind='cprofile', commands=None):
+        if kind not in PROFILERS:
+            raise ValueError('Unknown profiler: \'{}\'.'.format(kind))
+        self.root = root
+        self.kind = kind
+        self.commands = set(commands) if commands is not None else None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        tmpl = '{cls}({root!r}, kind={kind!r})'
+        return tmpl.format(cls=self.__class__.__name__, root=self.root,
+                           kind=self.kind)
+
+    def hook(self, cmd):
+        """Profile a command, see :class:`Scheduler`.
+
+        Parameters
+        ----------
+        cmd : `Command`
+            The command.
+        """
+        name = cmd.__class__.__name__
+        if self.commands is not None and name not in self.commands:
+            return _noop()
+        with self.lock:
+            self.count += 1
+            count = self.count
+        base = os.path.join(self.root, '{:02d}-{}'.format(count, name))
+        return PROFILERS[self.kind](self, base)
+
+    @contextlib.contextmanager
+    def _cprofile(self, base):
+        """Profile a block of code with the deterministic profiler."""
+        # Only one deterministic profiler can be active at a time in recent
+        # Python versions, commands executed concurrently are not profiled.
+        if not _active.acquire(False):
+            logger.warning('Another command is being profiled; '
+                           'skipping \'{}\'.'.format(base))
+            yield
+            return
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            yield
+        finally:
+            profile.disable()
+            _active.release()
+            self._write(base, profile)
+
+    @contextlib.contextmanager
+    def _sampling(self, base):
+        """Profile a block of code with the sampling profiler."""
+        profile = SamplingProfiler(get_ident())
+        start = time.time()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            note = ' ({} samples in {:.2f} s)'.format(
+                sum(profile.stacks.values()), time.time() - start)
+            self._write(base, profile, note=note)
+
+    def _write(self, base, profile, note=''):
+        """Write a profile in both formats.
+
+        It is called whether the command succeeded or not, so the failure
+        of writing the profile is logged rather than raised, not to replace
+        the command's exception.
+
+        Parameters
+        ----------
+        base : `str`
+            Name of the files without extensions.
+        profile : `cProfile.Profile` or `SamplingProfiler`
+            The profile.
+        note : `str`, optional
+            Details about the profile to log.
+        """
+        try:
+            makedirs(self.root)
+            profile.dump_stats(base + '.prof')
+            if isinstance(profile, SamplingProfiler):
+                profile.dump(base + '.folded')
+            else:
+                profile.create_stats()
+                _write_folded(base + '.folded', collapse(profile.stats))
+        except (IOError, OSError) as ex:
+            logger.error('Cannot write profile \'{}\': {}'.format(base, ex))
+            return
+        logger.info('Profile{} written to \'{}.{{prof,folded}}\'.'
+                    .format(note, base))
+
+
+def collapse(stats, depth=64, resolution=1e-6):
+    """Collapse deterministic profile statistics into call stacks.
+
+    The statistics record only which function called which, not the whole
+    stacks, so each function's own time is split among the stacks leading
+    to it in proportion to the cumulative time spent in it when called from
+    each of its callers.  Recursive calls are not followed.
+
+    Parameters
+    ----------
+    stats : `dict`
+        Statistics in the format of :attr:`pstats.Stats.stats`.
+    depth : `int`, optional
+        Maximal depth of the stacks. Defaults to 64.
+    resolution : `float`, optional
+        Time (in seconds) below which stacks are dropped. Defaults to
+        1e-6.
+
+    Returns
+    -------
+    `collections.Counter`
+        Times spent in the stacks, in microseconds, keyed by the stacks, i.e.
+        tuples of (file name, line number, function name) of their frames,
+        outermost first.
+    """
+    stacks = collections.Counter()
+    for func, (_, _, tt, _, _) in stats.items():
+        if tt < resolution:
+            continue
+        pending = [((func,), tt)]
+        while pending:
+            path, spent = pending.pop()
+            callers = stats.get(path[-1], (0, 0, 0.0, 0.0, {}))[4]
+            callers = dict((caller, info) for caller, info in callers.items()
+                           if caller not in path and caller in stats)
+            if not callers or len(path) >= depth:
+                stacks[tuple(reversed(path))] += int(round(spent * 1e6))
+                continue
+            total = float(sum(_weight(info) for info in callers.values()))
+            for caller, info in callers.items():
+                share = spent * (_weight(info) / total if total else
+                                 1.0 / len(callers))
+                if share >= resolution:
+                    pending.append((path + (caller,), share))
+    return stacks
+
+
+def _weight(info):
+    """Return the cumulative time spent in calls from a caller.
+    """
+    return info[3] if isinstance(info, tuple) else info
+
+
+def _write_folded(path, stacks):
+    """Write stacks in collapsed (folded) format.
+    """
+    with open(path, 'w') as f:
+        for stack, count in sorted(stacks.items()):
+            if count <= 0:
+                continue
+            frames = ('{}:{}:{}'.format(name, os.path.basename(filename),
+                                        lineno)
+                      for filename, lineno, name in stack)
+            f.write('{} {}\n'.format(';'.join(frames), count))
+
+
+@contextlib.contextmanager
+def _noop():
+    """Do nothing."""
+    yield
+
+
+# Guards the deterministic profiler.
+_active = threading.Lock()
+
+# Available profilers.
+PROFILERS = {
+    'cprofile': Profiler._cprofile,
+    'sampling': Profiler._sampling,
+}
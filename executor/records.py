@@ -0,0 +1,301 @@
+import array
+import collections
+import itertools
+import json
+from .processes import describe_error
+from .schema import RecordValidator, default
+
+
+class RecordStream(object):
+    """File records read from a JSON Lines file.
+
+    Records are read from the file, one per line, and validated only when
+    they are needed, so the memory required does not depend on their number.
+    The stream can be iterated over many times, each time the file is read
+    again.
+
+    Parameters
+    ----------
+    path : `str`
+        Name of the file.
+    schema : `dict`, optional
+        JSON schema of job descriptions. Each record must conform to its
+        definition of a file. Defaults to the internal schema.
+    """
+
+    def __init__(self, path, schema=default):
+        self.path = path
+        self.schema = schema
+        self.validator = RecordValidator(schema)
+
+    def __repr__(self):
+        tmpl = '{cls}({path!r})'
+        return tmpl.format(cls=self.__class__.__name__, path=self.path)
+
+    def __str__(self):
+        return self.path
+
+    def __iter__(self):
+        for _, rec in self.entries():
+            yield rec
+
+    def entries(self):
+        """Iterate over the records and the locations of their lines.
+
+        Yields
+        ------
+        offset : `int`
+            Offset of the record's line in the file, in bytes.
+        rec : `dict`
+            The record.
+        """
+        count = 0
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for num, line in enumerate(iter(f.readline, b''), start=1):
+                start, offset = offset, offset + len(line)
+                if not line.strip():
+                    continue
+                count += 1
+                yield start, self.parse(line, 'line {}'.format(num))
+        if not count:
+            raise ValueError('No records in \'{}\'.'.format(self.path))
+
+    def parse(self, line, where):
+        """Read and validate a record.
+
+        Parameters
+        ----------
+        line : `bytes`
+            Line of the file holding the record.
+        where : `str`
+            Location of the line, used in the error message.
+
+        Returns
+        -------
+        `dict`
+            The record.
+
+        Raises
+        ------
+        ValueError
+            If the record is invalid.
+        """
+        try:
+            rec = json.loads(line.decode('utf-8'))
+            self.validator.validate(rec)
+        except Exception as ex:
+            raise ValueError('Invalid record in \'{}\', {}: {}'
+                             .format(self.path, where, describe_error(ex)))
+        return rec
+
+
+class Subset(object):
+    """Records of a stream at given locations.
+
+    Only the offsets of the records' lines are kept in memory, the records
+    are read again each time the subset is iterated over.
+
+    Parameters
+    ----------
+    stream : `RecordStream`
+        The stream.
+    offsets : sequence of `int`
+        Offsets of the records' lines in the stream's file, see
+        :meth:`RecordStream.entries`.
+    """
+
+    def __init__(self, stream, offsets):
+        self.stream = stream
+        self.offsets = offsets
+
+    def __repr__(self):
+        tmpl = '{cls}({stream!r}, {count} record(s))'
+        return tmpl.format(cls=self.__class__.__name__, stream=self.stream,
+                           count=len(self.offsets))
+
+    def __str__(self):
+        return str(self.stream)
+
+    def __iter__(self):
+        with open(self.stream.path, 'rb') as f:
+            for offset in self.offsets:
+                f.seek(offset)
+                line = f.readline()
+                yield self.stream.parse(line, 'offset {}'.format(offset))
+
+
+class Mapped(object):
+    """Values computed lazily from the items of a re-iterable collection.
+
+    Parameters
+    ----------
+    items : iterable
+        The collection, e.g. a :class:`RecordStream`.
+    func : callable
+        Function computing a value from an item. Items for which it returns
+        None are skipped.
+    """
+
+    def __init__(self, items, func):
+        self.items = items
+        self.func = func
+
+    def __repr__(self):
+        tmpl = '{cls}({items!r})'
+        return tmpl.format(cls=self.__class__.__name__, items=self.items)
+
+    def __str__(self):
+        return origin(self.items)
+
+    def __iter__(self):
+        for item in self.items:
+            value = self.func(item)
+            if value is not None:
+                yield value
+
+
+class Chain(object):
+    """Items of many re-iterable collections, one after another.
+
+    Parameters
+    ----------
+    *parts
+        The collections.
+    """
+
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def __repr__(self):
+        tmpl = '{cls}({parts})'
+        parts = ', '.join(repr(part) for part in self.parts)
+        return tmpl.format(cls=self.__class__.__name__, parts=parts)
+
+    def __str__(self):
+        return ', '.join(origin(part) for part in self.parts)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.parts)
+
+
+def pluck(items, func):
+    """Compute values from the items of a collection.
+
+    Values computed from an in-memory list are returned as a list, while
+    values computed from any other collection, e.g. a stream, are computed
+    only when they are needed.
+
+    Parameters
+    ----------
+    items : iterable
+        The collection.
+    func : callable
+        Function computing a value from an item. Items for which it returns
+        None are skipped.
+
+    Returns
+    -------
+    `list` or `Mapped`
+        The values.
+    """
+    values = Mapped(items, func)
+    return list(values) if isinstance(items, list) else values
+
+
+def partition(items, key):
+    """Split the items of a collection into groups in a single pass.
+
+    Items of an in-memory list, or of any other collection but a stream,
+    are grouped in lists.  Records of a :class:`RecordStream` are grouped
+    in :class:`Subset` objects, so only the offsets of their lines are kept
+    in memory.
+
+    Parameters
+    ----------
+    items : iterable
+        The collection.
+    key : callable
+        Function computing the group of an item.
+
+    Returns
+    -------
+    `collections.OrderedDict`
+        The groups, in the order of their first items, keyed by the values
+        `key` returned.
+    """
+    groups = collections.OrderedDict()
+    if isinstance(items, RecordStream):
+        for offset, rec in items.entries():
+            groups.setdefault(key(rec), array.array('l')).append(offset)
+        for name, offsets in groups.items():
+            groups[name] = Subset(items, offsets)
+        return groups
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
+
+
+def concat(*parts):
+    """Concatenate collections.
+
+    Returns
+    -------
+    `list` or `Chain`
+        A list, if all collections are lists, a lazy chain otherwise.
+    """
+    if all(isinstance(part, list) for part in parts):
+        return list(itertools.chain.from_iterable(parts))
+    return Chain(*parts)
+
+
+def chunks(items, size):
+    """Split items into chunks of a limited size.
+
+    Parameters
+    ----------
+    items : iterable
+        The items.
+    size : `int`
+        Maximal number of items in a chunk.
+
+    Yields
+    ------
+    `list`
+        Consecutive items.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def describe(items, noun='item(s)'):
+    """Describe a collection without iterating over it.
+
+    Parameters
+    ----------
+    items : iterable
+        The collection.
+    noun : `str`, optional
+        What the items are, e.g. 'file(s)'.
+
+    Returns
+    -------
+    `str`
+        The number of items, for in-memory collections, or where the items
+        come from.
+    """
+    if isinstance(items, (list, tuple)):
+        return '{} {}'.format(len(items), noun)
+    return '{} from {}'.format(noun, items)
+
+
+def origin(items):
+    """Describe where the items of a collection come from.
+    """
+    if isinstance(items, (list, tuple)):
+        return describe(items, 'record(s)')
+    return str(items)
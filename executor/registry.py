@@ -0,0 +1,84 @@
+import logging
+from .imports import load
+
+
+logger = logging.getLogger(__name__)
+
+
+def merge(dst, src):
+    """Merge the content of a registry into another one.
+
+    Tables and indices missing in the destination registry are created.
+    Then, rows of each table are inserted into the respective table of the
+    destination registry unless they violate its constraints, e.g. describe
+    a file which is already there.  Integer primary keys are not copied, so
+    rows get new identifiers instead of clashing with the existing ones.
+
+    Parameters
+    ----------
+    dst : `str`
+        Name of the destination registry.
+    src : `str`
+        Name of the registry to merge.
+
+    Returns
+    -------
+    `int`
+        Number of merged rows.
+    """
+    conn = load('sqlite3').connect(dst)
+    count = 0
+    try:
+        conn.execute('ATTACH DATABASE ? AS source', (src,))
+        tables = _list(conn, 'source', 'table')
+        existing = dict(_list(conn, 'main', 'table'))
+        with conn:
+            for name, sql in tables:
+                if name not in existing:
+                    conn.execute(sql)
+                columns = _columns(conn, name)
+                query = 'INSERT OR IGNORE INTO main.{table} ({cols}) ' \
+                        'SELECT {cols} FROM source.{table}'
+                cursor = conn.execute(query.format(
+                    table=_quote(name),
+                    cols=', '.join(_quote(col) for col in columns)))
+                count += max(cursor.rowcount, 0)
+            existing = dict(_list(conn, 'main', 'index'))
+            for name, sql in _list(conn, 'source', 'index'):
+                if name not in existing and sql is not None:
+                    conn.execute(sql)
+        conn.execute('DETACH DATABASE source')
+    finally:
+        conn.close()
+    logger.debug('Merged {} row(s) from \'{}\' into \'{}\'.'
+                 .format(count, src, dst))
+    return count
+
+
+def _list(conn, schema, kind):
+    """List user defined objects of a given kind in a database.
+    """
+    query = 'SELECT name, sql FROM {}.sqlite_master ' \
+            'WHERE type = ? AND name NOT LIKE \'sqlite_%\''.format(schema)
+    return conn.execute(query, (kind,)).fetchall()
+
+
+def _columns(conn, table):
+    """List columns of a table of the attached registry to be merged.
+
+    An integer primary key is an alias of the row identifier, hence it is
+    excluded.
+    """
+    info = conn.execute('PRAGMA source.table_info({})'.format(_quote(table)))
+    info = info.fetchall()
+    keys = [row for row in info if row[5]]
+    excluded = set()
+    if len(keys) == 1 and keys[0][2].upper() == 'INTEGER':
+        excluded.add(keys[0][1])
+    return [row[1] for row in info if row[1] not in excluded]
+
+
+def _quote(name):
+    """Quote an SQL identifier.
+    """
+    return '"{}"'.format(name.replace('"', '""'))
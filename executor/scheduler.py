@@ -0,0 +1,193 @@
+import logging
+import six
+import sys
+import threading
+from six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """Execute commands concurrently, respecting their dependencies.
+
+    A command is started once all commands it requires (see
+    :attr:`Command.requires`) are completed and none of the commands being
+    executed holds any of the resources it needs (see
+    :attr:`Command.resources`).
+
+    If only a single command can be executed at a time, it is executed in the
+    calling thread. Hence, with a single worker commands are executed in the
+    main thread one by one, in the order they were enqueued.
+
+    Parameters
+    ----------
+    workers : `int`, optional
+        Maximal number of commands executed concurrently. Defaults to 1.
+    hooks : `list` of callable, optional
+        Functions wrapping the execution of each command. A hook is called
+        with the command as its argument and must return a context manager
+        which is entered just before the command is executed and exited
+        right after it is finished.
+    journal : `executor.journal.Journal`, optional
+        Journal of completed commands. If specified, completion of each
+        resumable command (see :attr:`Command.resumable`) is recorded in it
+        and resumable commands it lists as completed are not executed again,
+        unless a command they depend on needs to be executed.  The start of
+        each resumable command which is not idempotent (see
+        :attr:`Command.idempotent`) is recorded as well.
+    """
+
+    def __init__(self, workers=1, hooks=(), journal=None):
+        self.workers = max(1, workers)
+        self.hooks = list(hooks)
+        self.journal = journal
+
+    def run(self, commands):
+        """Execute the commands.
+
+        If a command fails, no new commands are started.  The scheduler waits
+        for the commands being executed to finish and re-raises the exception
+        raised by the failed command.
+
+        Dependencies on commands which are not in the queue are considered
+        to be satisfied.
+
+        Parameters
+        ----------
+        commands : `list` of `Command`
+            Commands to execute.
+
+        Raises
+        ------
+        ValueError
+            If dependencies between the commands can't be satisfied.
+        """
+        pending = list(commands)
+        enqueued = set(id(cmd) for cmd in pending)
+        completed = self._skip(pending, enqueued)
+        pending = [cmd for cmd in pending if id(cmd) not in completed]
+        running = {}
+        held = set()
+        events = queue.Queue()
+        failure = None
+        while pending or running:
+            if failure is None:
+                ready = [cmd for cmd in pending
+                         if all(id(dep) in completed or id(dep) not in enqueued
+                                for dep in cmd.requires)]
+                started = []
+                for cmd in ready:
+                    if len(running) + len(started) >= self.workers:
+                        break
+                    if held.intersection(cmd.resources):
+                        continue
+                    held.update(cmd.resources)
+                    started.append(cmd)
+                for cmd in started:
+                    pending.remove(cmd)
+
+                # Nothing else can be done in the meantime, so execute the
+                # command in the calling thread.
+                if not running and len(started) == 1 and \
+                        (len(ready) == 1 or self.workers == 1):
+                    cmd = started[0]
+                    exc_info = self._execute(cmd)
+                    held.difference_update(cmd.resources)
+                    if exc_info is not None:
+                        failure = exc_info
+                    else:
+                        completed.add(id(cmd))
+                    continue
+
+                for cmd in started:
+                    running[id(cmd)] = cmd
+                    thread = threading.Thread(target=self._submit,
+                                              args=(cmd, events))
+                    thread.daemon = True
+                    thread.start()
+
+            if not running:
+                if failure is None:
+                    names = ', '.join(str(cmd) for cmd in pending)
+                    msg = 'Unsatisfiable dependencies of: {}.'.format(names)
+                    logger.error(msg)
+                    raise ValueError(msg)
+                break
+
+            cmd, exc_info = events.get()
+            del running[id(cmd)]
+            held.difference_update(cmd.resources)
+            if exc_info is not None:
+                if failure is None:
+                    failure = exc_info
+            else:
+                completed.add(id(cmd))
+
+        if failure is not None:
+            if pending:
+                logger.warning('Skipped {} command(s) due to an earlier '
+                               'failure.'.format(len(pending)))
+            six.reraise(*failure)
+
+    def _skip(self, commands, enqueued):
+        """Find commands completed in an earlier run.
+
+        Parameters
+        ----------
+        commands : `list` of `Command`
+            Commands to execute, each one enqueued after the ones it depends
+            on.
+        enqueued : `set` of `int`
+            Identifiers of the commands.
+
+        Returns
+        -------
+        `set` of `int`
+            Identifiers of the commands which need not be executed.
+        """
+        skipped = set()
+        if self.journal is None:
+            return skipped
+        for cmd in commands:
+            deps = [dep for dep in cmd.requires if id(dep) in enqueued]
+            if (cmd.resumable and self.journal.has(cmd) and
+                    all(id(dep) in skipped for dep in deps)):
+                logger.info('Skipping completed command: {}'.format(cmd))
+                skipped.add(id(cmd))
+        return skipped
+
+    def _submit(self, cmd, events):
+        """Execute a command and report its completion to the scheduler."""
+        events.put((cmd, self._execute(cmd)))
+
+    def _execute(self, cmd):
+        """Execute a command.
+
+        Returns
+        -------
+        `tuple` or None
+            Information about the exception raised by the command, as
+            returned by :func:`sys.exc_info`, or None if it succeeded.
+        """
+        logger.info('Executing: {}'.format(cmd))
+        journal = self.journal if cmd.resumable else None
+        try:
+            if journal is not None and not cmd.idempotent:
+                journal.start(cmd)
+            self._wrap(cmd, self.hooks)
+            if journal is not None:
+                journal.record(cmd)
+        except Exception:
+            logger.error('Command failed: {}'.format(cmd))
+            return sys.exc_info()
+        return None
+
+    def _wrap(self, cmd, hooks):
+        """Execute a command within the context managers the hooks return.
+        """
+        if not hooks:
+            cmd.execute()
+            return
+        with hooks[0](cmd):
+            self._wrap(cmd, hooks[1:])
@@ -1,3 +1,10 @@
+import hashlib
+import json
+import six
+import threading
+from .imports import load
+
+
 default = {
     "$schema": "http://json-schema.org/draft-04/schema#",
     "description": "schema for Executor's job specification",
@@ -6,16 +13,8 @@ default = {
         "task": { "$ref": "#/definitions/task" },
         "input": { "$ref": "#/definitions/input" },
         "output": { "$ref": "#/definitions/output" },
-        "calibs": {
-            "type": "array",
-            "items": { "$ref": "#/definitions/file" },
-            "minItems": 1
-        },
-        "data": {
-            "type": "array",
-            "items": { "$ref": "#/definitions/file" },
-            "minItems": 1
-        }
+        "calibs": { "$ref": "#/definitions/files" },
+        "data": { "$ref": "#/definitions/files" }
     },
     "definitions": {
         "task": {
@@ -49,6 +48,19 @@ default = {
             },
             "required": [ "pfn", "meta" ]
         },
+        "files": {
+            "oneOf": [
+                {
+                    "type": "array",
+                    "items": { "$ref": "#/definitions/file" },
+                    "minItems": 1
+                },
+                {
+                    "type": "string",
+                    "description": "JSON Lines file with file specifications"
+                }
+            ]
+        },
         "input": {
             "type": "object",
             "properties": {
@@ -63,6 +75,12 @@ default = {
                 "readonly": {
                     "type": "boolean",
                     "default": True,
+                },
+                "ingest_mode": {
+                    "type": "string",
+                    "enum": [ "copy", "hardlink", "symlink", "reflink" ],
+                    "default": "copy",
+                    "description": "Method of placing files in the repository"
                 }
             },
             "required": [ "root", "mapper" ]
@@ -84,3 +102,229 @@ default = {
     },
     "required": [ "task", "input", "output" ]
 }
+
+
+# Validators compiled so far, keyed by fingerprints of their schemas.
+_validators = {}
+_lock = threading.Lock()
+
+
+def fingerprint(schema):
+    """Compute the fingerprint of a schema.
+
+    Parameters
+    ----------
+    schema : `dict`
+        JSON schema.
+
+    Returns
+    -------
+    `str`
+        Hash of the schema's content.
+    """
+    content = json.dumps(schema, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def get_validator(schema):
+    """Get the validator for a given schema.
+
+    Validators are compiled once per schema and cached, so schemas with the
+    same content share the validator.  The :mod:`jsonschema` package, which
+    takes a while to import, is imported only when the first validator is
+    needed.
+
+    Parameters
+    ----------
+    schema : `dict`
+        JSON schema.
+
+    Returns
+    -------
+    validator
+        An object validating JSON documents against the schema.
+
+    Raises
+    ------
+    jsonschema.SchemaError
+        If the schema itself is invalid.
+    """
+    key = fingerprint(schema)
+    with _lock:
+        validator = _validators.get(key)
+        if validator is None:
+            validators = load('jsonschema.validators')
+            cls = validators.validator_for(schema)
+            cls.check_schema(schema)
+            validator = cls(schema)
+            _validators[key] = validator
+    return validator
+
+
+def validate(job, schema=default):
+    """Validate a job description.
+
+    A job description which is clearly well-formed with respect to the
+    default schema is accepted without running the full validation.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+    schema : `dict`, optional
+        JSON schema the job description must conform to. Defaults to
+        the internal schema.
+
+    Raises
+    ------
+    jsonschema.ValidationError
+        If the job description is invalid.
+    """
+    if schema is default and is_well_formed(job):
+        return
+    get_validator(schema).validate(job)
+
+
+class RecordValidator(object):
+    """Validate file records.
+
+    The schema of the records is derived from the schema of job descriptions
+    once, and its validator is compiled only when the first record needs
+    a full validation, so validating many records, e.g. the ones of
+    a stream, costs little more than validating each of them.
+
+    Parameters
+    ----------
+    schema : `dict`, optional
+        JSON schema of job descriptions. Records must conform to its
+        definition of a file, or to the one from the internal schema if it
+        has none. Defaults to the internal schema.
+    """
+
+    def __init__(self, schema=default):
+        self.schema = schema
+        definitions = schema.get('definitions', {})
+        if 'file' not in definitions:
+            definitions = default['definitions']
+        self.record_schema = {
+            '$schema': schema.get('$schema', default['$schema']),
+            'definitions': definitions,
+            '$ref': '#/definitions/file',
+        }
+        self.validator = None
+
+    def __repr__(self):
+        tmpl = '{cls}(schema={key!r})'
+        return tmpl.format(cls=self.__class__.__name__,
+                           key=fingerprint(self.schema))
+
+    def validate(self, rec):
+        """Validate a file record.
+
+        Parameters
+        ----------
+        rec : `dict`
+            File record.
+
+        Raises
+        ------
+        jsonschema.ValidationError
+            If the record is invalid.
+        """
+        if self.schema is default and _is_file(rec):
+            return
+        if self.validator is None:
+            self.validator = get_validator(self.record_schema)
+        self.validator.validate(rec)
+
+
+def validate_record(rec, schema=default):
+    """Validate a file record.
+
+    To validate many records, use a single :class:`RecordValidator`.
+
+    Parameters
+    ----------
+    rec : `dict`
+        File record.
+    schema : `dict`, optional
+        JSON schema of job descriptions. The record must conform to its
+        definition of a file, or to the one from the internal schema if it
+        has none. Defaults to the internal schema.
+
+    Raises
+    ------
+    jsonschema.ValidationError
+        If the record is invalid.
+    """
+    RecordValidator(schema).validate(rec)
+
+
+def is_well_formed(job):
+    """Check if a job description conforms to the default schema.
+
+    It is a fast, conservative check mirroring the default schema: if it
+    passes, the job description is valid, otherwise it may or may not be.
+
+    Parameters
+    ----------
+    job : `dict`
+        Job description.
+
+    Returns
+    -------
+    `bool`
+        True if the job description is valid, False if it needs to be
+        validated against the schema to find out.
+    """
+    if not isinstance(job, dict):
+        return False
+    try:
+        task, inp, out = job['task'], job['input'], job['output']
+    except KeyError:
+        return False
+    if not (isinstance(task, dict) and isinstance(inp, dict) and
+            isinstance(out, dict)):
+        return False
+    args = task.get('args')
+    if not (_is_string(task.get('name')) and isinstance(args, list) and
+            all(_is_string(arg) for arg in args)):
+        return False
+    if not (_is_string(inp.get('root')) and _is_string(inp.get('mapper'))):
+        return False
+    if not isinstance(inp.get('readonly', True), bool):
+        return False
+    modes = default['definitions']['input']['properties']['ingest_mode']
+    if inp.get('ingest_mode', 'copy') not in modes['enum']:
+        return False
+    if not (_is_string(out.get('root')) and
+            _is_string(out.get('mapper', ''))):
+        return False
+    for key in ('calibs', 'data'):
+        if key in job and not _is_file_list(job[key]):
+            return False
+    return True
+
+
+def _is_string(value):
+    """Check if a value is a JSON string.
+    """
+    return isinstance(value, six.string_types)
+
+
+def _is_file_list(records):
+    """Check if a value is a non-empty list of file specifications or a name
+    of a file containing them.
+    """
+    if _is_string(records):
+        return True
+    if not isinstance(records, list) or not records:
+        return False
+    return all(_is_file(rec) for rec in records)
+
+
+def _is_file(rec):
+    """Check if a value is a file specification.
+    """
+    return (isinstance(rec, dict) and _is_string(rec.get('pfn')) and
+            isinstance(rec.get('meta'), dict))
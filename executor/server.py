@@ -0,0 +1,385 @@
+import collections
+import json
+import logging
+import os
+import signal
+import stat
+import threading
+import time
+
+from six.moves import BaseHTTPServer, queue, socketserver
+
+from .processes import describe_error, fork_context
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobServer(object):
+    """Accept job descriptions over HTTP and execute them in the background.
+
+    The server listens either on a Unix socket or on a TCP port.  Submitted
+    jobs are queued and executed in the order they arrive, a limited number
+    of them at a time, each in a separate process forked from the server.
+    Hence, a job starts with everything the server already loaded, e.g. the
+    task map and the task classes, and it can neither affect other jobs nor
+    bring down the server.
+
+    The server handles the following requests:
+
+    ``POST /jobs``
+        Submit a job, the body of the request is its description.  Returns
+        the state of the job, including its identifier.
+    ``GET /jobs/<id>``
+        Return the state of a job.
+    ``GET /jobs/<id>/result``
+        Return the result record of a finished job.
+    ``GET /status``
+        Return the number of jobs in each state and the concurrency limit.
+
+    Parameters
+    ----------
+    address : `str` or `tuple`
+        Name of the Unix socket or a (host, port) pair to listen on.
+    run : callable
+        Function executing a job, called with the job's source (its path on
+        the server), its description, and ordinal number.  It must return
+        the job's result record.
+    prepare : callable, optional
+        Function called with a job description before the job is executed,
+        in the server's process, e.g. to import the tasks the job requires.
+    validate : callable, optional
+        Function checking a job description when it is submitted, it must
+        raise an exception if the job is invalid.
+    limit : `int`, optional
+        Maximal number of jobs executed at the same time. Defaults to 1.
+    history : `int`, optional
+        Maximal number of finished jobs whose states are kept. Defaults to
+        1000.
+    """
+
+    def __init__(self, address, run, prepare=None, validate=None, limit=1,
+                 history=1000):
+        self.address = address
+        self.run = run
+        self.prepare = prepare
+        self.validate = validate
+        self.limit = max(1, limit)
+        self.history = history
+        self.jobs = collections.OrderedDict()
+        self.pending = queue.Queue()
+        self.count = 0
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.fork_lock = threading.Lock()
+        self.threads = []
+        self.httpd = None
+
+    def __repr__(self):
+        tmpl = '{cls}({address!r}, limit={limit})'
+        return tmpl.format(cls=self.__class__.__name__, address=self.address,
+                           limit=self.limit)
+
+    def submit(self, job):
+        """Queue a job for execution.
+
+        Parameters
+        ----------
+        job : `dict`
+            Job description.
+
+        Returns
+        -------
+        `dict`
+            State of the job.
+        """
+        if self.validate is not None:
+            self.validate(job)
+        with self.lock:
+            self.count += 1
+            ident = str(self.count)
+            state = {
+                'id': ident,
+                'task': job.get('task', {}).get('name'),
+                'status': 'queued',
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+                'error': None,
+            }
+            self.jobs[ident] = (state, None)
+            self._forget()
+        self.pending.put((ident, job))
+        logger.info('Queued job {}.'.format(ident))
+        return dict(state)
+
+    def state(self, ident):
+        """Return the state of a job and its result record, if finished.
+
+        Raises
+        ------
+        KeyError
+            If there is no such job.
+        """
+        with self.lock:
+            state, record = self.jobs[ident]
+            return dict(state), record
+
+    def status(self):
+        """Return the number of jobs in each state.
+        """
+        with self.lock:
+            counts = collections.Counter(state['status']
+                                         for state, _ in self.jobs.values())
+        counts = dict((key, counts.get(key, 0))
+                      for key in ('queued', 'running', 'succeeded', 'failed',
+                                  'cancelled'))
+        return {
+            'jobs': counts,
+            'submitted': self.count,
+            'limit': self.limit,
+            'uptime': time.time() - self.started,
+        }
+
+    def serve_forever(self):
+        """Handle requests until interrupted or terminated.
+        """
+        if isinstance(self.address, tuple):
+            self.httpd = _TCPServer(self.address, _Handler)
+        else:
+            _unlink(self.address)
+            self.httpd = _UnixServer(self.address, _Handler)
+        self.httpd.jobs = self
+        for _ in range(self.limit):
+            thread = threading.Thread(target=self._dispatch)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        def terminate(signum, frame):
+            raise SystemExit(0)
+        handler = signal.signal(signal.SIGTERM, terminate)
+        logger.info('Listening on {}, executing up to {} job(s) at a time.'
+                    .format(self.address, self.limit))
+        try:
+            self.httpd.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+            self.close()
+
+    def close(self):
+        """Stop accepting jobs and wait for the running ones to finish.
+
+        Jobs which have not started yet are cancelled.
+        """
+        self.stopped.set()
+        if self.httpd is not None:
+            self.httpd.server_close()
+            if not isinstance(self.address, tuple):
+                _unlink(self.address)
+        for _ in self.threads:
+            self.pending.put(None)
+        running = self.status()['jobs']['running']
+        if running:
+            logger.info('Waiting for {} running job(s).'.format(running))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _dispatch(self):
+        """Execute queued jobs one after another until stopped.
+        """
+        ctx = fork_context()
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            ident, job = item
+            if self.stopped.is_set():
+                self._update(ident, status='cancelled', finished=time.time())
+                continue
+
+            # Whatever is loaded here, the following jobs inherit.  If
+            # anything goes wrong, let the job report it.
+            with self.fork_lock:
+                if self.prepare is not None:
+                    try:
+                        self.prepare(job)
+                    except Exception:
+                        pass
+                reader, writer = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=self._work,
+                                   args=(writer, ident, job))
+                proc.start()
+                writer.close()
+            start = time.time()
+            self._update(ident, status='running', started=start)
+            logger.info('Started job {}.'.format(ident))
+
+            try:
+                record = reader.recv()
+            except EOFError:
+                record = None
+            reader.close()
+            proc.join()
+            if record is None:
+                msg = 'Worker exited with status {}.'.format(proc.exitcode)
+                record = {'job': _source(ident), 'task': None,
+                          'status': 'failed', 'error': msg,
+                          'elapsed': time.time() - start}
+            self._update(ident, record=record, status=record['status'],
+                         error=record['error'], finished=time.time())
+            logger.info('Job {} {}.'.format(ident, record['status']))
+
+    def _work(self, conn, ident, job):
+        """Execute a job in a worker process and send its record back.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.httpd.socket.close()
+        try:
+            conn.send(self.run(_source(ident), job, int(ident)))
+        finally:
+            conn.close()
+
+    def _update(self, ident, record=None, **changes):
+        """Update the state of a job.
+        """
+        with self.lock:
+            state, old = self.jobs[ident]
+            state.update(changes)
+            self.jobs[ident] = (state, record if record is not None else old)
+
+    def _forget(self):
+        """Discard states of the oldest finished jobs, if there are too many.
+        """
+        finished = [ident for ident, (state, _) in self.jobs.items()
+                    if state['finished'] is not None]
+        for ident in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[ident]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handler of requests to the job server.
+    """
+
+    def do_GET(self):
+        jobs = self.server.jobs
+        parts = self._parts()
+        if parts == ['status']:
+            self._reply(200, jobs.status())
+        elif len(parts) in (2, 3) and parts[0] == 'jobs':
+            try:
+                state, record = jobs.state(parts[1])
+            except KeyError:
+                self._reply(404, {'error': 'No such job.'})
+                return
+            if len(parts) == 2:
+                self._reply(200, state)
+            elif parts[2] != 'result':
+                self._reply(404, {'error': 'Not found.'})
+            elif record is None:
+                self._reply(202, state)
+            else:
+                self._reply(200, record)
+        else:
+            self._reply(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        jobs = self.server.jobs
+        if self._parts() != ['jobs']:
+            self._reply(404, {'error': 'Not found.'})
+            return
+        if jobs.stopped.is_set():
+            self._reply(503, {'error': 'Server is shutting down.'})
+            return
+        try:
+            size = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(size).decode('utf-8'))
+            state = jobs.submit(job)
+        except Exception as ex:
+            self._reply(400, {'error': describe_error(ex)})
+            return
+        self._reply(202, state,
+                    headers={'Location': '/jobs/{}'.format(state['id'])})
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return 'local'
+
+    def log_message(self, fmt, *args):
+        logger.debug('{} {}'.format(self.address_string(), fmt % args))
+
+    def _parts(self):
+        """Split the path of the request into its components.
+        """
+        path = self.path.split('?', 1)[0]
+        return [part for part in path.split('/') if part]
+
+    def _reply(self, code, body, headers=None):
+        """Send a response with a JSON body.
+        """
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_address(text):
+    """Parse the address the server should listen on.
+
+    Parameters
+    ----------
+    text : `str`
+        Either ``[host:]port`` (host defaults to ``localhost``) or the name
+        of a Unix socket, which must contain a slash, e.g. ``./executor.sock``.
+
+    Returns
+    -------
+    `str` or `tuple`
+        Name of the socket or a (host, port) pair.
+
+    Raises
+    ------
+    ValueError
+        If the address is invalid.
+    """
+    if os.sep in text:
+        return text
+    host, _, port = text.rpartition(':')
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        raise ValueError('Invalid address \'{}\'.'.format(text))
+
+
+def _source(ident):
+    """Describe where a submitted job came from.
+    """
+    return 'jobs/{}'.format(ident)
+
+
+def _unlink(path):
+    """Remove a stale Unix socket, if any.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if stat.S_ISSOCK(mode):
+        os.unlink(path)
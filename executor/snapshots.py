@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+
+
+class TemplateStore(object):
+    """Store of dataset repositories reusable as templates.
+
+    Jobs with identical input, i.e. the same mapper, ingest mode, data and
+    calibration files, require identical dataset repositories.  Files are
+    identified by their records and their sizes and modification times, so
+    a file replaced at the same location, e.g. a regenerated calibration
+    file, makes the input different.  Once such
+    a repository is built, it is stored as a template and repositories for
+    subsequent jobs are cloned from it instead of being built from scratch.
+
+    Parameters
+    ----------
+    root : `str`
+        Location of the store.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def __repr__(self):
+        tmpl = '{cls}({root!r})'
+        return tmpl.format(cls=self.__class__.__name__, root=self.root)
+
+    @staticmethod
+    def fingerprint(job):
+        """Compute the fingerprint of a job's input.
+
+        Parameters
+        ----------
+        job : `dict`
+            Job description.
+
+        Returns
+        -------
+        `str`
+            Hash of the parts of the job description which determine the
+            content of the input dataset repository, and of the sizes and
+            modification times of the files.  A file which cannot be
+            accessed is hashed as such.
+        """
+        inp = job['input']
+        content = {
+            'mapper': inp['mapper'],
+            'ingest_mode': inp.get('ingest_mode', 'copy'),
+        }
+        digest = hashlib.sha1(_dump(content))
+
+        # Records are hashed one by one, as they may come from a stream.
+        for key in ('data', 'calibs'):
+            digest.update(_dump(key))
+            for rec in job.get(key) or []:
+                digest.update(_dump(rec))
+                digest.update(_dump(_stat(rec.get('pfn'))))
+        return digest.hexdigest()
+
+    def path(self, fingerprint):
+        """Return the location of a template.
+
+        Parameters
+        ----------
+        fingerprint : `str`
+            Fingerprint of the input the template was built from.
+
+        Returns
+        -------
+        `str`
+            The location of the template.
+        """
+        return os.path.join(self.root, fingerprint)
+
+    def has(self, fingerprint):
+        """Check if a template exists.
+
+        Parameters
+        ----------
+        fingerprint : `str`
+            Fingerprint of the input the template was built from.
+
+        Returns
+        -------
+        `bool`
+            True if the template exists, False otherwise.
+        """
+        return os.path.isdir(self.path(fingerprint))
+
+
+def _stat(path):
+    """Return the size and the modification time of a file, if it exists.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+def _dump(value):
+    """Serialize a value in a canonical way.
+    """
+    text = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return text.encode('utf-8')
@@ -0,0 +1,382 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from six.moves import queue
+
+from .files import BLOCK_SIZE, MB, makedirs, spread
+from .records import origin
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximal number of files awaited at once while iterating over local copies.
+WINDOW = 1000
+
+# Interval (in seconds) at which a thread waiting for a place in the queue of
+# files to prefetch checks if prefetching was stopped.
+POLL_INTERVAL = 0.1
+
+
+class TokenBucket(object):
+    """Limit the rate of an operation, e.g. the number of bytes read.
+
+    Parameters
+    ----------
+    rate : `float`
+        Number of tokens added to the bucket per second.
+    capacity : `float`, optional
+        Maximal number of tokens in the bucket, i.e. the size of the largest
+        burst. Defaults to the number of tokens added in one second.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = self.rate if capacity is None else float(capacity)
+        self.tokens = self.capacity
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, count):
+        """Take tokens from the bucket, waiting until they are available.
+
+        Parameters
+        ----------
+        count : `float`
+            Number of tokens.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= count
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Entry(object):
+    """State of a file being prefetched.
+    """
+
+    def __init__(self):
+        self.claimed = False
+        self.path = None
+        self.error = None
+        self.done = threading.Event()
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def finish(self, path=None, error=None):
+        """Record the outcome and notify the listeners.
+        """
+        with self.lock:
+            self.path, self.error = path, error
+            self.done.set()
+            listeners, self.listeners = self.listeners, []
+        for listener in listeners:
+            listener()
+
+    def subscribe(self, listener):
+        """Call a function once the file is prefetched.
+        """
+        with self.lock:
+            if not self.done.is_set():
+                self.listeners.append(listener)
+                return
+        listener()
+
+    def result(self):
+        """Return the local path or raise the error which occurred.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+
+class Stager(object):
+    """Prefetch files from slow storage to a node-local scratch space.
+
+    Files are copied by a fixed number of threads, so the number of
+    concurrent transfers is bounded, and, optionally, the total bandwidth
+    they use is capped.  Files can be requested before, while, or after they
+    are prefetched; a file which was not scheduled for prefetching yet is
+    copied on demand.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory where the files are prefetched to.
+    workers : `int`, optional
+        Maximal number of files copied concurrently. Defaults to 4.
+    bandwidth : `float`, optional
+        Maximal total transfer rate (in MB/s). If None (default), the rate is
+        not limited.
+    """
+
+    def __init__(self, root, workers=4, bandwidth=None):
+        self.root = os.path.abspath(root)
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(bandwidth * MB) if bandwidth else None
+        self.entries = {}
+        self.sources = set()
+        self.tasks = queue.Queue(maxsize=2 * self.workers)
+        self.threads = []
+        self.feeders = []
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {'files': 0, 'bytes': 0}
+
+    def __repr__(self):
+        tmpl = '{cls}({root!r}, workers={num})'
+        return tmpl.format(cls=self.__class__.__name__, root=self.root,
+                           num=self.workers)
+
+    def start(self, pfns):
+        """Start prefetching files in the background.
+
+        Calling it again with the same collection has no effect.
+
+        Parameters
+        ----------
+        pfns : iterable of `str`
+            Physical names of the files, e.g. a list or a lazily computed
+            collection.
+        """
+        with self.lock:
+            if id(pfns) in self.sources:
+                return
+            self.sources.add(id(pfns))
+            if not self.threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self.threads.append(thread)
+        feeder = threading.Thread(target=self._feed, args=(pfns,))
+        feeder.daemon = True
+        feeder.start()
+        with self.lock:
+            self.feeders.append(feeder)
+
+    def get(self, pfn):
+        """Get the local copy of a file, waiting until it is prefetched.
+
+        Parameters
+        ----------
+        pfn : `str`
+            Physical name of the file.
+
+        Returns
+        -------
+        `str`
+            Name of the local copy.
+
+        Raises
+        ------
+        `IOError` or `OSError`
+            If the file could not be prefetched.
+        """
+        entry, new = self._claim(pfn)
+        if new:
+            self._fetch(pfn, entry)
+        entry.done.wait()
+        return entry.result()
+
+    def iter(self, pfns, window=WINDOW):
+        """Iterate over local copies of files in the order they arrive.
+
+        Only a limited number of files, the window, is awaited at once.  The
+        next file is awaited as soon as one of them arrives, so a file may
+        be yielded before files which arrived earlier but are further down
+        the list.
+
+        Parameters
+        ----------
+        pfns : iterable of `str`
+            Physical names of the files.
+        window : `int`, optional
+            Maximal number of files awaited at once. Defaults to 1000.
+
+        Yields
+        ------
+        pfn : `str`
+            Physical name of a file.
+        path : `str`
+            Name of its local copy.
+        """
+        self.start(pfns)
+        arrived = queue.Queue()
+        awaited = {}
+        seen = set()
+        names = iter(pfns)
+        exhausted = False
+        while True:
+            while not exhausted and len(awaited) < max(1, window):
+                try:
+                    pfn = next(names)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if pfn in seen:
+                    continue
+                seen.add(pfn)
+                with self.lock:
+                    entry = self.entries.setdefault(pfn, _Entry())
+                awaited[pfn] = entry
+                entry.subscribe(lambda pfn=pfn: arrived.put(pfn))
+            if not awaited:
+                return
+            pfn = arrived.get()
+            yield pfn, awaited.pop(pfn).result()
+
+    def close(self):
+        """Stop prefetching and remove the local copies.
+
+        Files scheduled for prefetching, but not being copied yet, are not
+        copied anymore.  Anyone waiting for them gets an error.
+        """
+        self.stopped.set()
+        with self.lock:
+            threads, self.threads = self.threads, []
+            feeders, self.feeders = self.feeders, []
+        for feeder in feeders:
+            feeder.join()
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                self._fetch(*task)
+        for _ in threads:
+            self.tasks.put(None)
+        for thread in threads:
+            thread.join()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def locate(self, pfn):
+        """Return the name the local copy of a file has.
+
+        See :func:`executor.files.spread` for the naming scheme.
+        """
+        return spread(self.root, pfn)
+
+    def _claim(self, pfn):
+        """Get the entry of a file, marking it as claimed by the caller.
+
+        Returns
+        -------
+        entry : `_Entry`
+            The entry.
+        new : `bool`
+            True if nobody claimed the file before, so the caller must
+            fetch it.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(pfn, _Entry())
+            new = not entry.claimed
+            entry.claimed = True
+        return entry, new
+
+    def _feed(self, pfns):
+        """Schedule files for prefetching.
+        """
+        try:
+            for pfn in pfns:
+                if self.stopped.is_set():
+                    return
+                entry, new = self._claim(pfn)
+                if new:
+                    self._schedule(pfn, entry)
+        except Exception:
+            logger.exception('Cannot schedule files for prefetching.')
+
+    def _schedule(self, pfn, entry):
+        """Put a file in the queue, unless prefetching is stopped meanwhile.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.tasks.put((pfn, entry), timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            return
+        self._fetch(pfn, entry)
+
+    def _work(self):
+        """Prefetch scheduled files until stopped.
+        """
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            self._fetch(*task)
+
+    def _fetch(self, pfn, entry):
+        """Copy a file to the scratch space.
+        """
+        if self.stopped.is_set():
+            entry.finish(error=IOError('Prefetching stopped.'))
+            return
+        dst = self.locate(pfn)
+        start = time.time()
+        try:
+            makedirs(os.path.dirname(dst))
+            size = 0
+            with open(pfn, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                while True:
+                    block = fsrc.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    if self.bucket is not None:
+                        self.bucket.consume(len(block))
+                    fdst.write(block)
+                    size += len(block)
+            shutil.copystat(pfn, dst)
+        except (IOError, OSError) as ex:
+            logger.error('Cannot prefetch \'{}\': {}'.format(pfn, ex))
+            entry.finish(error=ex)
+            return
+        duration = time.time() - start
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+        logger.debug('Prefetched \'{}\' to \'{}\', {:.1f} MB in {:.3f} s.'
+                     .format(pfn, dst, size / MB, duration))
+        entry.finish(path=dst)
+
+
+class Staged(object):
+    """Local copies of files, in the order they arrive.
+
+    Parameters
+    ----------
+    stager : `Stager`
+        Stager prefetching the files.
+    pfns : iterable of `str`
+        Physical names of the files.
+    window : `int`, optional
+        Maximal number of files awaited at once, see :meth:`Stager.iter`.
+        Defaults to 1000.
+    """
+
+    def __init__(self, stager, pfns, window=WINDOW):
+        self.stager = stager
+        self.pfns = pfns
+        self.window = window
+
+    def __repr__(self):
+        tmpl = '{cls}({stager!r}, {pfns!r})'
+        return tmpl.format(cls=self.__class__.__name__, stager=self.stager,
+                           pfns=self.pfns)
+
+    def __str__(self):
+        return '{} (prefetched)'.format(origin(self.pfns))
+
+    def __iter__(self):
+        for _, path in self.stager.iter(self.pfns, window=self.window):
+            yield path
@@ -0,0 +1,241 @@
+import logging
+import os
+import select
+import sys
+import threading
+import traceback
+
+from six.moves import queue
+
+from .processes import fork_context
+
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """Pool of pre-warmed processes running LSST tasks in isolation.
+
+    Workers are forked from the executor once the tasks are imported, so
+    they start with the LSST Stack already loaded.  For each task to run,
+    a worker forks a child process which sets up its own arguments and
+    environment and runs the task.  Hence, tasks can run concurrently,
+    neither of them can affect the executor or the others, and a crashing
+    task does not bring down the whole run.  The task's standard output and
+    error are streamed back to the executor, its exit status and resource
+    usage are reported once it finishes.
+
+    Parameters
+    ----------
+    size : `int`, optional
+        Number of worker processes, i.e. the maximal number of tasks running
+        at the same time. Defaults to 2.
+    """
+
+    def __init__(self, size=2):
+        self.size = max(1, size)
+        self.idle = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        tmpl = '{cls}(size={size})'
+        return tmpl.format(cls=self.__class__.__name__, size=self.size)
+
+    def start(self):
+        """Start the worker processes.
+
+        Calling it again has no effect. Call it from the main thread, before
+        starting any other threads, so the workers are forked from a process
+        in a consistent state.
+        """
+        with self.lock:
+            if self.workers:
+                return
+            for _ in range(self.size):
+                worker = self._spawn()
+                self.workers.append(worker)
+                self.idle.put(worker)
+        logger.info('Started {} worker process(es).'.format(self.size))
+
+    def run(self, task, args, use_argv=False, env=None):
+        """Run a task in a worker process, waiting until it finishes.
+
+        Parameters
+        ----------
+        task : CmdLineTask
+            The LSST task.
+        args : `list` of `str`
+            Task's arguments.
+        use_argv : `bool`, optional
+            If True, the task reads its arguments from `sys.argv`, otherwise
+            they are passed to its `parseAndRun()` method. Defaults to False.
+        env : `dict`, optional
+            Environment variables to set for the task.
+
+        Returns
+        -------
+        `dict`
+            Exit status of the task and resources it used: user and system
+            CPU time (in seconds) and the peak resident set size (in bytes).
+
+        Raises
+        ------
+        RuntimeError
+            If the task failed or the worker running it died.
+        """
+        self.start()
+        name = getattr(task, '_DefaultName', task.__name__)
+        worker = self.idle.get()
+        try:
+            worker.conn.send((task, list(args), use_argv, dict(env or {})))
+            while True:
+                msg = worker.conn.recv()
+                if msg[0] == 'exit':
+                    break
+                _, stream, data = msg
+                out = sys.stdout if stream == 'stdout' else sys.stderr
+                getattr(out, 'buffer', out).write(data)
+                out.flush()
+        except (EOFError, IOError, OSError):
+            worker = self._replace(worker)
+            msg = 'Worker running task \'{}\' died.'.format(name)
+            logger.error(msg)
+            raise RuntimeError(msg)
+        finally:
+            self.idle.put(worker)
+
+        _, status, usage = msg
+        result = dict(usage, status=status)
+        logger.info('Task \'{name}\' exited with status {status}: user '
+                    '{utime:.2f} s, system {stime:.2f} s, max RSS '
+                    '{rss:.1f} MB.'.format(name=name, rss=usage['maxrss'] /
+                                           1024.0 ** 2, **result))
+        if status != 0:
+            msg = 'Task \'{}\' failed with exit status {}.'.format(name,
+                                                                   status)
+            logger.error(msg)
+            raise RuntimeError(msg)
+        return result
+
+    def close(self):
+        """Stop the worker processes.
+        """
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (IOError, OSError):
+                pass
+            worker.conn.close()
+        for worker in workers:
+            worker.join()
+
+    def _spawn(self):
+        """Fork a new worker process.
+        """
+        ctx = fork_context()
+        conn, child = ctx.Pipe()
+        worker = ctx.Process(target=_serve, args=(child,))
+        worker.daemon = True
+        worker.start()
+        child.close()
+        worker.conn = conn
+        return worker
+
+    def _replace(self, worker):
+        """Replace a dead worker with a new one.
+        """
+        worker.conn.close()
+        worker.join()
+        new = self._spawn()
+        with self.lock:
+            if worker in self.workers:
+                self.workers[self.workers.index(worker)] = new
+        return new
+
+
+def _serve(conn):
+    """Run tasks requested by the executor until told to stop.
+
+    Each task is run in a child process.  Its output is sent to the executor
+    as it is produced, followed by its exit status and resource usage.
+    """
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        task, args, use_argv, env = request
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            os.close(out_r)
+            os.close(err_r)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os._exit(_run(task, args, use_argv, env))
+        os.close(out_w)
+        os.close(err_w)
+
+        streams = {out_r: 'stdout', err_r: 'stderr'}
+        while streams:
+            readable, _, _ = select.select(list(streams), [], [])
+            for fd in readable:
+                data = os.read(fd, 64 * 1024)
+                if not data:
+                    os.close(fd)
+                    del streams[fd]
+                    continue
+                conn.send(('output', streams[fd], data))
+
+        _, status, usage = os.wait4(pid, 0)
+        if os.WIFSIGNALED(status):
+            code = -os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        conn.send(('exit', code, {
+            'utime': usage.ru_utime,
+            'stime': usage.ru_stime,
+            'maxrss': usage.ru_maxrss * 1024,
+        }))
+
+
+def _run(task, args, use_argv, env):
+    """Run a task in the current process.
+
+    Returns
+    -------
+    `int`
+        Exit status.
+    """
+    os.environ.update(env)
+    code = 0
+    try:
+        if use_argv:
+            sys.argv = [getattr(task, '_DefaultName', task.__name__)] + args
+            task.parseAndRun()
+        else:
+            task.parseAndRun(args=args)
+    except SystemExit as ex:
+        if ex.code is None or isinstance(ex.code, int):
+            code = ex.code or 0
+        else:
+            sys.stderr.write('{}\n'.format(ex.code))
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+    return code
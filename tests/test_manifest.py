@@ -0,0 +1,130 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from executor.manifest import Manifest
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'repo')
+        os.mkdir(self.root)
+        self.manifest = Manifest(self.root)
+        self.src = os.path.join(self.tmpdir, 'raw.fits')
+        with open(self.src, 'w') as f:
+            f.write('content')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def entry(self, dst):
+        digest = hashlib.sha1(b'content')
+        return Manifest.entry(self.src, dst, digest)
+
+    def test_missing_manifest(self):
+        self.assertFalse(self.manifest.exists())
+        self.assertEqual(self.manifest.lookup([self.path('a')]), {})
+        self.assertEqual(self.manifest.locate([self.src]), {})
+        self.assertEqual(self.manifest.find('0', 'sha1'), [])
+        self.assertEqual(self.manifest.incomplete(), [])
+        self.assertFalse(self.manifest.exists())
+
+    def test_expected_files_are_pending(self):
+        self.manifest.expect([(self.src, self.path('a')),
+                              (self.src, self.path('b'))])
+        self.assertTrue(self.manifest.exists())
+        self.assertEqual(self.manifest.incomplete(),
+                         [self.path('a'), self.path('b')])
+        record = self.manifest.lookup([self.path('a')])[self.path('a')]
+        self.assertEqual(record['pfn'], self.src)
+        self.assertEqual(record['state'], 'pending')
+        self.assertIsNone(record['checksum'])
+        self.assertEqual(self.manifest.locate([self.src]), {})
+
+    def test_confirmed_files_are_done(self):
+        self.manifest.expect([(self.src, self.path('a')),
+                              (self.src, self.path('b'))])
+        self.manifest.confirm([self.entry(self.path('a'))])
+        self.assertEqual(self.manifest.incomplete(), [self.path('b')])
+
+        record = self.manifest.lookup([self.path('a')])[self.path('a')]
+        st = os.stat(self.src)
+        self.assertEqual(record['state'], 'done')
+        self.assertEqual(record['size'], st.st_size)
+        self.assertEqual(record['mtime'], st.st_mtime)
+        self.assertEqual(record['checksum'],
+                         hashlib.sha1(b'content').hexdigest())
+        self.assertEqual(record['algorithm'], 'sha1')
+
+        digest = hashlib.sha1(b'content').hexdigest()
+        self.assertEqual(self.manifest.find(digest, 'sha1'), [self.path('a')])
+        self.assertEqual(self.manifest.find(digest, 'md5'), [])
+        self.assertEqual(self.manifest.locate([self.src]),
+                         {self.src: self.path('a')})
+
+    def test_entry_accepts_checksum(self):
+        entry = Manifest.entry(self.src, self.path('a'), ('abc', 'blake2b'))
+        self.assertEqual(entry[0], self.path('a'))
+        self.assertEqual(entry[3:], ('abc', 'blake2b'))
+
+    def test_expect_replaces_earlier_records(self):
+        self.manifest.expect([(self.src, self.path('a'))])
+        self.manifest.confirm([self.entry(self.path('a'))])
+        self.manifest.expect([('other.fits', self.path('a'))])
+        record = self.manifest.lookup([self.path('a')])[self.path('a')]
+        self.assertEqual(record['pfn'], 'other.fits')
+        self.assertEqual(record['state'], 'pending')
+
+    def test_staged_files_are_relocated(self):
+        staged = os.path.join(self.root, 'scratch', 'a')
+        self.manifest.expect([(self.src, staged)])
+        self.manifest.confirm([self.entry(staged)], state='staged')
+        self.assertEqual(self.manifest.locate([self.src]), {})
+
+        moves = [(staged, self.path('a')),
+                 (os.path.join(self.root, 'scratch', 'b'), self.path('b'))]
+        self.assertEqual(self.manifest.relocate(moves), 1)
+        self.assertEqual(self.manifest.lookup([staged]), {})
+        record = self.manifest.lookup([self.path('a')])[self.path('a')]
+        self.assertEqual(record['state'], 'done')
+        self.assertEqual(self.manifest.locate([self.src]),
+                         {self.src: self.path('a')})
+
+    def test_only_staged_files_are_relocated(self):
+        self.manifest.expect([(self.src, self.path('a'))])
+        self.assertEqual(
+            self.manifest.relocate([(self.path('a'), self.path('b'))]), 0)
+        self.manifest.confirm([self.entry(self.path('a'))])
+        self.assertEqual(
+            self.manifest.relocate([(self.path('a'), self.path('b'))]), 0)
+        self.assertEqual(list(self.manifest.lookup([self.path('a')])),
+                         [self.path('a')])
+
+    def test_first_location_is_located(self):
+        dests = [self.path(name) for name in 'cab']
+        self.manifest.expect([(self.src, dst) for dst in dests])
+        self.manifest.confirm([self.entry(dst) for dst in dests])
+        self.assertEqual(self.manifest.locate([self.src, self.src]),
+                         {self.src: self.path('a')})
+
+    def test_locations_are_relative(self):
+        self.manifest.expect([(self.src, self.path('a'))])
+        self.manifest.confirm([self.entry(self.path('a'))])
+        clone = os.path.join(self.tmpdir, 'clone')
+        shutil.copytree(self.root, clone)
+        manifest = Manifest(clone)
+        self.assertEqual(manifest.locate([self.src]),
+                         {self.src: os.path.join(clone, 'a')})
+        self.assertIn(os.path.join(clone, 'a'),
+                      manifest.lookup([os.path.join(clone, 'a')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from executor.registry import merge
+
+
+SCHEMA = [
+    'CREATE TABLE raw (id INTEGER PRIMARY KEY, visit INTEGER, ccd INTEGER, '
+    'UNIQUE (visit, ccd))',
+    'CREATE TABLE raw_visit (visit INTEGER, filter TEXT, UNIQUE (visit))',
+]
+
+
+class MergeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dst = os.path.join(self.tmpdir, 'dst.sqlite3')
+        self.src = os.path.join(self.tmpdir, 'src.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create(self, path, statements):
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                for sql in statements:
+                    conn.execute(sql)
+        finally:
+            conn.close()
+
+    def fetch(self, path, query):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(query).fetchall()
+        finally:
+            conn.close()
+
+    def test_rows_get_new_identifiers(self):
+        self.create(self.dst, SCHEMA + [
+            'INSERT INTO raw VALUES (1, 1, 1)',
+            'INSERT INTO raw VALUES (2, 1, 2)',
+        ])
+        self.create(self.src, SCHEMA + [
+            'INSERT INTO raw VALUES (1, 2, 1)',
+            'INSERT INTO raw VALUES (2, 2, 2)',
+        ])
+        self.assertEqual(merge(self.dst, self.src), 2)
+        rows = self.fetch(self.dst, 'SELECT id, visit, ccd FROM raw '
+                                    'ORDER BY visit, ccd')
+        self.assertEqual([row[1:] for row in rows],
+                         [(1, 1), (1, 2), (2, 1), (2, 2)])
+        self.assertEqual(len(set(row[0] for row in rows)), 4)
+        self.assertEqual(rows[:2], [(1, 1, 1), (2, 1, 2)])
+
+    def test_duplicates_are_ignored(self):
+        self.create(self.dst, SCHEMA + [
+            'INSERT INTO raw VALUES (1, 1, 1)',
+            'INSERT INTO raw_visit VALUES (1, \'g\')',
+        ])
+        self.create(self.src, SCHEMA + [
+            'INSERT INTO raw VALUES (1, 1, 1)',
+            'INSERT INTO raw VALUES (2, 1, 2)',
+            'INSERT INTO raw_visit VALUES (1, \'g\')',
+        ])
+        self.assertEqual(merge(self.dst, self.src), 1)
+        self.assertEqual(self.fetch(self.dst, 'SELECT COUNT(*) FROM raw'),
+                         [(2,)])
+        self.assertEqual(self.fetch(self.dst, 'SELECT * FROM raw_visit'),
+                         [(1, 'g')])
+
+    def test_missing_tables_and_indices_are_created(self):
+        self.create(self.dst, SCHEMA[:1])
+        self.create(self.src, SCHEMA + [
+            'CREATE INDEX raw_visit_filter ON raw_visit (filter)',
+            'INSERT INTO raw_visit VALUES (1, \'g\')',
+            'INSERT INTO raw_visit VALUES (2, \'r\')',
+        ])
+        self.assertEqual(merge(self.dst, self.src), 2)
+        self.assertEqual(
+            self.fetch(self.dst, 'SELECT * FROM raw_visit ORDER BY visit'),
+            [(1, 'g'), (2, 'r')])
+        indices = self.fetch(self.dst, 'SELECT name FROM sqlite_master '
+                                       'WHERE type = \'index\' AND '
+                                       'name NOT LIKE \'sqlite_%\'')
+        self.assertEqual(indices, [('raw_visit_filter',)])
+
+    def test_merging_many_registries(self):
+        self.create(self.dst, SCHEMA)
+        for visit in range(3):
+            path = os.path.join(self.tmpdir, '{}.sqlite3'.format(visit))
+            self.create(path, SCHEMA + [
+                'INSERT INTO raw VALUES ({}, {}, {})'.format(ccd, visit, ccd)
+                for ccd in range(1, 4)])
+            self.assertEqual(merge(self.dst, path), 3)
+        self.assertEqual(
+            self.fetch(self.dst, 'SELECT COUNT(DISTINCT id) FROM raw'),
+            [(9,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
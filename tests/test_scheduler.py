@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from executor.commands import Command
+from executor.journal import Journal
+from executor.scheduler import Scheduler
+
+
+class Record(Command):
+    """Command appending its name to a log when executed.
+    """
+
+    resumable = True
+
+    def __init__(self, name, log, fail=False, idempotent=True):
+        self.name = name
+        self.log = log
+        self.fail = fail
+        self.idempotent = idempotent
+
+    def __repr__(self):
+        return '{cls}({name!r})'.format(cls=self.__class__.__name__,
+                                        name=self.name)
+
+    def execute(self):
+        self.log.append(self.name)
+        if self.fail:
+            raise RuntimeError('{} failed'.format(self.name))
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal')
+        self.log = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def journal(self, reset=False):
+        return Journal(self.path, 'input', reset=reset)
+
+    def test_single_worker_keeps_order(self):
+        cmds = [Record(name, self.log) for name in 'abcd']
+        Scheduler().run(cmds)
+        self.assertEqual(self.log, list('abcd'))
+
+    def test_dependencies_come_first(self):
+        a, b, c = [Record(name, self.log) for name in 'abc']
+        a.after(c)
+        b.after(a)
+        Scheduler().run([a, b, c])
+        self.assertEqual(self.log, ['c', 'a', 'b'])
+
+    def test_missing_dependencies_are_satisfied(self):
+        a, b = Record('a', self.log), Record('b', self.log)
+        b.after(a)
+        Scheduler().run([b])
+        self.assertEqual(self.log, ['b'])
+
+    def test_unsatisfiable_dependencies(self):
+        a, b = Record('a', self.log), Record('b', self.log)
+        a.after(b)
+        b.after(a)
+        with self.assertRaises(ValueError):
+            Scheduler().run([a, b])
+        self.assertEqual(self.log, [])
+
+    def test_failure_stops_new_commands(self):
+        cmds = [Record('a', self.log), Record('b', self.log, fail=True),
+                Record('c', self.log)]
+        with self.assertRaises(RuntimeError):
+            Scheduler().run(cmds)
+        self.assertEqual(self.log, ['a', 'b'])
+
+    def test_concurrent_commands_complete(self):
+        a, b, c, d = [Record(name, self.log) for name in 'abcd']
+        d.after(a, b, c)
+        Scheduler(workers=3).run([a, b, c, d])
+        self.assertEqual(sorted(self.log[:3]), list('abc'))
+        self.assertEqual(self.log[3], 'd')
+
+    def test_completed_commands_are_skipped(self):
+        a, b = Record('a', self.log), Record('b', self.log)
+        b.after(a)
+        Scheduler(journal=self.journal()).run([a, b])
+        self.assertEqual(self.log, ['a', 'b'])
+
+        del self.log[:]
+        a, b, c = [Record(name, self.log) for name in 'abc']
+        b.after(a)
+        c.after(b)
+        Scheduler(journal=self.journal()).run([a, b, c])
+        self.assertEqual(self.log, ['c'])
+
+    def test_commands_after_rerun_ones_are_not_skipped(self):
+        Scheduler(journal=self.journal()).run([Record('b', self.log)])
+
+        del self.log[:]
+        a, b = Record('a', self.log), Record('b', self.log)
+        b.after(a)
+        Scheduler(journal=self.journal()).run([a, b])
+        self.assertEqual(self.log, ['a', 'b'])
+
+    def test_commands_not_resumable_are_rerun(self):
+        a = Record('a', self.log)
+        a.resumable = False
+        Scheduler(journal=self.journal()).run([a])
+        Scheduler(journal=self.journal()).run([a])
+        self.assertEqual(self.log, ['a', 'a'])
+        self.assertEqual(self.journal().completed, set())
+
+    def test_failed_commands_are_rerun(self):
+        a = Record('a', self.log, fail=True)
+        with self.assertRaises(RuntimeError):
+            Scheduler(journal=self.journal()).run([a])
+        a.fail = False
+        Scheduler(journal=self.journal()).run([a])
+        self.assertEqual(self.log, ['a', 'a'])
+
+    def test_interrupted_commands_are_listed(self):
+        a = Record('a', self.log, idempotent=False)
+        b = Record('b', self.log, fail=True, idempotent=False)
+        c = Record('c', self.log, fail=True)
+        Scheduler(journal=self.journal()).run([a])
+        for cmd in (b, c):
+            with self.assertRaises(RuntimeError):
+                Scheduler(journal=self.journal()).run([cmd])
+        journal = self.journal()
+        self.assertEqual(journal.interrupted(), ["Record('b')"])
+        self.assertTrue(journal.has(a))
+        self.assertFalse(journal.has(b))
+
+    def test_journal_of_other_input_is_discarded(self):
+        a = Record('a', self.log)
+        Scheduler(journal=self.journal()).run([a])
+        journal = Journal(self.path, 'other')
+        Scheduler(journal=journal).run([a])
+        self.assertEqual(self.log, ['a', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()